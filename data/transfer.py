@@ -1,115 +1,81 @@
 import asyncio
 import aiohttp
-from datetime import datetime
-from database.models import Drug
-from database.db import async_session
+from utils.catalog_sync import CatalogSync, SyncBusyError
+from utils.config import CATALOG_SYNC_PAGE_SIZE
 
 # API endpoint for fetching drug data
 API_URL = "https://api.pharmagency.uz/drug-catalog-api/v2/referent-price/all"
 
+# Attempts per page before the run is given up
+PAGE_ATTEMPTS = 3
 
-async def fetch_and_create_drugs(page_size=100):
+
+async def fetch_page(http_session, page, page_size):
+    """
+    Fetch one page of the API.
+
+    Returns:
+        (content, last): rows of the page and whether it is the last one
+
+    Raises:
+        RuntimeError: if the page could not be fetched after PAGE_ATTEMPTS tries
     """
-    Fetch drugs from API and save them to the database.
-    
+    for attempt in range(1, PAGE_ATTEMPTS + 1):
+        try:
+            async with http_session.get(API_URL, params={"page": page, "size": page_size}) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f"Invalid server response: {resp.status}")
+                data = await resp.json()
+            result = data.get("result")
+            # Validate response structure
+            if not result or "content" not in result:
+                raise RuntimeError("No content found in response")
+            return result["content"], result.get("last", True)
+        except (aiohttp.ClientError, asyncio.TimeoutError, RuntimeError) as e:
+            if attempt == PAGE_ATTEMPTS:
+                raise RuntimeError(f"Page {page}: {e}") from e
+            print(f"⚠️ Page {page}, attempt {attempt}: {e}")
+            await asyncio.sleep(2 * attempt)
+
+
+async def sync_catalog(page_size=CATALOG_SYNC_PAGE_SIZE):
+    """
+    Fetch the whole catalog from the API and write only what changed
+    (see utils/catalog_sync.py).
+
+    Drugs missing from the API are tombstoned only when every page was
+    read; a failed run is recorded and changes nothing else.
+
     Args:
         page_size (int): Number of items to fetch per page
     """
     page = 0
-    total_added = 0
+    timeout = aiohttp.ClientTimeout(total=60)
 
-    async with aiohttp.ClientSession() as http_session:
-        async with async_session() as db:
+    try:
+        async with aiohttp.ClientSession(timeout=timeout) as http_session, CatalogSync() as sync:
             while True:
                 print(f"📦 Fetching page {page}...")
+                content, last = await fetch_page(http_session, page, page_size)
+                await sync.apply_page(content)
 
-                try:
-                    # Make GET request to API
-                    async with http_session.get(
-                            f"{API_URL}?page={page}&size={page_size}"
-                    ) as resp:
-                        # Check if response is successful
-                        if resp.status != 200:
-                            print(f"❌ Invalid server response: {resp.status}")
-                            break
-
-                        data = await resp.json()
-                        result = data.get("result")
-
-                        # Validate response structure
-                        if not result or "content" not in result:
-                            print("⚠️ No content found in response.")
-                            break
-
-                        content = result["content"]
-
-                        # Check if there's data to process
-                        if not content:
-                            print("✅ No more data found, stopping.")
-                            break
-
-                        drugs = []
-
-                        # Process each drug item
-                        for item in content:
-                            # Convert prescription type: 'Retsipli' -> True, 'Retsiptsiz' -> False
-                            prescription_value = item.get("prescription")
-                            is_prescription = (
-                                True if prescription_value == "Retsipli" else False
-                            )
-
-                            # Convert expiration_date to datetime.date format
-                            raw_date = item.get("priceDate")
-                            expiration_date = None
-                            if raw_date:
-                                try:
-                                    expiration_date = datetime.fromisoformat(
-                                        raw_date
-                                    ).date()
-                                except Exception:
-                                    expiration_date = None
-
-                            # Create Drug object
-                            drug = Drug(
-                                drug_id=item.get("drugId"),
-                                name=item.get("name"),
-                                description=item.get("trademark"),
-                                manufacturer=item.get("manufacturer"),
-                                dosage_form=None,
-                                strength=None,
-                                price=item.get("priceBase") or item.get("price"),
-                                expiration_date=expiration_date,
-                                prescription_required=is_prescription,
-                                category=item.get("currency"),
-                                image_url=item.get("imgUrl"),
-                                thumbnail_url=None,
-                            )
-                            drugs.append(drug)
-
-                        # Save all drugs to database
-                        db.add_all(drugs)
-                        await db.commit()
-                        total_added += len(drugs)
-
-                        print(
-                            f"✅ {len(drugs)} drugs added to database "
-                            f"(total: {total_added})."
-                        )
-
-                        # Check if this is the last page
-                        if result.get("last", True):
-                            print("🏁 Loading completed.")
-                            break
-
-                        page += 1
-
-                except Exception as e:
-                    print("❌ Error occurred:", e)
-                    await db.rollback()
+                # An empty page also ends the catalog
+                if last or not content:
                     break
+                page += 1
+
+            report = await sync.finish(complete=True)
+    except SyncBusyError:
+        print("⏳ Another catalog sync is running.")
+        return None
 
-    print(f"🎉 Total of {total_added} drugs added to database.")
+    print(
+        f"🎉 Sync #{sync.run_id}: {report.fetched} fetched, {report.inserted} new, "
+        f"{report.updated} changed, {report.restored} restored, {report.deleted} removed, "
+        f"{report.unchanged} unchanged ({report.duration_ms / 1000:.1f} s)."
+    )
+    return report
 
 
 if __name__ == "__main__":
-    asyncio.run(fetch_and_create_drugs(page_size=50))
+    asyncio.run(sync_catalog())
@@ -33,9 +33,9 @@ async def get_session() -> AsyncSession: # type: ignore
 
 # Database initialization
 async def init_db():
-    """Initialize database tables"""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+    """Bring the database schema up to date (see database/migrations.py)"""
+    from .migrations import migrate
+    await migrate()
 
 async def close_db():
     """Close database connection"""
@@ -0,0 +1,280 @@
+"""
+Schema versioning.
+
+``schema_version`` records which migrations were applied. At startup the bot
+reads the current version with one query and only runs migrations when it
+is behind; ``python migrate.py`` does the same explicitly.
+
+Rules for migrations:
+- append new ones at the end with the next version number, never edit old ones;
+- the baseline creates every table of the current models on an empty
+  database, so later migrations must be idempotent (``IF NOT EXISTS``,
+  ``checkfirst=True``);
+- each migration runs in its own transaction together with its version row;
+- migrations spell out their DDL and never iterate a model's current index
+  list: a later index on a column added by a later migration would break
+  every older database at startup.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import delete, insert, text
+from sqlalchemy.exc import ProgrammingError
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .db import Base, engine
+from . import models
+
+logger = logging.getLogger(__name__)
+
+# Serializes migrations of several bot instances starting at once
+MIGRATION_LOCK_KEY = 7_340_033
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[AsyncConnection], Awaitable[None]]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str):
+    """
+    Register a migration function.
+    """
+    def register(func):
+        assert not MIGRATIONS or MIGRATIONS[-1].version < version, "migrations must be in order"
+        MIGRATIONS.append(Migration(version, name, func))
+        return func
+    return register
+
+
+# ---------- migrations ----------
+
+@migration(1, "baseline")
+async def _baseline(conn: AsyncConnection):
+    # Creates missing tables (with their indexes) and sequences; existing ones are left alone
+    await conn.run_sync(Base.metadata.create_all)
+
+
+@migration(2, "orders list indexes and pickup code sequence")
+async def _orders_indexes(conn: AsyncConnection):
+    # Frozen DDL: the Order model gained indexes on later columns since
+    await conn.execute(text("CREATE SEQUENCE IF NOT EXISTS pickup_code_seq"))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_orders_pharmacy_status_created "
+        "ON orders (pharmacy_id, status, created_at DESC, id DESC)"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_orders_pharmacy_created "
+        "ON orders (pharmacy_id, created_at DESC, id DESC)"
+    ))
+    await conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uix_orders_active_pickup_code "
+        "ON orders (pickup_code) WHERE status IN ('pending', 'confirmed', 'ready')"
+    ))
+
+
+@migration(3, "users blocked flag")
+async def _users_blocked(conn: AsyncConnection):
+    await conn.execute(text(
+        "ALTER TABLE users "
+        "ADD COLUMN IF NOT EXISTS is_blocked boolean NOT NULL DEFAULT false, "
+        "ADD COLUMN IF NOT EXISTS blocked_at timestamptz"
+    ))
+
+
+@migration(4, "backfill pharmacy daily statistics")
+async def _backfill_stats(conn: AsyncConnection):
+    from utils.stats_rollup import COUNTERS, _raw_rollup
+
+    stats = models.PharmacyDailyStats
+    await conn.execute(delete(stats))
+    await conn.execute(insert(stats).from_select(["pharmacy_id", "day", *COUNTERS], _raw_rollup()))
+
+
+@migration(5, "shared FSM storage table")
+async def _fsm_state(conn: AsyncConnection):
+    await conn.run_sync(lambda sync_conn: models.FsmState.__table__.create(sync_conn, checkfirst=True))
+
+
+@migration(6, "orders idempotency key")
+async def _orders_idempotency_key(conn: AsyncConnection):
+    await conn.execute(text(
+        "ALTER TABLE orders ADD COLUMN IF NOT EXISTS idempotency_key varchar(64)"
+    ))
+    await conn.execute(text(
+        "CREATE UNIQUE INDEX IF NOT EXISTS uix_orders_idempotency_key ON orders (idempotency_key)"
+    ))
+
+
+@migration(7, "users search indexes")
+async def _users_search_indexes(conn: AsyncConnection):
+    # Expressions must match utils/user_search.py exactly to be used by the planner
+    await conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_fullname_trgm "
+        "ON users USING gin (lower(fullname) gin_trgm_ops)"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+        "ON users USING gin (lower(username) gin_trgm_ops)"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_users_phone_digits_rev "
+        "ON users ((reverse(regexp_replace(phone_number, '\\D', '', 'g')) COLLATE \"C\"))"
+    ))
+
+
+@migration(8, "catalog sync state and drug tombstones")
+async def _catalog_sync(conn: AsyncConnection):
+    await conn.execute(text(
+        "ALTER TABLE drugs "
+        "ADD COLUMN IF NOT EXISTS content_hash varchar(32), "
+        "ADD COLUMN IF NOT EXISTS deleted_at timestamptz"
+    ))
+
+    def create(sync_conn):
+        models.CatalogSyncRun.__table__.create(sync_conn, checkfirst=True)
+        models.CatalogChange.__table__.create(sync_conn, checkfirst=True)
+    await conn.run_sync(create)
+
+
+@migration(9, "admin order console indexes and audit log")
+async def _admin_orders(conn: AsyncConnection):
+    await conn.run_sync(lambda sync_conn: models.AdminAuditLog.__table__.create(sync_conn, checkfirst=True))
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_created ON orders (created_at DESC, id DESC)"))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_orders_status_created ON orders (status, created_at DESC, id DESC)"
+    ))
+    await conn.execute(text("CREATE INDEX IF NOT EXISTS ix_orders_pickup_code ON orders (pickup_code)"))
+    # Expression must match utils/order_search.py exactly to be used by the planner
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_orders_phone_digits_rev "
+        "ON orders ((reverse(regexp_replace(phone, '\\D', '', 'g')) COLLATE \"C\"))"
+    ))
+
+
+@migration(10, "applications and comments stored at submission")
+async def _moderation_rows(conn: AsyncConnection):
+    await conn.execute(text(
+        "ALTER TABLE applications "
+        "ADD COLUMN IF NOT EXISTS user_id bigint, "
+        "ADD COLUMN IF NOT EXISTS username varchar, "
+        "ADD COLUMN IF NOT EXISTS license_photo_id varchar, "
+        "ADD COLUMN IF NOT EXISTS decided_at timestamptz, "
+        "ADD COLUMN IF NOT EXISTS decided_by bigint"
+    ))
+    await conn.execute(text(
+        "ALTER TABLE comments "
+        "ADD COLUMN IF NOT EXISTS decided_at timestamptz, "
+        "ADD COLUMN IF NOT EXISTS decided_by bigint"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_applications_pending ON applications (id) WHERE approved IS NULL"
+    ))
+    await conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_comments_pending ON comments (id) WHERE approved IS NULL"
+    ))
+
+
+@migration(11, "moderation claims and digests")
+async def _moderation_claims(conn: AsyncConnection):
+    for table in ("applications", "comments"):
+        await conn.execute(text(
+            f"ALTER TABLE {table} "
+            "ADD COLUMN IF NOT EXISTS claimed_by bigint, "
+            "ADD COLUMN IF NOT EXISTS claimed_until timestamptz, "
+            "ADD COLUMN IF NOT EXISTS digested_at timestamptz"
+        ))
+        # Admins were sent these one by one already
+        await conn.execute(text(f"UPDATE {table} SET digested_at = now() WHERE digested_at IS NULL"))
+
+
+# ---------- runner ----------
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+async def current_version(conn: Optional[AsyncConnection] = None) -> int:
+    """
+    Highest applied migration, 0 for a database that was never migrated.
+    """
+    if conn is None:
+        async with engine.connect() as conn:
+            return await current_version(conn)
+    try:
+        version = await conn.scalar(text("SELECT max(version) FROM schema_version"))
+    except ProgrammingError:
+        # No schema_version table yet
+        await conn.rollback()
+        return 0
+    await conn.commit()
+    return version or 0
+
+
+async def migrate() -> List[Migration]:
+    """
+    Apply pending migrations.
+
+    Returns:
+        The migrations that were applied
+    """
+    applied = []
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT pg_advisory_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+        await conn.commit()
+        try:
+            await conn.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_version ("
+                " version integer PRIMARY KEY,"
+                " name text NOT NULL,"
+                " applied_at timestamptz NOT NULL DEFAULT now())"
+            ))
+            await conn.commit()
+
+            # Re-read under the lock: another instance may have migrated meanwhile
+            version = await current_version(conn)
+            for step in MIGRATIONS:
+                if step.version <= version:
+                    continue
+                logger.info(f"Applying migration {step.version}: {step.name}")
+                async with conn.begin():
+                    await step.apply(conn)
+                    await conn.execute(
+                        text("INSERT INTO schema_version (version, name) VALUES (:version, :name)"),
+                        {"version": step.version, "name": step.name},
+                    )
+                applied.append(step)
+        finally:
+            await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": MIGRATION_LOCK_KEY})
+            await conn.commit()
+    return applied
+
+
+async def ensure_schema(auto_migrate: bool = True):
+    """
+    Startup check: one query when the schema is current.
+
+    Raises:
+        RuntimeError: if migrations are pending and ``auto_migrate`` is off
+    """
+    version = await current_version()
+    if version == LATEST_VERSION:
+        return
+    if version > LATEST_VERSION:
+        logger.warning(
+            f"Database schema version {version} is newer than this code ({LATEST_VERSION})"
+        )
+        return
+    if not auto_migrate:
+        raise RuntimeError(
+            f"Database schema is at version {version}, code needs {LATEST_VERSION}. "
+            f"Run: python migrate.py"
+        )
+    applied = await migrate()
+    logger.info(f"Database migrated to version {LATEST_VERSION} ({len(applied)} migrations)")
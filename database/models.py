@@ -10,14 +10,25 @@ from sqlalchemy import (
     ForeignKey, 
     Float,  # Added for coordinates
     UniqueConstraint,
+    Index,
+    Sequence,
     func,
+    text,
     Enum
 )
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import relationship
 from .db import Base
 import enum
 
 
+# Orders a customer can still pick up; pickup codes only have to be unique among these
+ACTIVE_ORDER_STATUSES = ("pending", "confirmed", "ready")
+
+# Source of pickup code numbers (see utils/pickup_code.py)
+pickup_code_seq = Sequence("pickup_code_seq", metadata=Base.metadata)
+
+
 class UserStatus(enum.Enum):
     REGULAR = "regular"
     PHARMACY_ADMIN = "pharmacy_admin"
@@ -34,11 +45,25 @@ class Application(Base):
     __tablename__ = "applications"
 
     id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(BigInteger, nullable=True)  # Telegram ID of the applicant
+    username = Column(String, nullable=True)  # @username or full name of the applicant
     full_name = Column(String, nullable=False)  # Organization/person name
     phone = Column(String, nullable=False)  # Contact information (phone/email)
     pharmacy_name = Column(String, nullable=False)  # Address (currently stored as pharmacy_name)
+    license_photo_id = Column(String, nullable=True)  # Telegram file_id of the license photo
     approved = Column(Boolean, default=None)  # True = approved, False = rejected, None = pending
     created_at = Column(DateTime(timezone=True), server_default=func.now())  # Creation timestamp
+    decided_at = Column(DateTime(timezone=True), nullable=True)
+    decided_by = Column(BigInteger, nullable=True)  # admin Telegram ID
+    # Moderation queue: a moderator reserves a batch until claimed_until
+    claimed_by = Column(BigInteger, nullable=True)
+    claimed_until = Column(DateTime(timezone=True), nullable=True)
+    digested_at = Column(DateTime(timezone=True), nullable=True)  # included in a moderator digest
+
+    __table_args__ = (
+        # Moderation queue: pending rows in id order
+        Index("ix_applications_pending", id, postgresql_where=approved.is_(None)),
+    )
 
 
 class Comment(Base):
@@ -50,6 +75,17 @@ class Comment(Base):
     text = Column(String, nullable=False)
     approved = Column(Boolean, default=None)  # True = approved, False = rejected, None = pending
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    decided_at = Column(DateTime(timezone=True), nullable=True)
+    decided_by = Column(BigInteger, nullable=True)  # admin Telegram ID
+    # Moderation queue: a moderator reserves a batch until claimed_until
+    claimed_by = Column(BigInteger, nullable=True)
+    claimed_until = Column(DateTime(timezone=True), nullable=True)
+    digested_at = Column(DateTime(timezone=True), nullable=True)  # included in a moderator digest
+
+    __table_args__ = (
+        # Moderation queue: pending rows in id order
+        Index("ix_comments_pending", id, postgresql_where=approved.is_(None)),
+    )
 
 
 class Drug(Base):
@@ -71,6 +107,10 @@ class Drug(Base):
     image_url = Column(String, nullable=True)  # drug image URL
     thumbnail_url = Column(String, nullable=True)  # thumbnail image URL
 
+    # Catalog sync (see utils/catalog_sync.py)
+    content_hash = Column(String(32), nullable=True)  # hash of the API fields at the last sync
+    deleted_at = Column(DateTime(timezone=True), nullable=True)  # gone from the API; hidden, kept for order history
+
     def __repr__(self):
         return f"<Drug(name={self.name}, manufacturer={self.manufacturer})>"
 
@@ -163,6 +203,7 @@ class Order(BaseModel):
     total_amount = Column(Integer, default=0)  # Total order amount
     delivery_type = Column(String, default="pickup")  # "pickup" or "delivery"
     pickup_code = Column(String, nullable=True)  # Unique pickup code for pharmacy pickup
+    idempotency_key = Column(String(64), nullable=True)  # One order per confirmation, see finalize_order
     
     status = Column(String, default="pending")  # pending, confirmed, ready, completed, cancelled
     payment_status = Column(String, default="unpaid")  # unpaid, paid, refunded
@@ -175,6 +216,30 @@ class Order(BaseModel):
     # Relationship
     pharmacy = relationship("Pharmacy", backref="orders")
 
+    __table_args__ = (
+        # Pharmacy order lists: keyset pagination per status, and over all statuses
+        Index(
+            "ix_orders_pharmacy_status_created",
+            pharmacy_id, status, created_at.desc(), id.desc(),
+        ),
+        Index("ix_orders_pharmacy_created", pharmacy_id, created_at.desc(), id.desc()),
+        # Admin order console: all pharmacies, by status, and lookups by pickup code
+        Index("ix_orders_created", created_at.desc(), id.desc()),
+        Index("ix_orders_status_created", status, created_at.desc(), id.desc()),
+        Index("ix_orders_pickup_code", "pickup_code"),
+        # Pickup codes are unique among active orders and looked up by pharmacies
+        Index(
+            "uix_orders_active_pickup_code",
+            "pickup_code",
+            unique=True,
+            postgresql_where=text(
+                "status IN (" + ", ".join(f"'{st}'" for st in ACTIVE_ORDER_STATUSES) + ")"
+            ),
+        ),
+        # A repeated confirmation tap must not create a second order
+        Index("uix_orders_idempotency_key", "idempotency_key", unique=True),
+    )
+
     def __repr__(self):
         return f"<Order(id={self.id}, user_id={self.user_id}, status={self.status}, pickup_code={self.pickup_code})>"
 
@@ -200,6 +265,8 @@ class OrderItem(BaseModel):
 class User(Base):
     """User model to store Telegram user information"""
     __tablename__ = "users"
+    # Admin search indexes (pg_trgm, reversed phone digits) are created by
+    # migration 7, see utils/user_search.py
 
     id = Column(Integer, primary_key=True, index=True)
     telegram_id = Column(BigInteger, unique=True, nullable=False)  # Telegram user ID
@@ -209,6 +276,178 @@ class User(Base):
     status = Column(Enum(UserStatus, values_callable=lambda x: [e.value for e in x]), 
                     default=UserStatus.REGULAR, 
                     nullable=False)  # User status
+    # Set when a message to the user fails with 403 (bot blocked); broadcasts skip them
+    is_blocked = Column(Boolean, nullable=False, default=False, server_default=text("false"))
+    blocked_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<User(telegram_id={self.telegram_id}, username={self.username}, fullname={self.fullname}, status={self.status})>"
+
+
+class PharmacyDailyStats(Base):
+    """
+    Order counters per pharmacy per day (order creation day, local time).
+    Kept current on every order status transition, see utils/stats_rollup.py.
+    """
+    __tablename__ = "pharmacy_daily_stats"
+
+    pharmacy_id = Column(Integer, ForeignKey("pharmacies.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+
+    total = Column(Integer, nullable=False, default=0, server_default="0")
+    pending = Column(Integer, nullable=False, default=0, server_default="0")
+    confirmed = Column(Integer, nullable=False, default=0, server_default="0")
+    ready = Column(Integer, nullable=False, default=0, server_default="0")
+    completed = Column(Integer, nullable=False, default=0, server_default="0")
+    cancelled = Column(Integer, nullable=False, default=0, server_default="0")
+    revenue = Column(BigInteger, nullable=False, default=0, server_default="0")  # completed orders only
+
+    def __repr__(self):
+        return f"<PharmacyDailyStats(pharmacy={self.pharmacy_id}, day={self.day}, total={self.total})>"
+
+
+class NotificationOutbox(Base):
+    """
+    Outgoing Telegram message waiting to be sent by the background sender
+    (see utils/notifications.py). Rows are written in the same transaction
+    as the change they announce.
+    """
+    __tablename__ = "notification_outbox"
+
+    id = Column(BigInteger, primary_key=True)
+    chat_id = Column(BigInteger, nullable=False)
+
+    text = Column(Text, nullable=True)  # message text, or photo caption
+    photo = Column(String, nullable=True)  # Telegram file_id; sent as a photo when set
+    parse_mode = Column(String, nullable=True)
+    reply_markup = Column(Text, nullable=True)  # InlineKeyboardMarkup as JSON
+
+    status = Column(String, nullable=False, default="pending", server_default="pending")  # pending, sending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    locked_until = Column(DateTime(timezone=True), nullable=True)  # lease of a sender working on the row
+    last_error = Column(Text, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # Sender picks due rows in order
+        Index("ix_notification_outbox_due", "status", "next_attempt_at"),
+    )
+
+    def __repr__(self):
+        return f"<NotificationOutbox(id={self.id}, chat_id={self.chat_id}, status={self.status})>"
+
+
+class Broadcast(Base):
+    """
+    Admin message sent to every user (see utils/broadcast.py).
+    Progress is saved after every chunk of recipients, so a broadcast
+    interrupted by a restart continues where it stopped.
+    """
+    __tablename__ = "broadcasts"
+
+    id = Column(Integer, primary_key=True)
+    created_by = Column(BigInteger, nullable=False)  # admin Telegram ID
+
+    # The admin's original message is copied to every recipient
+    source_chat_id = Column(BigInteger, nullable=False)
+    source_message_id = Column(BigInteger, nullable=False)
+
+    status = Column(String, nullable=False, default="running", server_default="running")  # running, done, cancelled
+    last_user_id = Column(Integer, nullable=False, default=0, server_default="0")  # users.id cursor
+    total = Column(Integer, nullable=False, default=0, server_default="0")  # recipients when started
+    sent = Column(Integer, nullable=False, default=0, server_default="0")
+    failed = Column(Integer, nullable=False, default=0, server_default="0")
+    blocked = Column(Integer, nullable=False, default=0, server_default="0")
+
+    # Admin message showing the progress
+    progress_chat_id = Column(BigInteger, nullable=True)
+    progress_message_id = Column(BigInteger, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<Broadcast(id={self.id}, status={self.status}, sent={self.sent}/{self.total})>"
+
+
+class FsmState(Base):
+    """
+    aiogram FSM state and data per chat/user, shared by all bot workers
+    (FSM_STORAGE=postgres, see utils/fsm_storage.py).
+    """
+    __tablename__ = "fsm_state"
+
+    key = Column(String, primary_key=True)  # aiogram storage key
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=True)  # compact JSON
+    updated_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    def __repr__(self):
+        return f"<FsmState(key={self.key}, state={self.state})>"
+
+
+class CatalogSyncRun(Base):
+    """
+    One run of the PharmAgency catalog sync (see utils/catalog_sync.py).
+    The latest finished run is the sync state shown to admins.
+    """
+    __tablename__ = "catalog_sync_runs"
+
+    id = Column(Integer, primary_key=True)
+    status = Column(String, nullable=False, default="running", server_default="running")  # running, done, failed
+
+    fetched = Column(Integer, nullable=False, default=0, server_default="0")  # rows received from the API
+    inserted = Column(Integer, nullable=False, default=0, server_default="0")
+    updated = Column(Integer, nullable=False, default=0, server_default="0")
+    unchanged = Column(Integer, nullable=False, default=0, server_default="0")
+    restored = Column(Integer, nullable=False, default=0, server_default="0")  # tombstoned drugs that came back
+    deleted = Column(Integer, nullable=False, default=0, server_default="0")  # tombstoned by this run
+    duration_ms = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+
+    started_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    def __repr__(self):
+        return f"<CatalogSyncRun(id={self.id}, status={self.status})>"
+
+
+class CatalogChange(Base):
+    """
+    Drug changed by a catalog sync run. Read in id order by caches that
+    hold drug data (``after id`` cursor).
+    """
+    __tablename__ = "catalog_changes"
+
+    id = Column(BigInteger, primary_key=True)
+    run_id = Column(Integer, ForeignKey("catalog_sync_runs.id", ondelete="CASCADE"), nullable=False, index=True)
+    drug_id = Column(Integer, ForeignKey("drugs.id", ondelete="CASCADE"), nullable=False)  # drugs.id, not the API id
+    change = Column(String(8), nullable=False)  # insert, update, restore, delete
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    def __repr__(self):
+        return f"<CatalogChange(id={self.id}, drug_id={self.drug_id}, change={self.change})>"
+
+
+class AdminAuditLog(Base):
+    """
+    Admin action that changed data (see utils/audit.py).
+    """
+    __tablename__ = "admin_audit_log"
+
+    id = Column(BigInteger, primary_key=True)
+    admin_id = Column(BigInteger, nullable=False)  # admin Telegram ID
+    action = Column(String, nullable=False)  # e.g. orders.status, orders.delete
+    target_ids = Column(ARRAY(Integer), nullable=True)  # ids of the changed rows
+    details = Column(Text, nullable=True)  # compact JSON
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index("ix_admin_audit_log_created", created_at.desc()),
+    )
 
     def __repr__(self):
-        return f"<User(telegram_id={self.telegram_id}, username={self.username}, fullname={self.fullname}, status={self.status})>"
\ No newline at end of file
+        return f"<AdminAuditLog(id={self.id}, admin_id={self.admin_id}, action={self.action})>"
@@ -0,0 +1,109 @@
+from aiogram import Router, F, types
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+
+from keyboards.admin_menu import admin_main_menu, confirm_keyboard
+from middlewares.identity import Identity
+from utils.broadcast import broadcast_runner, count_recipients
+
+router = Router()
+
+
+class BroadcastState(StatesGroup):
+    """
+    FSM states for composing a broadcast.
+    """
+    waiting_for_message = State()
+    confirming = State()
+
+
+@router.callback_query(F.data == "admin:broadcast")
+async def ask_broadcast_message(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    """
+    Ask the admin for the message to send to every user.
+    """
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    await callback.answer()
+    recipients = await count_recipients()
+    await state.set_state(BroadcastState.waiting_for_message)
+    await callback.message.edit_text(
+        "📣 Barcha foydalanuvchilarga yuboriladigan xabarni yuboring.\n"
+        "Matn, rasm, video yoki hujjat bo'lishi mumkin.\n\n"
+        f"👥 Qabul qiluvchilar: {recipients} ta",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text="❌ Bekor qilish", callback_data="admin:broadcast:abort")]]
+        )
+    )
+
+
+@router.message(BroadcastState.waiting_for_message)
+async def preview_broadcast(message: types.Message, state: FSMContext):
+    """
+    Show the message as users will see it and ask for confirmation.
+    """
+    await state.update_data(source_chat_id=message.chat.id, source_message_id=message.message_id)
+    await state.set_state(BroadcastState.confirming)
+
+    await message.bot.copy_message(message.chat.id, message.chat.id, message.message_id)
+    recipients = await count_recipients()
+    await message.answer(
+        f"⬆️ Xabar shu ko'rinishda {recipients} ta foydalanuvchiga yuboriladi. Tasdiqlaysizmi?",
+        reply_markup=confirm_keyboard(
+            confirm_text="✅ Yuborish",
+            confirm_data="admin:broadcast:confirm",
+            cancel_data="admin:broadcast:abort",
+        )
+    )
+
+
+@router.callback_query(BroadcastState.confirming, F.data == "admin:broadcast:confirm")
+async def start_broadcast(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    """
+    Save the broadcast and start sending it in the background.
+    """
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    data = await state.get_data()
+    await state.clear()
+    await callback.answer("📣 Yuborish boshlandi")
+
+    progress_message = await callback.message.edit_text("📣 Xabar yuborilmoqda...")
+    # The runner keeps editing this message with the progress
+    await broadcast_runner.create(
+        identity.telegram_id,
+        data["source_chat_id"],
+        data["source_message_id"],
+        progress_message,
+    )
+
+
+@router.callback_query(F.data == "admin:broadcast:abort")
+async def abort_broadcast(callback: CallbackQuery, state: FSMContext):
+    """
+    Drop the broadcast being composed and return to the admin menu.
+    """
+    await state.clear()
+    await callback.answer()
+    await callback.message.edit_text("Admin bosh menyusi:", reply_markup=admin_main_menu())
+
+
+@router.callback_query(F.data.startswith("admin:broadcast:cancel:"))
+async def cancel_broadcast(callback: CallbackQuery, identity: Identity):
+    """
+    Stop a running broadcast.
+    """
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    broadcast_id = int(callback.data.split(":")[-1])
+    if await broadcast_runner.cancel(broadcast_id):
+        await callback.answer("⛔ Yuborish to'xtatilmoqda...")
+    else:
+        await callback.answer("Bu xabar yuborish allaqachon tugagan.", show_alert=True)
@@ -0,0 +1,438 @@
+import html
+import logging
+from typing import List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from aiogram import F, Router, types
+from aiogram.filters import Command
+from aiogram.fsm.context import FSMContext
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import select
+
+from database.db import async_session
+from database.models import Application, Comment
+from middlewares.identity import Identity
+from utils.config import MODERATION_BATCH_SIZE, MODERATION_CLAIM_TTL, TIMEZONE
+from utils.moderation import (
+    APPROVE,
+    KINDS,
+    REJECT,
+    claim_batch,
+    claimed_rows,
+    decide,
+    pending_counts,
+    release,
+)
+from utils.notifications import notify
+from utils.render_fingerprint import edit_if_changed
+
+logger = logging.getLogger(__name__)
+
+router = Router()
+
+LOCAL_TZ = ZoneInfo(TIMEZONE)
+
+MAX_TEXT_PREVIEW = 300
+
+# FSM data key: {kind: [selected ids]}
+SELECTED_KEY = "moderation_selected"
+
+
+def render_item(kind: str, item, selected: bool) -> str:
+    created = item.created_at.astimezone(LOCAL_TZ).strftime("%d.%m.%Y %H:%M") if item.created_at else ""
+    author = html.escape(item.username or "—")
+    if item.user_id:
+        author += f" · 🆔 <code>{item.user_id}</code>"
+    header = f"{'☑️' if selected else '⬜'} <b>#{item.id}</b> · {created}\n👤 {author}\n"
+    if kind == "app":
+        return (
+            header
+            + f"🏢 {html.escape(item.full_name)}\n"
+            f"📞 {html.escape(item.phone)} · 📍 {html.escape(item.pharmacy_name)}"
+        )
+    text = item.text if len(item.text) <= MAX_TEXT_PREVIEW else item.text[:MAX_TEXT_PREVIEW] + "…"
+    return header + f"«{html.escape(text)}»"
+
+
+def batch_keyboard(kind: str, items: List, selected: set) -> InlineKeyboardMarkup:
+    rows: List[List[InlineKeyboardButton]] = []
+    for item in items:
+        row = [InlineKeyboardButton(
+            text=f"{'☑️' if item.id in selected else '⬜'} #{item.id}",
+            callback_data=f"mod:t:{kind}:{item.id}",
+        )]
+        if kind == "app" and item.license_photo_id:
+            row.append(InlineKeyboardButton(text="🖼 Litsenziya", callback_data=f"mod:photo:{item.id}"))
+        rows.append(row)
+
+    if items:
+        rows.append([
+            InlineKeyboardButton(text="☑️ Hammasini tanlash", callback_data=f"mod:all:{kind}"),
+            InlineKeyboardButton(text="⬜ Tozalash", callback_data=f"mod:none:{kind}"),
+        ])
+        if selected:
+            rows.append([
+                InlineKeyboardButton(text=f"✅ Tasdiqlash ({len(selected)})", callback_data=f"mod:d:{kind}:{APPROVE}"),
+                InlineKeyboardButton(text=f"❌ Rad etish ({len(selected)})", callback_data=f"mod:d:{kind}:{REJECT}"),
+            ])
+        rows.append([
+            InlineKeyboardButton(text="⏭ Keyingi to'plam", callback_data=f"mod:skip:{kind}:{items[-1].id}"),
+            InlineKeyboardButton(text="🔓 Bo'shatish", callback_data=f"mod:rel:{kind}"),
+        ])
+    rows.append([InlineKeyboardButton(text="🔙 Ortga", callback_data="admin:moderation")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+async def get_selected(state: FSMContext, kind: str) -> set:
+    return set((await state.get_data()).get(SELECTED_KEY, {}).get(kind, []))
+
+
+async def set_selected(state: FSMContext, kind: str, selected: set):
+    data = (await state.get_data()).get(SELECTED_KEY, {})
+    data[kind] = sorted(selected)
+    await state.update_data({SELECTED_KEY: data})
+
+
+async def show_batch(message: types.Message, state: FSMContext, identity: Identity, kind: str,
+                     claim: bool = True, after_id: int = 0):
+    """
+    Render the moderator's claimed batch. With ``claim`` the batch is renewed
+    and topped up from the queue first; otherwise the current claims are shown.
+    """
+    async with async_session() as session:
+        if claim:
+            items = await claim_batch(session, kind, identity.telegram_id, MODERATION_BATCH_SIZE, after_id)
+            if not items and after_id:
+                # Reached the end of the queue: start over from the oldest
+                items = await claim_batch(session, kind, identity.telegram_id, MODERATION_BATCH_SIZE)
+            await session.commit()
+        else:
+            items = await claimed_rows(session, kind, identity.telegram_id)
+        total = (await pending_counts(session))[kind]
+
+    # Selections of rows that were decided or lost meanwhile are dropped
+    selected = await get_selected(state, kind) & {item.id for item in items}
+    await set_selected(state, kind, selected)
+
+    spec = KINDS[kind]
+    if items:
+        text = (
+            f"{spec.title} · ⏳ {total} ta kutilmoqda\n"
+            f"<i>Sizga {len(items)} ta ajratildi ({int(MODERATION_CLAIM_TTL // 60)} daqiqaga). "
+            f"Belgilang va bir yo'la tasdiqlang yoki rad eting.</i>\n\n"
+            + "\n\n".join(render_item(kind, item, item.id in selected) for item in items)
+        )
+    elif total:
+        text = f"{spec.title} · ⏳ {total} ta\n\n🔒 Hammasini boshqa moderatorlar ko'rib chiqmoqda."
+    else:
+        text = f"{spec.title}\n\n✅ Ko'rib chiqilmagan so'rovlar yo'q."
+    await edit_if_changed(message, text, reply_markup=batch_keyboard(kind, items, selected), parse_mode="HTML")
+
+
+def parse_kind(callback: CallbackQuery, parts_count: int):
+    """
+    Callback data split by ":", or None if it has the wrong shape or kind.
+    """
+    parts = callback.data.split(":")
+    if len(parts) != parts_count or parts[2] not in KINDS:
+        return None
+    return parts
+
+
+# =================== Menu =================== #
+
+async def moderation_menu_content(identity: Identity):
+    async with async_session() as session:
+        counts = await pending_counts(session)
+
+    rows = [
+        [InlineKeyboardButton(text=f"{spec.title} ({counts[key]})", callback_data=f"mod:q:{key}")]
+        for key, spec in KINDS.items()
+    ]
+    if identity.is_admin:
+        rows.append([InlineKeyboardButton(text="⬅️ Ortga", callback_data="admin:back")])
+    text = (
+        "🗂 <b>Moderatsiya</b>\n\n"
+        f"Navbatni ochganingizda eng eski {MODERATION_BATCH_SIZE} ta so'rov sizga ajratiladi - "
+        "boshqa moderatorlar ularni ko'rmaydi."
+    )
+    return text, InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+@router.message(Command("moderation"))
+async def moderation_command(message: types.Message, identity: Identity):
+    if not identity.is_moderator:
+        return
+    text, markup = await moderation_menu_content(identity)
+    await message.answer(text, reply_markup=markup, parse_mode="HTML")
+
+
+@router.callback_query(F.data == "admin:moderation")
+async def moderation_menu(callback: CallbackQuery, identity: Identity):
+    """
+    Pending counts per kind with links to the queues.
+    """
+    if not identity.is_moderator:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    text, markup = await moderation_menu_content(identity)
+    await callback.answer()
+    await edit_if_changed(callback.message, text, reply_markup=markup, parse_mode="HTML")
+
+
+# =================== Claimed batch =================== #
+
+@router.callback_query(F.data.startswith("mod:q:"))
+async def open_queue(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    """
+    Claim (or renew) a batch of the oldest pending items: "mod:q:<kind>".
+    """
+    if not identity.is_moderator:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    parts = parse_kind(callback, 3)
+    if parts is None:
+        await callback.answer("❌ Noto'g'ri ma'lumot", show_alert=True)
+        return
+    await callback.answer()
+    await show_batch(callback.message, state, identity, parts[2])
+
+
+@router.callback_query(F.data.startswith("mod:t:") | F.data.startswith("mod:all:") | F.data.startswith("mod:none:"))
+async def change_selection(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    """
+    Toggle one item ("mod:t:<kind>:<id>"), select all ("mod:all:<kind>") or
+    clear the selection ("mod:none:<kind>") of the claimed batch.
+    """
+    if not identity.is_moderator:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    action = callback.data.split(":")[1]
+    parts = parse_kind(callback, 4 if action == "t" else 3)
+    if parts is None or (action == "t" and not parts[3].isdigit()):
+        await callback.answer("❌ Noto'g'ri ma'lumot", show_alert=True)
+        return
+    kind = parts[2]
+
+    async with async_session() as session:
+        claimed = {item.id for item in await claimed_rows(session, kind, identity.telegram_id)}
+    if not claimed:
+        await callback.answer("⏳ Ajratish muddati tugadi, navbat yangilandi")
+        await show_batch(callback.message, state, identity, kind)
+        return
+
+    selected = await get_selected(state, kind)
+    if action == "t":
+        selected ^= {int(parts[3])}
+    elif action == "all":
+        selected = claimed
+    else:
+        selected = set()
+    await set_selected(state, kind, selected & claimed)
+    await callback.answer()
+    await show_batch(callback.message, state, identity, kind, claim=False)
+
+
+@router.callback_query(F.data.startswith("mod:d:"))
+async def decide_selected(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    """
+    Approve or reject all selected items with one UPDATE: "mod:d:<kind>:<a|r>".
+    """
+    if not identity.is_moderator:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    parts = parse_kind(callback, 4)
+    if parts is None or parts[3] not in (APPROVE, REJECT):
+        await callback.answer("❌ Noto'g'ri ma'lumot", show_alert=True)
+        return
+    kind, approve = parts[2], parts[3] == APPROVE
+
+    selected = await get_selected(state, kind)
+    if not selected:
+        await callback.answer("▫️ Hech narsa tanlanmagan")
+        return
+
+    async with async_session() as session:
+        decided = await decide(session, kind, selected, approve, identity.telegram_id)
+        await session.commit()
+    await set_selected(state, kind, set())
+
+    logger.info(f"Moderator {identity.telegram_id} {'approved' if approve else 'rejected'} "
+                f"{len(decided)}/{len(selected)} {KINDS[kind].model.__tablename__} rows")
+    label = "✅ Tasdiqlandi" if approve else "❌ Rad etildi"
+    answer = f"{label}: {len(decided)} ta"
+    if len(decided) < len(selected):
+        answer += f"\n▫️ {len(selected) - len(decided)} tasi allaqachon ko'rib chiqilgan"
+    await callback.answer(answer, show_alert=len(decided) < len(selected))
+    await show_batch(callback.message, state, identity, kind)
+
+
+@router.callback_query(F.data.startswith("mod:skip:"))
+async def skip_batch(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    """
+    Give the batch back and claim the next one: "mod:skip:<kind>:<last id>".
+    """
+    if not identity.is_moderator:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    parts = parse_kind(callback, 4)
+    if parts is None or not parts[3].isdigit():
+        await callback.answer("❌ Noto'g'ri ma'lumot", show_alert=True)
+        return
+    kind = parts[2]
+
+    async with async_session() as session:
+        await release(session, kind, identity.telegram_id)
+        await session.commit()
+    await callback.answer()
+    await show_batch(callback.message, state, identity, kind, after_id=int(parts[3]))
+
+
+@router.callback_query(F.data.startswith("mod:rel:"))
+async def release_batch(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    """
+    Give the batch back to the queue: "mod:rel:<kind>".
+    """
+    if not identity.is_moderator:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    parts = parse_kind(callback, 3)
+    if parts is None:
+        await callback.answer("❌ Noto'g'ri ma'lumot", show_alert=True)
+        return
+
+    async with async_session() as session:
+        released = await release(session, parts[2], identity.telegram_id)
+        await session.commit()
+    await set_selected(state, parts[2], set())
+    await callback.answer(f"🔓 {released} ta so'rov navbatga qaytarildi")
+    text, markup = await moderation_menu_content(identity)
+    await edit_if_changed(callback.message, text, reply_markup=markup, parse_mode="HTML")
+
+
+@router.callback_query(F.data.startswith("mod:photo:"))
+async def show_license_photo(callback: CallbackQuery, identity: Identity):
+    if not identity.is_moderator:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    app_id = callback.data.removeprefix("mod:photo:")
+    if not app_id.isdigit():
+        await callback.answer("❌ Noto'g'ri ma'lumot", show_alert=True)
+        return
+    async with async_session() as session:
+        photo_id = await session.scalar(
+            select(Application.license_photo_id).where(Application.id == int(app_id))
+        )
+    if not photo_id:
+        await callback.answer("❌ Rasm topilmadi", show_alert=True)
+        return
+    await callback.answer()
+    await callback.message.answer_photo(photo_id, caption=f"📋 Hamkorlik so'rovi #{app_id}")
+
+
+# =================== Older admin messages =================== #
+
+# Caption lines of a pre-upgrade application message -> Application column
+LEGACY_APPLICATION_FIELDS = {
+    "👤 Foydalanuvchi:": "username",
+    "🏢 Tashkilot:": "full_name",
+    "📞 Aloqa:": "phone",
+    "📍 Manzil:": "pharmacy_name",
+}
+
+RESUBMIT_TEXT = {
+    "app": "⚠️ Tizim yangilangani sababli hamkorlik so'rovingizni ko'rib chiqib bo'lmadi.\n"
+           "Iltimos, uni qaytadan yuboring.",
+    "fb": "⚠️ Tizim yangilangani sababli fikringizni ko'rib chiqib bo'lmadi.\n"
+          "Iltimos, uni qaytadan yuboring.",
+}
+
+
+def legacy_item(data: str, message: types.Message) -> Optional[Tuple[str, object]]:
+    """
+    Pending row rebuilt from a pre-upgrade admin message, or None if the
+    message cannot be read. Application messages are a photo with the
+    details in the caption; feedback messages carry the text in quotes.
+    """
+    user_id = data.rsplit("_", 1)[-1]
+    if not user_id.isdigit():
+        return None
+
+    if data.startswith("admin_feedback_"):
+        body = message.text or ""
+        start = body.find('\n\n"')
+        end = body.rfind('"\n\nTasdiqlaysizmi?')
+        if start < 0 or end <= start + 3:
+            return None
+        username = next(
+            (line.removeprefix("👤 ").strip() for line in body.split("\n") if line.startswith("👤 ")), None
+        )
+        return "fb", Comment(user_id=int(user_id), username=username, text=body[start + 3:end])
+
+    fields = {}
+    for line in (message.caption or "").split("\n"):
+        for prefix, column in LEGACY_APPLICATION_FIELDS.items():
+            if line.startswith(prefix):
+                fields[column] = line.removeprefix(prefix).strip()
+    if not all(fields.get(column) for column in ("full_name", "phone", "pharmacy_name")):
+        return None
+    photo_id = message.photo[-1].file_id if message.photo else None
+    return "app", Application(user_id=int(user_id), license_photo_id=photo_id, **fields)
+
+
+@router.callback_query(
+    F.data.startswith("admin_approve_") | F.data.startswith("admin_reject_")
+    | F.data.startswith("admin_feedback_approve_") | F.data.startswith("admin_feedback_reject_")
+)
+async def outdated_decision(callback: CallbackQuery, identity: Identity):
+    """
+    Buttons of admin messages sent before applications were stored at
+    submission; they carry no row id. The submission is imported from the
+    message into the moderation queue (once), or, if the message cannot be
+    read, the author is asked to send it again.
+    """
+    if not identity.is_moderator:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    kind = "fb" if callback.data.startswith("admin_feedback_") else "app"
+    item = legacy_item(callback.data, callback.message)
+    if item is None:
+        user_id = callback.data.rsplit("_", 1)[-1]
+        if user_id.isdigit():
+            await notify(int(user_id), RESUBMIT_TEXT[kind])
+        logger.warning(f"Could not import legacy {kind} message {callback.message.message_id}")
+        mark = "\n\n⚠️ Eskirgan: foydalanuvchidan qayta yuborish so'raldi"
+        await callback.answer("⚠️ Bu xabar eskirgan. Foydalanuvchidan qayta yuborish so'raldi.", show_alert=True)
+    else:
+        kind, row = item
+        model = KINDS[kind].model
+        same = model.full_name == row.full_name if kind == "app" else model.text == row.text
+        async with async_session() as session:
+            # Another tap on the same message already imported it
+            item_id = await session.scalar(
+                select(model.id).where(model.user_id == row.user_id, same).order_by(model.id.desc()).limit(1)
+            )
+            if item_id is None:
+                session.add(row)
+                await session.commit()
+                item_id = row.id
+                logger.info(f"Moderator {identity.telegram_id} imported legacy {kind} message as #{item_id}")
+        mark = f"\n\n📥 Moderatsiya navbatiga qo'shildi (#{item_id})"
+        await callback.answer(
+            f"📥 So'rov moderatsiya navbatiga qo'shildi (#{item_id}).\n🗂 Moderatsiya bo'limida ko'rib chiqing.",
+            show_alert=True,
+        )
+
+    if callback.message.caption is not None:
+        await callback.message.edit_caption(caption=callback.message.caption + mark, reply_markup=None)
+    else:
+        await callback.message.edit_text((callback.message.text or "") + mark, reply_markup=None)
+
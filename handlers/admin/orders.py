@@ -1,9 +1,442 @@
-from aiogram import Router, types
-from aiogram.types import CallbackQuery
-from keyboards.admin_menu import orders_menu
+import html
+import logging
+import re
+from typing import List, Optional
+
+from aiogram import F, Router, types
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import select
+
+from database.db import async_session
+from database.models import Order
+from keyboards.admin_menu import confirm_keyboard, orders_menu
+from middlewares.identity import Identity
+from utils.audit import audit
+from utils.order_lifecycle import STATUS_LABELS, TRANSITIONS, bulk_transition, delete_orders
+from utils.order_search import LOCAL_TZ, OrderQuery, build_order_query, parse_order_query
+from utils.pagination import NEXT, PREV, Page, decode_cursor, fetch_page
+from utils.pharmacy_cache import get_pharmacies
+from utils.render_fingerprint import edit_if_changed
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
+ORDERS_PER_PAGE = 10
+# Orders changed by one bulk action
+BULK_LIMIT = 200
+
+STATUS_FILTERS = {"all": "Barchasi", **STATUS_LABELS}
+
+_ID_TOKEN = re.compile(r"^(\d+)(?:-(\d+))?$")
+
+
+class OrderConsoleState(StatesGroup):
+    """
+    FSM states of the admin order console.
+    """
+    waiting_for_query = State()
+    waiting_for_status_ids = State()
+    choosing_status = State()
+    waiting_for_delete_ids = State()
+    confirming_delete = State()
+
+
+def list_callback(status: str, cursor: Optional[str] = None, direction: str = NEXT) -> str:
+    """
+    Callback data for a list page: "admin:orders:l:<status>:<direction><cursor>".
+    """
+    return f"admin:orders:l:{status}:{direction + cursor if cursor else ''}"
+
+
+def search_callback(cursor: Optional[str] = None, direction: str = NEXT) -> str:
+    """
+    Callback data for a search results page: "admin:orders:s:<direction><cursor>";
+    the query itself is kept in the FSM data.
+    """
+    return f"admin:orders:s:{direction + cursor if cursor else ''}"
+
+
+def back_to_orders_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Ortga", callback_data="admin:orders:cancel")],
+    ])
+
+
+def navigation_row(page: Page, make_callback) -> List[InlineKeyboardButton]:
+    row = []
+    if page.prev_cursor:
+        row.append(InlineKeyboardButton(text="⬅️ Oldingi", callback_data=make_callback(page.prev_cursor, PREV)))
+    if page.next_cursor:
+        row.append(InlineKeyboardButton(text="Keyingi ➡️", callback_data=make_callback(page.next_cursor, NEXT)))
+    return row
+
+
+def parse_order_ids(text: str) -> Optional[List[int]]:
+    """
+    Order ids from "12, 15 20-25"; None if the text is not such a list or
+    names more than BULK_LIMIT orders.
+    """
+    ids = set()
+    for token in re.split(r"[\s,;]+", text.strip()):
+        if not token:
+            continue
+        match = _ID_TOKEN.match(token)
+        if not match:
+            return None
+        start = int(match.group(1))
+        end = int(match.group(2) or start)
+        if end < start or end - start >= BULK_LIMIT:
+            return None
+        ids.update(range(start, end + 1))
+        if len(ids) > BULK_LIMIT:
+            return None
+    return sorted(ids) or None
+
+
+def describe_ids(ids: List[int], limit: int = 20) -> str:
+    shown = ", ".join(f"#{order_id}" for order_id in ids[:limit])
+    return shown + (f" ... (+{len(ids) - limit})" if len(ids) > limit else "")
+
+
+async def render_orders(orders: List[Order]) -> str:
+    """
+    One line block per order, with the pharmacy name.
+    """
+    pharmacy_ids = {order.pharmacy_id for order in orders if order.pharmacy_id}
+    pharmacies = {card.id: card.name for card in await get_pharmacies(pharmacy_ids)}
+    text = ""
+    for order in orders:
+        created = order.created_at.astimezone(LOCAL_TZ).strftime("%d.%m.%Y %H:%M") if order.created_at else ""
+        pharmacy = pharmacies.get(order.pharmacy_id) or (f"#{order.pharmacy_id}" if order.pharmacy_id else "—")
+        text += (
+            f"{STATUS_LABELS.get(order.status, order.status)} · <b>#{order.id}</b> · {created}\n"
+            f"🏥 {html.escape(pharmacy)} · 💰 {order.total_amount or 0:,} so'm\n"
+            f"👤 {html.escape(order.full_name or '')} · 📞 {html.escape(order.phone or '')}"
+        )
+        if order.pickup_code and order.pickup_code != order.phone:
+            text += f" · 🔑 {order.pickup_code}"
+        text += "\n\n"
+    return text
+
+
+# =================== Listing =================== #
+
+@router.callback_query(F.data == "admin:orders:list")
+@router.callback_query(F.data.startswith("admin:orders:l:"))
+async def list_orders(callback: CallbackQuery, identity: Identity):
+    """
+    Orders of all pharmacies, newest first, keyset paginated, filterable by status.
+    """
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    status, cursor, direction = "all", None, NEXT
+    if callback.data.startswith("admin:orders:l:"):
+        try:
+            _, _, _, status, position = callback.data.split(":")
+            if status not in STATUS_FILTERS:
+                raise ValueError(status)
+            if position:
+                direction, cursor = position[0], position[1:]
+                decode_cursor(cursor)
+        except ValueError:
+            await callback.answer("❌ Noto'g'ri ma'lumot", show_alert=True)
+            return
+
+    stmt = select(Order)
+    if status != "all":
+        stmt = stmt.where(Order.status == status)
+    async with async_session() as session:
+        page = await fetch_page(
+            session, stmt, Order.created_at, Order.id,
+            limit=ORDERS_PER_PAGE, cursor=cursor, direction=direction,
+        )
+
+    title = STATUS_FILTERS[status]
+    if page.items:
+        text = f"📋 <b>Buyurtmalar</b> · {title}\n\n" + await render_orders(page.items)
+    else:
+        text = f"📋 <b>Buyurtmalar</b> · {title}\n\nBuyurtmalar yo'q."
+
+    rows = []
+    nav = navigation_row(page, lambda c, d: list_callback(status, c, d))
+    if nav:
+        rows.append(nav)
+    filters = [
+        InlineKeyboardButton(text=f"• {label} •" if key == status else label, callback_data=list_callback(key))
+        for key, label in STATUS_FILTERS.items()
+    ]
+    rows += [filters[:3], filters[3:]]
+    rows.append([InlineKeyboardButton(text="🔙 Ortga", callback_data="admin:orders")])
+
+    await callback.answer()
+    await edit_if_changed(
+        callback.message, text, reply_markup=InlineKeyboardMarkup(inline_keyboard=rows), parse_mode="HTML"
+    )
+
+
+# =================== Search =================== #
+
+@router.callback_query(F.data == "admin:orders:search")
+async def ask_order_query(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    await callback.answer()
+    await state.set_state(OrderConsoleState.waiting_for_query)
+    await edit_if_changed(
+        callback.message,
+        "🔎 <b>Buyurtma qidirish</b>\n\n"
+        "Yuboring:\n"
+        "• buyurtma raqami: <code>1234</code> yoki <code>#1234</code>\n"
+        "• pickup kodi: <code>PX-7KQ2MC</code>\n"
+        "• telefon: <code>+998 90 123 45 67</code> yoki oxirgi raqamlari\n"
+        "• sana yoki oraliq: <code>14.10.2026</code>, <code>01.10.2026-14.10.2026</code>",
+        reply_markup=back_to_orders_keyboard(),
+        parse_mode="HTML",
+    )
+
+
+async def show_search_page(message: types.Message, query: OrderQuery, cursor: Optional[str] = None,
+                           direction: str = NEXT, edit: bool = True):
+    async with async_session() as session:
+        page = await fetch_page(
+            session, build_order_query(query), Order.created_at, Order.id,
+            limit=ORDERS_PER_PAGE, cursor=cursor, direction=direction,
+        )
+
+    title = f"🔎 <b>{html.escape(query.describe)}</b>"
+    if page.items:
+        text = f"{title}\n\n" + await render_orders(page.items)
+    else:
+        text = f"{title}\n\nHech narsa topilmadi. Boshqa so'rov yuboring."
+
+    rows = []
+    nav = navigation_row(page, search_callback)
+    if nav:
+        rows.append(nav)
+    rows.append([InlineKeyboardButton(text="🔙 Ortga", callback_data="admin:orders:cancel")])
+    markup = InlineKeyboardMarkup(inline_keyboard=rows)
+
+    if edit:
+        await edit_if_changed(message, text, reply_markup=markup, parse_mode="HTML")
+    else:
+        await message.answer(text, reply_markup=markup, parse_mode="HTML")
+
+
+@router.message(OrderConsoleState.waiting_for_query, F.text)
+async def run_order_search(message: types.Message, state: FSMContext, identity: Identity):
+    """
+    Show the matches; the admin can send another query right away.
+    """
+    if not identity.is_admin:
+        await state.clear()
+        return
+
+    query = parse_order_query(message.text)
+    if query is None:
+        await message.answer(
+            "❌ So'rov tushunilmadi. Raqam, pickup kodi, telefon yoki sana yuboring.",
+            reply_markup=back_to_orders_keyboard(),
+        )
+        return
+
+    await state.update_data(order_query=message.text)
+    await show_search_page(message, query, edit=False)
+
+
+@router.callback_query(OrderConsoleState.waiting_for_query, F.data.startswith("admin:orders:s:"))
+async def paginate_order_search(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    query = parse_order_query((await state.get_data()).get("order_query") or "")
+    position = callback.data.removeprefix("admin:orders:s:")
+    try:
+        direction, cursor = (position[0], position[1:]) if position else (NEXT, None)
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError:
+        query = None
+    if query is None:
+        await callback.answer("❌ Qidiruv eskirgan, qaytadan yuboring.", show_alert=True)
+        return
+
+    await callback.answer()
+    await show_search_page(callback.message, query, cursor, direction)
+
+
+# =================== Bulk status update =================== #
+
+@router.callback_query(F.data == "admin:orders:update_status")
+async def ask_status_ids(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    await callback.answer()
+    await state.set_state(OrderConsoleState.waiting_for_status_ids)
+    await edit_if_changed(
+        callback.message,
+        "✅ <b>Holatni yangilash</b>\n\n"
+        f"Buyurtma raqamlarini yuboring (ko'pi bilan {BULK_LIMIT} ta), masalan: "
+        "<code>12, 15 20-25</code>",
+        reply_markup=back_to_orders_keyboard(),
+        parse_mode="HTML",
+    )
+
+
+@router.message(OrderConsoleState.waiting_for_status_ids, F.text)
+async def choose_new_status(message: types.Message, state: FSMContext, identity: Identity):
+    if not identity.is_admin:
+        await state.clear()
+        return
+
+    ids = parse_order_ids(message.text)
+    if ids is None:
+        await message.answer(
+            f"❌ Raqamlar ro'yxati noto'g'ri yoki {BULK_LIMIT} tadan ko'p.",
+            reply_markup=back_to_orders_keyboard(),
+        )
+        return
+
+    await state.set_state(OrderConsoleState.choosing_status)
+    await state.update_data(order_ids=ids)
+    targets = [status for status in STATUS_LABELS if any(status in allowed for allowed in TRANSITIONS.values())]
+    buttons = [
+        InlineKeyboardButton(text=STATUS_LABELS[status], callback_data=f"admin:orders:bulk:{status}")
+        for status in targets
+    ]
+    await message.answer(
+        f"📦 {len(ids)} ta buyurtma: {describe_ids(ids)}\n\n"
+        "Yangi holatni tanlang. Joriy holatidan bu holatga o'tib bo'lmaydigan buyurtmalar o'zgarmaydi.",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            buttons[:2], buttons[2:],
+            [InlineKeyboardButton(text="❌ Bekor qilish", callback_data="admin:orders:cancel")],
+        ]),
+    )
+
+
+@router.callback_query(OrderConsoleState.choosing_status, F.data.startswith("admin:orders:bulk:"))
+async def apply_bulk_status(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    """
+    One set-based UPDATE for all selected orders, audited in the same transaction.
+    """
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    new_status = callback.data.removeprefix("admin:orders:bulk:")
+    ids = (await state.get_data()).get("order_ids") or []
+    if new_status not in STATUS_LABELS or not ids:
+        await callback.answer("❌ Noto'g'ri ma'lumot", show_alert=True)
+        return
+    await state.clear()
+
+    async with async_session() as session:
+        changed = await bulk_transition(session, ids, new_status)
+        if changed:
+            audit(session, identity.telegram_id, "orders.status", [row.id for row in changed],
+                  status=new_status, requested=len(ids))
+        await session.commit()
+
+    changed_ids = sorted(row.id for row in changed)
+    logger.info(f"Admin {identity.telegram_id} moved {len(changed_ids)}/{len(ids)} orders to {new_status}")
+    text = f"{STATUS_LABELS[new_status]}: {len(changed_ids)} ta buyurtma yangilandi."
+    if changed_ids:
+        text += f"\n{describe_ids(changed_ids)}"
+    skipped = len(ids) - len(changed_ids)
+    if skipped:
+        text += f"\n\n▫️ {skipped} ta o'zgarmadi (topilmadi yoki bu holatga o'tib bo'lmaydi)."
+    await callback.answer()
+    await callback.message.edit_text(text, reply_markup=back_to_orders_keyboard())
+
+
+# =================== Deletion =================== #
+
+@router.callback_query(F.data == "admin:orders:delete")
+async def ask_delete_ids(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    await callback.answer()
+    await state.set_state(OrderConsoleState.waiting_for_delete_ids)
+    await edit_if_changed(
+        callback.message,
+        "🗑️ <b>Buyurtmalarni o'chirish</b>\n\n"
+        f"Buyurtma raqamlarini yuboring (ko'pi bilan {BULK_LIMIT} ta), masalan: "
+        "<code>12, 15 20-25</code>",
+        reply_markup=back_to_orders_keyboard(),
+        parse_mode="HTML",
+    )
+
+
+@router.message(OrderConsoleState.waiting_for_delete_ids, F.text)
+async def confirm_delete_orders(message: types.Message, state: FSMContext, identity: Identity):
+    if not identity.is_admin:
+        await state.clear()
+        return
+
+    ids = parse_order_ids(message.text)
+    if ids is None:
+        await message.answer(
+            f"❌ Raqamlar ro'yxati noto'g'ri yoki {BULK_LIMIT} tadan ko'p.",
+            reply_markup=back_to_orders_keyboard(),
+        )
+        return
+
+    await state.set_state(OrderConsoleState.confirming_delete)
+    await state.update_data(order_ids=ids)
+    await message.answer(
+        f"⚠️ {len(ids)} ta buyurtma va ularning tarkibi butunlay o'chiriladi:\n{describe_ids(ids)}\n\n"
+        "Davom etamizmi?",
+        reply_markup=confirm_keyboard(
+            confirm_text="🗑️ O'chirish",
+            confirm_data="admin:orders:delete:confirm",
+            cancel_data="admin:orders:cancel",
+        ),
+    )
+
+
+@router.callback_query(OrderConsoleState.confirming_delete, F.data == "admin:orders:delete:confirm")
+async def delete_selected_orders(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    ids = (await state.get_data()).get("order_ids") or []
+    await state.clear()
+
+    async with async_session() as session:
+        deleted = await delete_orders(session, ids)
+        if deleted:
+            audit(session, identity.telegram_id, "orders.delete", [row.id for row in deleted],
+                  statuses=sorted({row.old_status for row in deleted}))
+        await session.commit()
+
+    logger.info(f"Admin {identity.telegram_id} deleted {len(deleted)}/{len(ids)} orders")
+    text = f"🗑️ {len(deleted)} ta buyurtma o'chirildi."
+    if len(deleted) < len(ids):
+        text += f"\n▫️ {len(ids) - len(deleted)} tasi topilmadi."
+    await callback.answer()
+    await callback.message.edit_text(text, reply_markup=back_to_orders_keyboard())
+
+
+@router.callback_query(F.data == "admin:orders:cancel")
+async def cancel_orders_action(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.answer()
+    await callback.message.edit_text("Buyurtmalarni boshqarish menyusi:", reply_markup=orders_menu())
+
+
+# Registered last: the other handlers above match more specific callbacks
 @router.callback_query(lambda c: c.data and c.data.startswith("admin:orders"))
 async def handle_orders_menu(callback: CallbackQuery):
     """
@@ -13,4 +446,4 @@ async def handle_orders_menu(callback: CallbackQuery):
     await callback.message.edit_text(
         "Buyurtmalarni boshqarish menyusi:",
         reply_markup=orders_menu()
-    )
\ No newline at end of file
+    )
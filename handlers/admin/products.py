@@ -1,9 +1,434 @@
-from aiogram import Router, types
-from aiogram.types import CallbackQuery
-from keyboards.admin_menu import product_menu
+import html
+import logging
+import os
+import time
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from aiogram import F, Router, types
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import CallbackQuery, InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import delete, exists, func, select
+
+from database.db import async_session
+from database.models import Cart, Drug, OrderItem, Pharmacy, PharmacyDrug
+from keyboards.admin_menu import confirm_keyboard, product_menu
+from middlewares.identity import Identity
+from utils.background_jobs import background_jobs
+from utils.cart_service import cart_service
+from utils.catalog_import import (
+    COLUMN_ALIASES,
+    SUPPORTED_EXTENSIONS,
+    ImportFileError,
+    ImportReport,
+    run_import,
+)
+from utils.catalog_sync import last_sync_run
+from utils.config import IMPORT_DIR, IMPORT_PROGRESS_INTERVAL, TIMEZONE
+from utils.pagination import estimated_count
+from utils.render_fingerprint import edit_if_changed
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
+# Bot API limit for files a bot can download
+MAX_FILE_SIZE = 20 * 1024 * 1024
+
+LOCAL_TZ = ZoneInfo(TIMEZONE)
+
+
+class ProductState(StatesGroup):
+    """
+    FSM states for catalog import and product deletion.
+    """
+    waiting_for_file = State()
+    checking_import = State()
+    confirming_import = State()
+    waiting_for_delete_id = State()
+    confirming_delete = State()
+
+
+def back_to_products_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Ortga", callback_data="admin:products:cancel")]
+    ])
+
+
+def import_report_text(report: ImportReport, title: str) -> str:
+    """
+    Import (or dry run) summary for the admin.
+    """
+    text = (
+        f"<b>{title}</b>\n\n"
+        f"📄 Qatorlar: {report.rows}\n"
+        f"💊 Dorilar: ➕ {report.drugs_new} yangi, ✏️ {report.drugs_changed} o'zgargan, "
+        f"▫️ {report.drugs_unchanged} o'zgarmagan\n"
+        f"🏪 Qoldiqlar: ➕ {report.stock_new} yangi, ✏️ {report.stock_changed} o'zgargan, "
+        f"▫️ {report.stock_unchanged} o'zgarmagan\n"
+    )
+    if report.error_count:
+        text += f"\n⚠️ Xatoli qatorlar: {report.error_count} (o'tkazib yuboriladi)\n"
+        text += "\n".join(f"• {html.escape(error)}" for error in report.errors)
+        if report.error_count > len(report.errors):
+            text += f"\n• ... yana {report.error_count - len(report.errors)} ta"
+    return text
+
+
+def cancel_check_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="❌ Bekor qilish", callback_data="admin:products:cancel")]
+    ])
+
+
+def progress_reporter(message: types.Message, title: str, reply_markup: Optional[InlineKeyboardMarkup] = None):
+    """
+    Progress callback for ``run_import`` that edits ``message`` at most every
+    IMPORT_PROGRESS_INTERVAL seconds.
+    """
+    last_edit = 0.0
+
+    async def report_progress(report: ImportReport):
+        nonlocal last_edit
+        if time.monotonic() - last_edit < IMPORT_PROGRESS_INTERVAL:
+            return
+        last_edit = time.monotonic()
+        await edit_if_changed(
+            message,
+            f"⏳ {title}: {report.rows} qator ({report.changes} o'zgarish, {report.error_count} xato)",
+            reply_markup=reply_markup,
+        )
+
+    return report_progress
+
+
+def import_job(user_id: int) -> str:
+    return f"catalog_import:{user_id}"
+
+
+def remove_import_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@router.callback_query(F.data == "admin:products:catalog")
+async def show_catalog(callback: CallbackQuery, identity: Identity):
+    """
+    Catalog size and the import file format.
+    """
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    await callback.answer()
+    async with async_session() as session:
+        drugs = await estimated_count(session, Drug)
+        stock_rows = await estimated_count(session, PharmacyDrug)
+        pharmacies = await session.scalar(select(func.count(Pharmacy.id)))
+        last_sync = await last_sync_run(session)
+
+    if last_sync is None:
+        sync_line = "🔄 PharmAgency sinxronlash: hali bo'lmagan\n"
+    elif last_sync.status == "failed":
+        sync_line = f"🔄 Oxirgi sinxronlash: ❌ {last_sync.started_at.astimezone(LOCAL_TZ):%d.%m.%Y %H:%M} (xato)\n"
+    else:
+        sync_line = (
+            f"🔄 Oxirgi sinxronlash: {last_sync.started_at.astimezone(LOCAL_TZ):%d.%m.%Y %H:%M}, "
+            f"{(last_sync.duration_ms or 0) / 1000:.0f} s\n"
+            f"    ➕ {last_sync.inserted + last_sync.restored} ✏️ {last_sync.updated} "
+            f"🗑 {last_sync.deleted} ▫️ {last_sync.unchanged}\n"
+        )
+
+    columns = "\n".join(
+        f"• <code>{column}</code>" + (f" ({', '.join(aliases[1:])})" if len(aliases) > 1 else "")
+        for column, aliases in COLUMN_ALIASES.items()
+    )
+    await edit_if_changed(
+        callback.message,
+        "📁 <b>Katalog</b>\n\n"
+        f"💊 Dorilar: ~{drugs}\n"
+        f"🏪 Dorixonalar: {pharmacies}\n"
+        f"📦 Qoldiq yozuvlari: ~{stock_rows}\n"
+        f"{sync_line}\n"
+        "<b>Import fayli (CSV yoki XLSX) ustunlari:</b>\n"
+        f"{columns}\n\n"
+        "<i>Dori drug_id bo'yicha, u bo'lmasa nomi va ishlab chiqaruvchisi bo'yicha topiladi. "
+        "Bo'sh katak saqlangan qiymatni o'zgartirmaydi.</i>",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="📥 Fayl yuklash", callback_data="admin:products:add")],
+            [InlineKeyboardButton(text="🔙 Ortga", callback_data="admin:products")],
+        ]),
+        parse_mode="HTML",
+    )
+
+
+@router.callback_query(F.data.in_({"admin:products:add", "admin:products:edit"}))
+async def ask_import_file(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    """
+    Adding and editing products both go through a catalog file.
+    """
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    await callback.answer()
+    await state.set_state(ProductState.waiting_for_file)
+    await edit_if_changed(
+        callback.message,
+        "📥 <b>Katalog faylini yuboring</b> (CSV yoki XLSX, 20 MB gacha).\n\n"
+        "Yangi dorilar qo'shiladi, mavjudlari yangilanadi, <code>pharmacy_id</code> "
+        "va <code>residual</code> ustunlari bo'lsa dorixona qoldiqlari ham yangilanadi.\n"
+        "Avval tekshiruv natijasi ko'rsatiladi, o'zgarishlar tasdiqlangandan keyin yoziladi.\n\n"
+        "Ustunlar ro'yxati: 📁 Katalog",
+        reply_markup=back_to_products_keyboard(),
+        parse_mode="HTML",
+    )
+
+
+@router.message(ProductState.waiting_for_file, F.document)
+async def receive_import_file(message: types.Message, state: FSMContext, identity: Identity):
+    """
+    Download the file and start the dry run; its diff is shown when done.
+    """
+    if not identity.is_admin:
+        await state.clear()
+        return
+
+    document = message.document
+    extension = os.path.splitext(document.file_name or "")[1].lower()
+    if extension not in SUPPORTED_EXTENSIONS:
+        await message.answer("❌ Faqat CSV yoki XLSX fayl yuboring.", reply_markup=back_to_products_keyboard())
+        return
+    if document.file_size and document.file_size > MAX_FILE_SIZE:
+        await message.answer("❌ Fayl 20 MB dan katta.", reply_markup=back_to_products_keyboard())
+        return
+
+    if background_jobs.running(import_job(message.from_user.id)):
+        await message.answer("⏳ Oldingi import hali tugamadi.", reply_markup=back_to_products_keyboard())
+        return
+
+    os.makedirs(IMPORT_DIR, exist_ok=True)
+    path = os.path.join(IMPORT_DIR, f"{message.from_user.id}_{document.file_unique_id}{extension}")
+    await message.bot.download(document, destination=path)
+
+    progress = await message.answer("⏳ Fayl tekshirilmoqda...", reply_markup=cancel_check_keyboard())
+    await state.set_state(ProductState.checking_import)
+    await state.update_data(import_path=path)
+    background_jobs.start(import_job(message.from_user.id), check_import(progress, state, path))
+
+
+async def check_import(progress: types.Message, state: FSMContext, path: str):
+    """
+    Background dry run of an uploaded file; asks to confirm if it changes anything.
+    """
+    report = error = None
+    try:
+        report = await run_import(
+            path, apply=False, progress=progress_reporter(progress, "Tekshirilmoqda", cancel_check_keyboard())
+        )
+    except ImportFileError as e:
+        error = html.escape(str(e))
+    except Exception as e:
+        logger.error(f"Error checking catalog file {path}: {e}", exc_info=True)
+        error = "Faylni o'qib bo'lmadi."
+
+    if await state.get_state() != ProductState.checking_import.state:
+        # The admin left the import meanwhile
+        remove_import_file(path)
+        return
+    if error:
+        await state.clear()
+        remove_import_file(path)
+        await progress.edit_text(f"❌ {error}", reply_markup=back_to_products_keyboard(), parse_mode="HTML")
+        return
+
+    text = import_report_text(report, "📊 Tekshiruv natijasi")
+    if not report.changes:
+        remove_import_file(path)
+        await state.clear()
+        await progress.edit_text(
+            text + "\n\nYoziladigan o'zgarish yo'q.",
+            reply_markup=back_to_products_keyboard(),
+            parse_mode="HTML",
+        )
+        return
+
+    await state.set_state(ProductState.confirming_import)
+    await state.update_data(import_path=path)
+    await progress.edit_text(
+        text + "\n\nO'zgarishlarni yozaymi?",
+        reply_markup=confirm_keyboard(
+            confirm_text="✅ Yozish",
+            confirm_data="admin:products:import:apply",
+            cancel_data="admin:products:cancel",
+        ),
+        parse_mode="HTML",
+    )
+
+
+@router.message(ProductState.waiting_for_file)
+async def expect_import_file(message: types.Message):
+    await message.answer("📎 Iltimos, CSV yoki XLSX faylni hujjat sifatida yuboring.")
+
+
+@router.callback_query(ProductState.confirming_import, F.data == "admin:products:import:apply")
+async def apply_import(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    """
+    Start writing the checked file, one transaction per chunk.
+    """
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    path = (await state.get_data()).get("import_path")
+    await state.clear()
+    if not path or not os.path.exists(path):
+        await callback.answer("❌ Fayl topilmadi, qaytadan yuboring.", show_alert=True)
+        return
+
+    if not background_jobs.start(import_job(callback.from_user.id), write_import(callback.message, path)):
+        await callback.answer("⏳ Oldingi import hali tugamadi.", show_alert=True)
+        return
+    await callback.answer("⏳ Yozish boshlandi")
+
+
+async def write_import(message: types.Message, path: str):
+    """
+    Background import of a checked file; edits ``message`` with progress and the result.
+    """
+    await message.edit_text("⏳ O'zgarishlar yozilmoqda...")
+    try:
+        report = await run_import(path, apply=True, progress=progress_reporter(message, "Yozilmoqda"))
+    except Exception as e:
+        logger.error(f"Error importing catalog file {path}: {e}", exc_info=True)
+        await message.edit_text(
+            "❌ Import to'xtadi. Oldingi qismlar yozilgan; faylni qayta yuborish xavfsiz.",
+            reply_markup=back_to_products_keyboard(),
+        )
+        return
+    finally:
+        remove_import_file(path)
+
+    await message.edit_text(
+        import_report_text(report, "✅ Import yakunlandi"),
+        reply_markup=back_to_products_keyboard(),
+        parse_mode="HTML",
+    )
+
+
+@router.callback_query(F.data == "admin:products:delete")
+async def ask_delete_id(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    await callback.answer()
+    await state.set_state(ProductState.waiting_for_delete_id)
+    await edit_if_changed(
+        callback.message,
+        "🗑️ O'chiriladigan dorining ID raqamini yuboring.",
+        reply_markup=back_to_products_keyboard(),
+    )
+
+
+@router.message(ProductState.waiting_for_delete_id, F.text)
+async def confirm_delete(message: types.Message, state: FSMContext, identity: Identity):
+    """
+    Show what deleting the drug would affect.
+    """
+    if not identity.is_admin:
+        await state.clear()
+        return
+
+    if not message.text.strip().isdigit():
+        await message.answer("❌ ID raqam bo'lishi kerak.", reply_markup=back_to_products_keyboard())
+        return
+
+    drug_id = int(message.text.strip())
+    async with async_session() as session:
+        drug = await session.get(Drug, drug_id)
+        if drug is None:
+            await message.answer("❌ Bunday dori topilmadi.", reply_markup=back_to_products_keyboard())
+            return
+        stocked = await session.scalar(
+            select(func.count()).select_from(PharmacyDrug).where(PharmacyDrug.drug_id == drug_id)
+        )
+        ordered = await session.scalar(select(exists().where(OrderItem.drug_id == drug_id)))
+
+    text = (
+        f"🗑️ <b>{html.escape(drug.name)}</b>"
+        f"{' — ' + html.escape(drug.manufacturer) if drug.manufacturer else ''}\n"
+        f"🏪 {stocked} ta dorixonada qoldiq yozuvi bor.\n\n"
+    )
+    if ordered:
+        text += (
+            "⚠️ Bu dori buyurtmalarda bor, shuning uchun katalogda qoladi: "
+            "faqat dorixonalar va savatlardan olib tashlanadi."
+        )
+    else:
+        text += "Dori katalogdan butunlay o'chiriladi."
+
+    await state.set_state(ProductState.confirming_delete)
+    await state.update_data(delete_drug_id=drug_id)
+    await message.answer(
+        text,
+        parse_mode="HTML",
+        reply_markup=confirm_keyboard(
+            confirm_text="🗑️ O'chirish",
+            confirm_data="admin:products:delete:confirm",
+            cancel_data="admin:products:cancel",
+        ),
+    )
+
+
+@router.callback_query(ProductState.confirming_delete, F.data == "admin:products:delete:confirm")
+async def delete_product(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    drug_id = (await state.get_data()).get("delete_drug_id")
+    await state.clear()
+
+    async with async_session() as session:
+        await session.execute(delete(PharmacyDrug).where(PharmacyDrug.drug_id == drug_id))
+        await session.execute(delete(Cart).where(Cart.drug_id == drug_id))
+        # Order history keeps its items (order_items cascade from drugs)
+        removed = (await session.execute(
+            delete(Drug)
+            .where(Drug.id == drug_id, ~exists().where(OrderItem.drug_id == drug_id))
+            .returning(Drug.id)
+        )).scalar_one_or_none()
+        await session.commit()
+    cart_service.forget_drug(drug_id)
+
+    logger.info(f"Admin {identity.telegram_id} deleted drug #{drug_id} (catalog row removed: {bool(removed)})")
+    await callback.answer("✅ O'chirildi")
+    await callback.message.edit_text(
+        "✅ Dori katalogdan o'chirildi." if removed else "✅ Dori sotuvdan olindi.",
+        reply_markup=back_to_products_keyboard(),
+    )
+
+
+@router.callback_query(F.data == "admin:products:cancel")
+async def cancel_products_action(callback: CallbackQuery, state: FSMContext):
+    if await state.get_state() == ProductState.checking_import.state:
+        # Only a dry run is stopped: an import being written finishes its chunks
+        background_jobs.cancel(import_job(callback.from_user.id))
+    path = (await state.get_data()).get("import_path")
+    if path:
+        remove_import_file(path)
+    await state.clear()
+    await callback.answer()
+    await callback.message.edit_text(
+        "Mahsulotlarni boshqarish menyusi:",
+        reply_markup=product_menu()
+    )
+
+
 @router.callback_query(lambda c: c.data and c.data.startswith("admin:products"))
 async def handle_products_menu(callback: CallbackQuery):
     """
@@ -13,4 +438,4 @@ async def handle_products_menu(callback: CallbackQuery):
     await callback.message.edit_text(
         "Mahsulotlarni boshqarish menyusi:",
         reply_markup=product_menu()
-    )
\ No newline at end of file
+    )
@@ -1,5 +1,5 @@
 from aiogram import Router
-from . import users, products, orders, settings, back_button
+from . import users, products, orders, settings, broadcast, moderation, back_button
 
 router = Router()
 
@@ -8,4 +8,6 @@ router.include_router(users.router)
 router.include_router(products.router)
 router.include_router(orders.router)
 router.include_router(settings.router)
+router.include_router(broadcast.router)
+router.include_router(moderation.router)
 router.include_router(back_button.router)
\ No newline at end of file
@@ -1,16 +1,276 @@
-from aiogram import Router, types
-from aiogram.types import CallbackQuery
-from keyboards.admin_menu import settings_menu
+import html
+import logging
+import os
+import time
+
+from aiogram import F, Router, types
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import CallbackQuery, FSInputFile
+from keyboards.admin_menu import confirm_keyboard, settings_menu, simple_back_keyboard
+from middlewares.identity import Identity, identity_cache
+from utils.background_jobs import background_jobs
+from utils.cart_service import cart_service
+from utils.config import BACKUP_DIR
+from utils.db_backup import BackupError, BackupSummary, busy, check_backup, create_backup, restore_backup
+from utils.pharmacy_cache import invalidate_pharmacies
+from utils.render_fingerprint import edit_if_changed
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
+# Bot API limits: bots upload up to 50 MB and download up to 20 MB
+MAX_UPLOAD_SIZE = 50 * 1024 * 1024
+MAX_DOWNLOAD_SIZE = 20 * 1024 * 1024
+
+# Seconds between progress edits
+PROGRESS_INTERVAL = 2.0
+
+# Background job name: one backup or restore at a time
+BACKUP_JOB = "db_backup"
+
+
+class SettingsState(StatesGroup):
+    """
+    FSM states for restoring a backup.
+    """
+    waiting_for_backup = State()
+    confirming_restore = State()
+
+
+def back_to_settings_keyboard():
+    return simple_back_keyboard(callback_data="admin:settings")
+
+
+def summary_text(summary: BackupSummary) -> str:
+    tables = "\n".join(f"• <code>{table.name}</code>: {table.rows}" for table in summary.tables if table.rows)
+    return (
+        f"🗓 {html.escape(summary.created_at[:19].replace('T', ' '))} UTC, sxema v{summary.schema}\n"
+        f"📊 Jami: {summary.rows} qator\n{tables}"
+    )
+
+
+def progress_reporter(message: types.Message, title: str):
+    """
+    Progress callback that edits ``message`` at most every PROGRESS_INTERVAL seconds.
+    """
+    last_edit = 0.0
+
+    async def report_progress(table: str, rows: int):
+        nonlocal last_edit
+        if time.monotonic() - last_edit < PROGRESS_INTERVAL:
+            return
+        last_edit = time.monotonic()
+        await edit_if_changed(message, f"⏳ {title}: {table} ({rows} qator)")
+
+    return report_progress
+
+
+def remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+@router.callback_query(F.data == "admin:settings:backup")
+async def make_backup(callback: CallbackQuery, identity: Identity):
+    """
+    Start streaming all tables into a compressed archive; it is sent as a
+    document when done.
+    """
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+    if busy() or not background_jobs.start(BACKUP_JOB, send_backup(callback.message, identity.telegram_id)):
+        await callback.answer("⏳ Zaxira yoki tiklash allaqachon bajarilmoqda", show_alert=True)
+        return
+    await callback.answer()
+
+
+async def send_backup(message: types.Message, admin_id: int):
+    """
+    Background backup; edits ``message`` with progress and the result.
+    """
+    await message.edit_text("⏳ Zaxira nusxasi yaratilmoqda...")
+    try:
+        path, summary = await create_backup(progress=progress_reporter(message, "Zaxiralanmoqda"))
+    except Exception as e:
+        logger.error(f"Backup failed: {e}", exc_info=True)
+        await message.edit_text("❌ Zaxira nusxasini yaratib bo'lmadi.", reply_markup=back_to_settings_keyboard())
+        return
+
+    size = os.path.getsize(path)
+    logger.info(f"Admin {admin_id} created backup {os.path.basename(path)} ({size} bytes)")
+    if size > MAX_UPLOAD_SIZE:
+        await message.edit_text(
+            f"✅ Zaxira nusxasi yaratildi, lekin u {size // (1024 * 1024)} MB - Telegram orqali "
+            f"yuborib bo'lmaydi.\nServerdagi fayl: <code>{html.escape(path)}</code>\n\n{summary_text(summary)}",
+            reply_markup=back_to_settings_keyboard(),
+            parse_mode="HTML",
+        )
+        return
+
+    await message.answer_document(
+        FSInputFile(path),
+        caption=f"💾 Zaxira nusxasi\n\n{summary_text(summary)}",
+        parse_mode="HTML",
+    )
+    await message.edit_text("✅ Zaxira nusxasi yuborildi.", reply_markup=back_to_settings_keyboard())
+
+
+@router.callback_query(F.data == "admin:settings:restore")
+async def ask_backup_file(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    await callback.answer()
+    await state.set_state(SettingsState.waiting_for_backup)
+    await edit_if_changed(
+        callback.message,
+        "♻️ <b>Ma'lumotlarni tiklash</b>\n\n"
+        "Zaxira faylini (<code>.ndjson.gz</code>, 20 MB gacha) yuboring.\n"
+        "Fayl avval to'liq tekshiriladi. Tasdiqlangandan keyin bazadagi barcha "
+        "ma'lumotlar zaxiradagisi bilan almashtiriladi.\n\n"
+        "⚠️ Bir nechta bot nusxasi ishlayotgan bo'lsa, tiklashdan oldin qolganlarini to'xtating.",
+        reply_markup=simple_back_keyboard(callback_data="admin:settings:cancel", text="❌ Bekor qilish"),
+        parse_mode="HTML",
+    )
+
+
+@router.message(SettingsState.waiting_for_backup, F.document)
+async def receive_backup_file(message: types.Message, state: FSMContext, identity: Identity):
+    """
+    Download the archive and verify it without touching the database.
+    """
+    if not identity.is_admin:
+        await state.clear()
+        return
+
+    document = message.document
+    if not (document.file_name or "").endswith(".gz"):
+        await message.answer("❌ Zaxira fayli .ndjson.gz bo'lishi kerak.", reply_markup=back_to_settings_keyboard())
+        return
+    if document.file_size and document.file_size > MAX_DOWNLOAD_SIZE:
+        await message.answer("❌ Fayl 20 MB dan katta.", reply_markup=back_to_settings_keyboard())
+        return
+
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    # Not *.ndjson.gz: uploads must not count against the kept backups
+    path = os.path.join(BACKUP_DIR, f"restore_{message.from_user.id}_{document.file_unique_id}.gz.upload")
+    await message.bot.download(document, destination=path)
+
+    progress = await message.answer("⏳ Fayl tekshirilmoqda...")
+    try:
+        summary = await check_backup(path)
+    except BackupError as e:
+        remove_file(path)
+        await progress.edit_text(
+            f"❌ {html.escape(str(e))}", reply_markup=back_to_settings_keyboard(), parse_mode="HTML"
+        )
+        return
+    except Exception as e:
+        logger.error(f"Error checking backup {path}: {e}", exc_info=True)
+        remove_file(path)
+        await progress.edit_text("❌ Faylni o'qib bo'lmadi.", reply_markup=back_to_settings_keyboard())
+        return
+
+    await state.set_state(SettingsState.confirming_restore)
+    await state.update_data(restore_path=path)
+    await progress.edit_text(
+        f"✅ Fayl butun.\n\n{summary_text(summary)}\n\n"
+        "⚠️ Bazadagi barcha ma'lumotlar shu zaxira bilan almashtiriladi. Davom etamizmi?",
+        reply_markup=confirm_keyboard(
+            confirm_text="♻️ Tiklash",
+            confirm_data="admin:settings:restore:apply",
+            cancel_data="admin:settings:cancel",
+        ),
+        parse_mode="HTML",
+    )
+
+
+@router.message(SettingsState.waiting_for_backup)
+async def expect_backup_file(message: types.Message):
+    await message.answer("📎 Iltimos, zaxira faylini hujjat sifatida yuboring.")
+
+
+@router.callback_query(SettingsState.confirming_restore, F.data == "admin:settings:restore:apply")
+async def apply_restore(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    """
+    Start replacing the database contents with the checked archive (one
+    transaction).
+    """
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    path = (await state.get_data()).get("restore_path")
+    await state.clear()
+    if not path or not os.path.exists(path):
+        await callback.answer("❌ Fayl topilmadi, qaytadan yuboring.", show_alert=True)
+        return
+    if busy() or not background_jobs.start(BACKUP_JOB, restore(callback.message, path, identity.telegram_id)):
+        await callback.answer("⏳ Zaxira yoki tiklash allaqachon bajarilmoqda", show_alert=True)
+        return
+    await callback.answer("⏳ Tiklash boshlandi")
+
+
+async def restore(message: types.Message, path: str, admin_id: int):
+    """
+    Background restore; edits ``message`` with progress and the result.
+    """
+    await message.edit_text("⏳ Ma'lumotlar tiklanmoqda...")
+    try:
+        # Cart row ids change with the restore: no write-behind flush may run meanwhile
+        async with cart_service.suspended():
+            summary = await restore_backup(path, progress=progress_reporter(message, "Tiklanmoqda"))
+    except BackupError as e:
+        await message.edit_text(
+            f"❌ {html.escape(str(e))}\nBaza o'zgarmadi.", reply_markup=back_to_settings_keyboard(), parse_mode="HTML"
+        )
+        return
+    except Exception as e:
+        logger.error(f"Restore of {path} failed: {e}", exc_info=True)
+        await message.edit_text(
+            "❌ Tiklash to'xtadi. Baza o'zgarmadi.", reply_markup=back_to_settings_keyboard()
+        )
+        return
+    finally:
+        remove_file(path)
+
+    # Bulk loads bypass the ORM events that keep these caches current
+    identity_cache.clear()
+    invalidate_pharmacies()
+
+    logger.warning(f"Admin {admin_id} restored the database from a backup ({summary.rows} rows)")
+    await message.edit_text(
+        f"✅ Ma'lumotlar tiklandi.\n\n{summary_text(summary)}",
+        reply_markup=back_to_settings_keyboard(),
+        parse_mode="HTML",
+    )
+
+
+@router.callback_query(F.data == "admin:settings:cancel")
+async def cancel_settings_action(callback: CallbackQuery, state: FSMContext):
+    path = (await state.get_data()).get("restore_path")
+    if path:
+        remove_file(path)
+    await state.clear()
+    await callback.answer()
+    await callback.message.edit_text("Sozlamalar menyusi:", reply_markup=settings_menu())
+
+
+# Registered last: the other handlers above match more specific callbacks
 @router.callback_query(lambda c: c.data and c.data.startswith("admin:settings"))
-async def handle_settings_menu(callback: CallbackQuery):
+async def handle_settings_menu(callback: CallbackQuery, state: FSMContext):
     """
     Handle admin settings menu interactions.
     """
+    await state.clear()
     await callback.answer()
     await callback.message.edit_text(
         "Sozlamalar menyusi:",
         reply_markup=settings_menu()
-    )
\ No newline at end of file
+    )
@@ -1,24 +1,36 @@
 import html
-import json
 import math
 
 from typing import Optional
 
-from aiogram import Router, types
+from aiogram import F, Router, types
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
 
 from keyboards.admin_menu import users_menu
 
 from sqlalchemy.future import select
 
-from database.models import User
+from database.models import User, UserStatus
 from database.db import async_session
-from sqlalchemy import func
+
+from middlewares.identity import Identity
+from utils.pagination import NEXT, PREV, estimated_count, fetch_id_page
+from utils.render_scheduler import render_scheduler
+from utils.user_search import MIN_NAME_LENGTH, MIN_PHONE_DIGITS, search_users
 
 router = Router()
 
 USERS_PER_PAGE = 10  # Number of users to display per page
 
+
+class UserSearchState(StatesGroup):
+    """
+    FSM state for the admin user search.
+    """
+    waiting_for_query = State()
+
 async def safe_edit_message_text(
     message: types.Message, 
     text: str, 
@@ -28,26 +40,16 @@ async def safe_edit_message_text(
     Safely edit a message's text to avoid Telegram's "message is not modified" error.
     """
     try:
-        # Compare text
-        text_changed = message.text != text
-        
-        # Compare markup by converting to dict and then to JSON string
-        current_markup_json = json.dumps(
-            message.reply_markup.model_dump() if message.reply_markup else None,
-            sort_keys=True
-        )
-        new_markup_json = json.dumps(
-            reply_markup.model_dump() if reply_markup else None,
-            sort_keys=True
-        )
-        markup_changed = current_markup_json != new_markup_json
-
-        if text_changed or markup_changed:
-            await message.edit_text(text, reply_markup=reply_markup, parse_mode="HTML")
+        # Skipped in O(1) when the same render is already shown (fingerprint cache);
+        # otherwise rate limited per chat
+        await render_scheduler.edit(message, text, reply_markup=reply_markup, parse_mode="HTML")
     except Exception as e:
         print(f"Error editing message: {e}")
 
-@router.callback_query(lambda c: c.data and c.data.startswith("admin:users") and not c.data.startswith("admin:users:list"))
+@router.callback_query(
+    lambda c: c.data and c.data.startswith("admin:users")
+    and not c.data.startswith(("admin:users:list", "admin:users:search"))
+)
 async def handle_users_menu(callback: CallbackQuery):
     """
     Handle user management menu interactions.
@@ -59,114 +61,97 @@ async def handle_users_menu(callback: CallbackQuery):
         reply_markup=users_menu()
     )
 
+def users_list_callback(cursor: Optional[str] = None, direction: str = NEXT, page: int = 1) -> str:
+    """
+    Callback data for a user list page: "admin:users:list:<direction><cursor>:<page>".
+    """
+    return f"admin:users:list:{direction + cursor if cursor else ''}:{page}"
+
+
 @router.callback_query(lambda c: c.data and c.data.startswith("admin:users:list"))
 async def list_users(callback: CallbackQuery):
     """
     Handle the "Ro'yxat" button to display a list of all users with pagination.
     """
     await callback.answer()  # Answer immediately to stop loading
-    
-    # Parse page number from callback data
-    parts = callback.data.split(":")
-    page = int(parts[3]) if len(parts) > 3 else 1
-    
-    async with async_session() as session:
-        # Get total count efficiently
-        total_users = int(await session.scalar(select(func.count(User.id))) or 0)
 
-        # Normalize page based on total_users so we fetch the correct slice
-        total_pages = math.ceil(total_users / USERS_PER_PAGE) if total_users else 1
-        page = max(1, min(page, total_pages))
+    # Parse position from callback data; anything else (old buttons) opens the first page
+    parts = callback.data.split(":")
+    cursor, direction, page = None, NEXT, 1
+    if len(parts) == 5 and parts[3][:1] in (NEXT, PREV) and parts[3][1:].isdigit() and parts[4].isdigit():
+        direction, cursor, page = parts[3][0], parts[3][1:], int(parts[4])
 
-        # Calculate offset for the current page and fetch only that page
-        offset = (page - 1) * USERS_PER_PAGE
-        result = await session.execute(
-            select(User).order_by(User.id).limit(USERS_PER_PAGE).offset(offset)
+    async with async_session() as session:
+        # Approximate for big tables, cached; not worth a full count per page turn
+        total_users = await estimated_count(session, User)
+        users_page = await fetch_id_page(
+            session, select(User), User.id,
+            limit=USERS_PER_PAGE, cursor=cursor, direction=direction,
         )
-        page_users = result.scalars().all()
-
-        # Provide an object that supports slicing as the original code expects
-        class _PagedWindow:
-            def __init__(self, items, offset, total):
-                self._items = items
-                self._offset = offset
-                self._total = total
-
-            def __getitem__(self, key):
-                if isinstance(key, slice):
-                    start = 0 if key.start is None else key.start
-                    stop = self._total if key.stop is None else key.stop
-                    rel_start = max(0, start - self._offset)
-                    rel_stop = max(0, stop - self._offset)
-                    return self._items[rel_start:rel_stop]
-                else:
-                    rel = key - self._offset
-                    if 0 <= rel < len(self._items):
-                        return self._items[rel]
-                    raise IndexError
-
-        # all_users behaves like the full list when sliced, but only fetches the current page
-        all_users = _PagedWindow(page_users, offset, total_users)
-    if total_users == 0:
+        if not users_page.items and cursor is not None:
+            # The users around the cursor are gone: start over
+            users_page = await fetch_id_page(session, select(User), User.id, limit=USERS_PER_PAGE)
+
+    if not users_page.items:
         await safe_edit_message_text(
-            callback.message, 
+            callback.message,
             "Foydalanuvchilar ro'yxati bo'sh.",
             reply_markup=users_menu()
         )
         return
-    
-    # Calculate pagination
-    total_pages = math.ceil(total_users / USERS_PER_PAGE)
-    page = max(1, min(page, total_pages))  # Ensure page is within valid range
-    
+
+    if users_page.prev_cursor is None:
+        page = 1
     start_idx = (page - 1) * USERS_PER_PAGE
-    end_idx = start_idx + USERS_PER_PAGE
-    
-    # Get users for current page
-    users_page = all_users[start_idx:end_idx]
-    
+    total_pages = max(page, math.ceil(total_users / USERS_PER_PAGE))
+
     # Format the user list
     user_list = "\n".join([
         f"{idx + start_idx + 1}. {html.escape(user.fullname or 'Nomalum')} "
         f"(@{html.escape(user.username or 'N/A')}) - "
         f"{html.escape(user.phone_number or 'Telefon raqam mavjud emas!')}"
-        for idx, user in enumerate(users_page)
+        for idx, user in enumerate(users_page.items)
     ])
-    
+
     # Create pagination keyboard
     keyboard = []
     nav_buttons = []
-    
-    if page > 1:
+
+    if users_page.prev_cursor:
         nav_buttons.append(
-            InlineKeyboardButton(text="⬅️ Oldingi", callback_data=f"admin:users:list:{page-1}")
+            InlineKeyboardButton(
+                text="⬅️ Oldingi",
+                callback_data=users_list_callback(users_page.prev_cursor, PREV, page - 1)
+            )
         )
-    
+
     nav_buttons.append(
         InlineKeyboardButton(text=f"{page}/{total_pages}", callback_data="noop")
     )
-    
-    if page < total_pages:
+
+    if users_page.next_cursor:
         nav_buttons.append(
-            InlineKeyboardButton(text="Keyingi ➡️", callback_data=f"admin:users:list:{page+1}")
+            InlineKeyboardButton(
+                text="Keyingi ➡️",
+                callback_data=users_list_callback(users_page.next_cursor, NEXT, page + 1)
+            )
         )
-    
-    if nav_buttons:
-        keyboard.append(nav_buttons)
-    
+
+    keyboard.append(nav_buttons)
+
     # Add back button
     keyboard.append([
         InlineKeyboardButton(text="🔙 Ortga", callback_data="admin:users")
     ])
-    
+
     reply_markup = InlineKeyboardMarkup(inline_keyboard=keyboard)
-    
+
     text = (
         f"<b>Foydalanuvchilar ro'yxati</b>\n"
-        f"Jami: {total_users} ta foydalanuvchi\n\n"
+        f"Jami: ~{total_users} ta foydalanuvchi\n\n"
         f"{user_list}"
     )
-    
+
     await safe_edit_message_text(
         callback.message,
         text,
@@ -176,4 +161,81 @@ async def list_users(callback: CallbackQuery):
 @router.callback_query(lambda c: c.data == "noop")
 async def handle_noop(callback: CallbackQuery):
     """Handle no-operation callback (page indicator)"""
-    await callback.answer()
\ No newline at end of file
+    await callback.answer()
+
+
+def search_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔙 Ortga", callback_data="admin:users:search:cancel")]
+    ])
+
+
+@router.callback_query(F.data == "admin:users:search")
+async def ask_search_query(callback: CallbackQuery, state: FSMContext, identity: Identity):
+    """
+    Ask the admin what to search for.
+    """
+    if not identity.is_admin:
+        await callback.answer("❌ Sizda ruxsat yo'q!", show_alert=True)
+        return
+
+    await callback.answer()
+    await state.set_state(UserSearchState.waiting_for_query)
+    await safe_edit_message_text(
+        callback.message,
+        "🔎 <b>Foydalanuvchini qidirish</b>\n\n"
+        "Ism, @username, telefon raqam (to'liq yoki oxirgi raqamlari) "
+        "yoki Telegram ID yuboring.",
+        reply_markup=search_keyboard()
+    )
+
+
+@router.callback_query(F.data == "admin:users:search:cancel")
+async def cancel_search(callback: CallbackQuery, state: FSMContext):
+    await state.clear()
+    await callback.answer()
+    await safe_edit_message_text(
+        callback.message,
+        "Foydalanuvchilarni boshqarish menyusi:",
+        reply_markup=users_menu()
+    )
+
+
+def format_found_user(index: int, user: User) -> str:
+    role = "🏪 Dorixona admini" if user.status == UserStatus.PHARMACY_ADMIN else "👤 Foydalanuvchi"
+    line = (
+        f"{index}. <b>{html.escape(user.fullname or 'Nomalum')}</b> "
+        f"(@{html.escape(user.username or 'N/A')})\n"
+        f"   📞 {html.escape(user.phone_number or 'Telefon raqam mavjud emas!')}\n"
+        f"   🆔 <code>{user.telegram_id}</code> · {role}"
+    )
+    if user.is_blocked:
+        line += " · 🚫 botni bloklagan"
+    return line
+
+
+@router.message(UserSearchState.waiting_for_query, F.text)
+async def run_search(message: types.Message, state: FSMContext, identity: Identity):
+    """
+    Show the best matches; the admin can send another query right away.
+    """
+    if not identity.is_admin:
+        await state.clear()
+        return
+
+    query = message.text.strip()
+    users = await search_users(query)
+
+    if users:
+        text = (
+            f"🔎 <b>Natijalar:</b> {html.escape(query)}\n\n"
+            + "\n\n".join(format_found_user(i, user) for i, user in enumerate(users, 1))
+            + "\n\n<i>Yana qidirish uchun yangi so'rov yuboring.</i>"
+        )
+    else:
+        text = (
+            f"🔎 <b>{html.escape(query)}</b> bo'yicha hech kim topilmadi.\n\n"
+            f"<i>Kamida {MIN_NAME_LENGTH} ta harf yoki {MIN_PHONE_DIGITS} ta raqam yuboring.</i>"
+        )
+
+    await message.answer(text, parse_mode="HTML", reply_markup=search_keyboard())
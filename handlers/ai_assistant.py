@@ -2,7 +2,6 @@
 import os
 import re
 import logging
-import requests
 from datetime import datetime
 from aiogram import Router, types
 from aiogram.fsm.context import FSMContext
@@ -10,9 +9,13 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from typing import Dict, List
 
+from utils.lazy_import import lazy_import
+
 router = Router()
 logger = logging.getLogger(__name__)
 
+requests = lazy_import("requests")
+
 # API settings
 API_KEY = os.getenv("GROQ_API_KEY")
 URL = "https://api.groq.com/openai/v1/chat/completions"
@@ -1,8 +1,8 @@
 # handlers/barcode_verification.py
+import asyncio
 import os
 import io
 import logging
-import requests
 import json
 import warnings
 import urllib3
@@ -13,21 +13,26 @@ from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from typing import Dict, Optional, Tuple
 
+from utils.lazy_import import lazy_import
+
 
 warnings.filterwarnings('ignore', message='Unverified HTTPS request')
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
-# Import barcode libraries
-try:
-    from PIL import Image
-    import cv2
-    import numpy as np
-    from pyzbar import pyzbar
-except ImportError:
-    Image = None
-    cv2 = None
-    np = None
-    pyzbar = None
+# Heavy libraries are imported on first use (or pre-warmed after startup)
+requests = lazy_import("requests")
+Image = lazy_import("PIL.Image")
+cv2 = lazy_import("cv2")
+np = lazy_import("numpy")
+pyzbar = lazy_import("pyzbar.pyzbar")
+
+
+def barcode_libraries_available() -> bool:
+    """
+    True if the image barcode scanner libraries are installed.
+    """
+    return all(module.available for module in (Image, cv2, np, pyzbar))
+
 
 router = Router()
 logger = logging.getLogger(__name__)
@@ -129,7 +134,7 @@ async def decode_barcode_from_image(image_bytes: bytes) -> Optional[Tuple[str, s
     Decode barcode from image bytes
     Returns (decoded_data, barcode_type) or None
     """
-    if not all([Image, cv2, np, pyzbar]):
+    if not barcode_libraries_available():
         logger.error("Required libraries not installed for barcode detection")
         return None
     
@@ -400,8 +405,8 @@ async def process_barcode_image(message: types.Message, state: FSMContext):
     Process uploaded barcode image
     """
     try:
-        # Check if libraries are available
-        if not all([Image, cv2, np, pyzbar]):
+        # Check if libraries are available (imports them off the event loop if not pre-warmed yet)
+        if not await asyncio.to_thread(barcode_libraries_available):
             await message.answer(
                 "⚠️ Barcode skanerga kerakli kutubxonalar o'rnatilmagan.\n"
                 "Iltimos, kod orqali tekshiring.",
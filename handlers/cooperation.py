@@ -132,12 +132,28 @@ async def process_license(message: types.Message, state: FSMContext):
 async def confirm_data(callback: types.CallbackQuery, state: FSMContext):
     """
     Step 6: Handle user confirmation.
-    - If yes → send application to admin
+    - If yes → store the application for moderation
     - If no → cancel and return to main menu
     """
     data = await state.get_data()
 
     if callback.data == "confirm_yes":
+        user = callback.from_user
+        username = f"@{user.username}" if user.username else user.full_name
+
+        # Stored as pending; moderators get it through the queue and the digest
+        async with async_session() as session:
+            application = Application(
+                user_id=user.id,
+                username=username,
+                full_name=data['name'],
+                phone=data['contact'],
+                pharmacy_name=data['address'],
+                license_photo_id=data['license_photo'],
+            )
+            session.add(application)
+            await session.commit()
+
         # Notify user
         await callback.message.answer(
             "✅ Ma'lumotlaringiz adminga yuborildi!\n"
@@ -145,37 +161,6 @@ async def confirm_data(callback: types.CallbackQuery, state: FSMContext):
             reply_markup=get_main_menu()
         )
 
-        # Save user ID (for admin response)
-        user_id = callback.from_user.id
-        await state.update_data(user_id=user_id)
-
-        # Send application to admin
-        caption = (
-            "📋 Yangi hamkorlik so'rovi:\n\n"
-            f"👤 Foydalanuvchi: @{callback.from_user.username or callback.from_user.full_name}\n"
-            f"🆔 User ID: {user_id}\n\n"
-            f"🏢 Tashkilot: {data['name']}\n"
-            f"📞 Aloqa: {data['contact']}\n"
-            f"📍 Manzil: {data['address']}\n\n"
-            "Ma'lumotlarni tasdiqlaysizmi?"
-        )
-
-        admin_keyboard = types.InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    types.InlineKeyboardButton(text="✅ Tasdiqlash", callback_data=f"admin_approve_{user_id}"),
-                    types.InlineKeyboardButton(text="❌ Rad etish", callback_data=f"admin_reject_{user_id}")
-                ]
-            ]
-        )
-
-        await callback.bot.send_photo(
-            chat_id=ADMIN_ID,
-            photo=data['license_photo'],
-            caption=caption,
-            reply_markup=admin_keyboard
-        )
-
     elif callback.data == "confirm_no":
         await callback.message.answer(
             "❌ Ma'lumotlar bekor qilindi. Asosiy menyuga qaytdingiz.",
@@ -183,82 +168,3 @@ async def confirm_data(callback: types.CallbackQuery, state: FSMContext):
         )
 
     await state.clear()
-
-
-@router.callback_query(lambda c: c.data.startswith("admin_approve_") or c.data.startswith("admin_reject_"))
-async def admin_decision(callback: types.CallbackQuery):
-    """
-    Step 7: Handle admin decision (approve/reject).
-    - If approved → save application to DB and notify user
-    - If rejected → notify user about rejection
-    """
-    if callback.from_user.id != ADMIN_ID:
-        await callback.answer("❌ Sizda ruxsat yo'q!")
-        return
-
-    decision = "approve" if "approve" in callback.data else "reject"
-    user_id = int(callback.data.split("_")[-1])
-
-    if decision == "approve":
-        try:
-            # Extract data from caption
-            caption_text = callback.message.caption
-            lines = caption_text.split('\n')
-
-            name, contact, address = "", "", ""
-            for line in lines:
-                if "🏢 Tashkilot:" in line:
-                    name = line.split("🏢 Tashkilot:")[1].strip()
-                elif "📞 Aloqa:" in line:
-                    contact = line.split("📞 Aloqa:")[1].strip()
-                elif "📍 Manzil:" in line:
-                    address = line.split("📍 Manzil:")[1].strip()
-
-            # Save to database
-            async with async_session() as session:
-                new_application = Application(
-                    full_name=name,
-                    phone=contact,
-                    pharmacy_name=address,
-                    approved=True
-                )
-                session.add(new_application)
-                await session.commit()
-                app_id = new_application.id
-
-            # Update admin message
-            await callback.message.edit_caption(
-                caption=callback.message.caption + f"\n\n✅ TASDIQLANDI (ID: {app_id})",
-                reply_markup=None
-            )
-
-            # Notify user
-            await callback.bot.send_message(
-                chat_id=user_id,
-                text=(
-                    f"🎉 Tabriklaymiz! Hamkorlik so'rovingiz tasdiqlandi!\n"
-                    f"📝 Ariza raqami: #{app_id}"
-                )
-            )
-
-        except Exception as e:
-            print(f"Database saving error: {e}")
-            await callback.answer("❌ Error while saving to database!")
-
-    elif decision == "reject":
-        # Update admin message
-        await callback.message.edit_caption(
-            caption=callback.message.caption + "\n\n❌ RAD ETILDI",
-            reply_markup=None
-        )
-
-        # Notify user
-        await callback.bot.send_message(
-            chat_id=user_id,
-            text=(
-                "❌ Afsuski, hamkorlik so'rovingiz rad etildi.\n"
-                "Batafsil ma'lumot uchun admin bilan bog'laning."
-            )
-        )
-
-    await callback.answer()
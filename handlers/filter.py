@@ -28,6 +28,7 @@ async def inline_drug_search(inline_query: types.InlineQuery):
             if query:
                 # Search by drug name, category, or manufacturer
                 stmt = select(Drug).where(
+                    Drug.deleted_at.is_(None),
                     or_(
                         Drug.name.ilike(f"%{query}%"),
                         Drug.category.ilike(f"%{query}%"),
@@ -37,7 +38,7 @@ async def inline_drug_search(inline_query: types.InlineQuery):
                 ).limit(20)
             else:
                 # If query is empty, return latest 10 drugs
-                stmt = select(Drug).limit(10)
+                stmt = select(Drug).where(Drug.deleted_at.is_(None)).limit(10)
 
             result = await session.execute(stmt)
             drugs = result.scalars().all()
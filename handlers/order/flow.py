@@ -1,23 +1,29 @@
-import random
 import logging
 
 from .import router
-from loader import bot
 from aiogram import types
 from aiogram.fsm.context import FSMContext
-from aiogram.exceptions import TelegramAPIError
 from aiogram.fsm.state import State, StatesGroup
 
-from sqlalchemy import select, delete
+from sqlalchemy import delete, distinct, func, select
+from sqlalchemy.exc import IntegrityError
 
 from database.db import async_session
-from database.models import Drug, Cart, Pharmacy, PharmacyDrug, Order, OrderItem
+from database.models import Drug, Cart, PharmacyDrug, Order, OrderItem
 
 from keyboards.main_menu import get_main_menu
-from .utils import calculate_distance
+from utils.cart_service import cart_service
+from utils.notifications import enqueue
+from utils.order_lifecycle import order_action_rows, take_stock
+from utils.pharmacy_cache import active_pharmacies, get_pharmacies, get_pharmacy
+from utils.pickup_code import add_order_with_pickup_code
+from utils.stats_rollup import record_transition
+from .utils import calculate_distance, cart_version
 
 logger = logging.getLogger(__name__)
 
+AVAILABLE_STATUS = "Dorilar mavjud ✅"
+
 
 class OrderState(StatesGroup):
     """
@@ -36,13 +42,10 @@ async def place_order(callback: types.CallbackQuery, state: FSMContext):
     Start order placement process - choose delivery type.
     """
     # Check if cart is not empty
-    async with async_session() as session:
-        cart_check = await session.execute(
-            select(Cart).where(Cart.user_id == callback.from_user.id)
-        )
-        if not cart_check.scalars().all():
-            await callback.answer("🛒 Savatingiz bo'sh!", show_alert=True)
-            return
+    cart = await cart_service.get_cart(callback.from_user.id)
+    if not cart.items():
+        await callback.answer("🛒 Savatingiz bo'sh!", show_alert=True)
+        return
 
     await state.set_state(OrderState.choosing_delivery_type)
 
@@ -152,26 +155,24 @@ async def handle_location(message: types.Message, state: FSMContext):
     )
 
     try:
+        # The order flow reads carts from the database
+        await cart_service.flush_user(user_id)
+
         async with async_session() as session:
             # Get user's cart items
-            stmt_cart = select(Cart).where(Cart.user_id == user_id)
-            cart_items_res = await session.execute(stmt_cart)
-            cart_items = cart_items_res.scalars().all()
+            required_drug_ids = set((await session.execute(
+                select(Cart.drug_id).where(Cart.user_id == user_id)
+            )).scalars().all())
 
-            if not cart_items:
+            if not required_drug_ids:
                 await message.answer(
                     "❌ Sizning savatingiz bo'sh. Qayta boshlash uchun /start bosing."
                 )
                 await state.clear()
                 return
 
-            required_drug_ids = {item.drug_id for item in cart_items}
-
-            # Fetch all active pharmacies
-            pharmacies_result = await session.execute(
-                select(Pharmacy).where(Pharmacy.is_active == True)
-            )
-            all_pharmacies = pharmacies_result.scalars().all()
+            # Active pharmacies come from the cache
+            all_pharmacies = await active_pharmacies()
 
             if not all_pharmacies:
                 await message.answer(
@@ -181,101 +182,52 @@ async def handle_location(message: types.Message, state: FSMContext):
                 await state.clear()
                 return
 
-            eligible_pharmacies = []
-
-            # Check each pharmacy for drug availability
-            for pharmacy in all_pharmacies:
-                pharmacy_drugs_result = await session.execute(
-                    select(PharmacyDrug).where(
-                        PharmacyDrug.pharmacy_id == pharmacy.id,
-                        PharmacyDrug.drug_id.in_(required_drug_ids),
-                        PharmacyDrug.residual > 0
-                    )
+            # Pharmacies that have every drug of the cart in stock, one query
+            stocked_ids = (await session.execute(
+                select(PharmacyDrug.pharmacy_id)
+                .where(
+                    PharmacyDrug.pharmacy_id.in_(list(all_pharmacies)),
+                    PharmacyDrug.drug_id.in_(required_drug_ids),
+                    PharmacyDrug.residual > 0
                 )
-                available_drugs = pharmacy_drugs_result.scalars().all()
-                available_drug_ids = {pd.drug_id for pd in available_drugs}
-
-                if required_drug_ids.issubset(available_drug_ids):
-                    # Foydalaniladigan koordinatalar modeldan olinadi
-                    if pharmacy.latitude and pharmacy.longitude:
-                        pharmacy_lat = float(pharmacy.latitude)
-                        pharmacy_lon = float(pharmacy.longitude)
-                    else:
-                        # fallback agar bazada yo‘q bo‘lsa
-                        pharmacy_lat = 41.2995  
-                        pharmacy_lon = 69.2401  
-
-                    distance = calculate_distance(user_lat, user_lon, pharmacy_lat, pharmacy_lon)
-
-                    eligible_pharmacies.append({
-                        "id": pharmacy.id,
-                        "name": pharmacy.name,
-                        "address": pharmacy.address or "Manzil ko'rsatilmagan",
-                        "phone": pharmacy.phone or "",
-                        "distance": distance,
-                        "latitude": pharmacy.latitude,
-                        "longitude": pharmacy.longitude,
-                        "status": "Dorilar mavjud ✅"
-                    })
-
-            # Sort by distance and take top 3
-            eligible_pharmacies.sort(key=lambda x: x["distance"])
-            top_pharmacies = eligible_pharmacies[:3]
-
-            if not top_pharmacies:
-                await message.answer(
-                    "❌ Uzr, savatingizdagi barcha dorilar mavjud bo'lgan "
-                    "yaqin dorixona topilmadi.\n\n"
-                    "Iltimos, savatni ko'rib chiqing va ayrim mahsulotlarni o'chirib, "
-                    "qaytadan urinib ko'ring.",
-                    reply_markup=types.InlineKeyboardMarkup(
-                        inline_keyboard=[
-                            [types.InlineKeyboardButton(
-                                text="🛒 Savatni ko'rish",
-                                callback_data="view_cart"
-                            )]
-                        ]
-                    )
-                )
-                await state.clear()
-                return
+                .group_by(PharmacyDrug.pharmacy_id)
+                .having(func.count(distinct(PharmacyDrug.drug_id)) == len(required_drug_ids))
+            )).scalars().all()
 
-            # Display pharmacy options
-            pharmacy_text = "<b>🏪 Sizga eng yaqin dorixonalar ro'yxati:</b>\n\n"
-            keyboard_buttons = []
+        eligible_pharmacies = []
+        for pharmacy_id in stocked_ids:
+            pharmacy_lat, pharmacy_lon = all_pharmacies[pharmacy_id].location
+            distance = calculate_distance(user_lat, user_lon, pharmacy_lat, pharmacy_lon)
+            eligible_pharmacies.append([pharmacy_id, round(distance, 2)])
 
-            for i, p in enumerate(top_pharmacies, 1):
-                pharmacy_text += (
-                    f"{i}. <b>{p['name']}</b>\n"
-                    f"   📍 <a href='https://www.google.com/maps/search/?api=1&query={p['latitude']},{p['longitude']}'>{p['address']}</a>\n"
-                    f"   📏 <i>{p['distance']:.2f} km</i> – {p['status']}\n"
-                )
-                if p['phone']:
-                    pharmacy_text += f"   📞 {p['phone']}\n"
-                pharmacy_text += "\n"
-
-                keyboard_buttons.append([
-                    types.InlineKeyboardButton(
-                        text=f"{i}. {p['name']} ({p['distance']:.1f} km)",
-                        callback_data=f"select_pharmacy:{p['id']}"
-                    )
-                ])
+        # Sort by distance and take top 3
+        eligible_pharmacies.sort(key=lambda x: x[1])
+        top_pharmacies = eligible_pharmacies[:3]
 
-            keyboard_buttons.append([
-                types.InlineKeyboardButton(
-                    text="⬅️ Ortga (Qayta qidirish)",
-                    callback_data="place_order"
+        if not top_pharmacies:
+            await message.answer(
+                "❌ Uzr, savatingizdagi barcha dorilar mavjud bo'lgan "
+                "yaqin dorixona topilmadi.\n\n"
+                "Iltimos, savatni ko'rib chiqing va ayrim mahsulotlarni o'chirib, "
+                "qaytadan urinib ko'ring.",
+                reply_markup=types.InlineKeyboardMarkup(
+                    inline_keyboard=[
+                        [types.InlineKeyboardButton(
+                            text="🛒 Savatni ko'rish",
+                            callback_data="view_cart"
+                        )]
+                    ]
                 )
-            ])
+            )
+            await state.clear()
+            return
 
-            await state.set_state(OrderState.choosing_pharmacy)
-            await state.update_data(pharmacies=top_pharmacies)
+        await state.set_state(OrderState.choosing_pharmacy)
+        # Only [pharmacy_id, distance] pairs; details are rehydrated from the cache
+        await state.update_data(pharmacies=top_pharmacies)
 
-            await message.answer(
-                pharmacy_text,
-                parse_mode="HTML",
-                reply_markup=types.InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
-            )
+        pharmacy_text, keyboard = await pharmacy_choice_view(top_pharmacies, "⬅️ Ortga (Qayta qidirish)")
+        await message.answer(pharmacy_text, parse_mode="HTML", reply_markup=keyboard)
 
     except Exception as e:
         logger.error(f"Error handling location and searching pharmacies: {e}", exc_info=True)
@@ -286,6 +238,63 @@ async def handle_location(message: types.Message, state: FSMContext):
         await state.clear()
 
 
+async def pharmacy_choice_view(pharmacies: list, back_text: str):
+    """
+    Text and keyboard of the nearest pharmacies list.
+
+    Args:
+        pharmacies: [pharmacy_id, distance] pairs from FSM state
+        back_text: Label of the button that restarts the search
+    """
+    distances = dict(pharmacies)
+    cards = await get_pharmacies(distances)
+
+    pharmacy_text = "<b>🏪 Sizga eng yaqin dorixonalar ro'yxati:</b>\n\n"
+    keyboard_buttons = []
+
+    for i, p in enumerate(cards, 1):
+        distance = distances[p.id]
+        pharmacy_text += (
+            f"{i}. <b>{p.name}</b>\n"
+            f"   📍 <a href='{p.map_url}'>{p.address}</a>\n"
+            f"   📏 <i>{distance:.2f} km</i> – {AVAILABLE_STATUS}\n"
+        )
+        if p.phone:
+            pharmacy_text += f"   📞 {p.phone}\n"
+        pharmacy_text += "\n"
+
+        keyboard_buttons.append([
+            types.InlineKeyboardButton(
+                text=f"{i}. {p.name} ({distance:.1f} km)",
+                callback_data=f"select_pharmacy:{p.id}"
+            )
+        ])
+
+    keyboard_buttons.append([
+        types.InlineKeyboardButton(
+            text=back_text,
+            callback_data="place_order"
+        )
+    ])
+    return pharmacy_text, types.InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+
+
+async def load_cart(session, user_id: int) -> list:
+    """
+    Cart rows of a user joined with their drugs, as (Cart, Drug) pairs.
+    """
+    result = await session.execute(
+        select(Cart, Drug).join(Drug).where(Cart.user_id == user_id).order_by(Cart.id)
+    )
+    return result.all()
+
+
+def cart_items_version(cart_items) -> str:
+    return cart_version(
+        (drug.id, cart_item.quantity, drug.price or 0) for cart_item, drug in cart_items
+    )
+
+
 @router.callback_query(
     OrderState.choosing_pharmacy,
     lambda c: c.data.startswith("select_pharmacy:")
@@ -296,111 +305,108 @@ async def finalize_order_confirmation(callback: types.CallbackQuery, state: FSMC
     """
     try:
         pharmacy_id = int(callback.data.split(":")[1])
-        user_id = callback.from_user.id
+        if await show_order_confirmation(callback, state, pharmacy_id):
+            await callback.answer()
 
-        data = await state.get_data()
-        pharmacy_list = data.get("pharmacies", [])
-        selected_pharmacy = next((p for p in pharmacy_list if p['id'] == pharmacy_id), None)
+    except ValueError:
+        logger.error("Invalid pharmacy_id format")
+        await callback.answer("❌ Noto'g'ri ma'lumot", show_alert=True)
+    except Exception as e:
+        logger.error(f"Error in order confirmation: {e}", exc_info=True)
+        await callback.answer("❌ Xatolik yuz berdi", show_alert=True)
 
-        if not selected_pharmacy:
-            await callback.answer("❌ Tanlangan dorixona topilmadi.", show_alert=True)
-            return
 
-        total_amount = 0
-        cart_items_details = []
+async def show_order_confirmation(callback: types.CallbackQuery, state: FSMContext, pharmacy_id: int) -> bool:
+    """
+    Render the confirmation of the current cart at the chosen pharmacy.
 
-        async with async_session() as session:
-            stmt = select(Cart, Drug).join(Drug).where(Cart.user_id == user_id)
-            result = await session.execute(stmt)
-            cart_items = result.all()
+    Only the pharmacy id and the cart version are kept in FSM state;
+    ``finalize_order`` re-reads the cart and checks the version.
 
-            if not cart_items:
-                await callback.answer("🛒 Savatingiz bo'sh!", show_alert=True)
-                await state.clear()
-                return
+    Returns:
+        False if the pharmacy or the cart is gone (the user was already told)
+    """
+    user_id = callback.from_user.id
 
-            cart_summary_text = ""
-            for i, (cart_item, drug) in enumerate(cart_items, 1):
-                item_total = (drug.price or 0) * cart_item.quantity
-                total_amount += item_total
+    data = await state.get_data()
+    distances = dict(data.get("pharmacies", []))
+    selected_pharmacy = await get_pharmacy(pharmacy_id) if pharmacy_id in distances else None
 
-                cart_summary_text += (
-                    f"{i}. <b>{drug.name}</b>: {cart_item.quantity} × "
-                    f"{drug.price or 0:,} so'm = {item_total:,} so'm\n"
-                )
-                cart_items_details.append({
-                    "drug_id": drug.id,
-                    "drug_name": drug.name,
-                    "quantity": cart_item.quantity,
-                    "price": drug.price or 0
-                })
+    if not selected_pharmacy:
+        await callback.answer("❌ Tanlangan dorixona topilmadi.", show_alert=True)
+        return False
 
-        # Generate unique pickup code
-        pickup_code = f"PX-{random.randint(10000, 99999)}"
+    total_amount = 0
 
-        confirmation_text = (
-            "<b>✅ Buyurtmani tasdiqlash</b>\n\n"
-            "<b>🏪 Tanlangan dorixona (Pickup):</b>\n"
-            f" 📍 {selected_pharmacy['name']}\n"
-            f" 🏠 Manzil: <a href='https://www.google.com/maps/search/?api=1&query={selected_pharmacy['latitude']},{selected_pharmacy['longitude']}'>{selected_pharmacy['address']}</a>\n"
-        )
-        
-        if selected_pharmacy.get('phone'):
-            confirmation_text += f" 📞 Telefon: {selected_pharmacy['phone']}\n"
-        
-        confirmation_text += (
-            f" 📏 Masofa: {selected_pharmacy['distance']:.2f} km\n\n"
-            "<b>🛍 Buyurtma tafsilotlari:</b>\n"
-            f"{cart_summary_text}\n"
-            f"<b>💵 Jami to'lov: {total_amount:,} so'm</b>\n\n"
-            "<b>⏰ Kutish vaqti:</b> Buyurtma 40 daqiqa ichida tayyor bo'ladi.\n\n"
-            "<i>Iltimos, buyurtmani tasdiqlang. Tasdiqlangandan keyin "
-            "sizga maxsus kod beriladi.</i>"
-        )
+    await cart_service.flush_user(user_id)
 
-        keyboard = types.InlineKeyboardMarkup(
-            inline_keyboard=[
-                [
-                    types.InlineKeyboardButton(
-                        text="✅ Tasdiqlash va kod olish",
-                        callback_data=f"confirm_pickup:{pharmacy_id}"
-                    )
-                ],
-                [
-                    types.InlineKeyboardButton(
-                        text="⬅️ Dorixonani o'zgartirish",
-                        callback_data="change_pharmacy"
-                    )
-                ]
-            ]
-        )
+    async with async_session() as session:
+        cart_items = await load_cart(session, user_id)
 
-        await state.set_state(OrderState.confirming_order)
-        await state.update_data(
-            final_pharmacy_id=pharmacy_id,
-            final_pharmacy_name=selected_pharmacy['name'],
-            final_pharmacy_address=selected_pharmacy['address'],
-            final_pharmacy_phone=selected_pharmacy.get('phone', ''),
-            final_pharmacy_latitude=selected_pharmacy['latitude'],
-            final_pharmacy_longitude=selected_pharmacy['longitude'],
-            order_total=total_amount,
-            order_items=cart_items_details,
-            pickup_code=pickup_code
-        )
+    if not cart_items:
+        await callback.answer("🛒 Savatingiz bo'sh!", show_alert=True)
+        await state.clear()
+        return False
 
-        await callback.message.edit_text(
-            confirmation_text,
-            parse_mode="HTML",
-            reply_markup=keyboard
+    cart_summary_text = ""
+    for i, (cart_item, drug) in enumerate(cart_items, 1):
+        item_total = (drug.price or 0) * cart_item.quantity
+        total_amount += item_total
+
+        cart_summary_text += (
+            f"{i}. <b>{drug.name}</b>: {cart_item.quantity} × "
+            f"{drug.price or 0:,} so'm = {item_total:,} so'm\n"
         )
-        await callback.answer()
 
-    except ValueError:
-        logger.error("Invalid pharmacy_id format")
-        await callback.answer("❌ Noto'g'ri ma'lumot", show_alert=True)
-    except Exception as e:
-        logger.error(f"Error in order confirmation: {e}", exc_info=True)
-        await callback.answer("❌ Xatolik yuz berdi", show_alert=True)
+    confirmation_text = (
+        "<b>✅ Buyurtmani tasdiqlash</b>\n\n"
+        "<b>🏪 Tanlangan dorixona (Pickup):</b>\n"
+        f" 📍 {selected_pharmacy.name}\n"
+        f" 🏠 Manzil: <a href='{selected_pharmacy.map_url}'>{selected_pharmacy.address}</a>\n"
+    )
+
+    if selected_pharmacy.phone:
+        confirmation_text += f" 📞 Telefon: {selected_pharmacy.phone}\n"
+
+    confirmation_text += (
+        f" 📏 Masofa: {distances[pharmacy_id]:.2f} km\n\n"
+        "<b>🛍 Buyurtma tafsilotlari:</b>\n"
+        f"{cart_summary_text}\n"
+        f"<b>💵 Jami to'lov: {total_amount:,} so'm</b>\n\n"
+        "<b>⏰ Kutish vaqti:</b> Buyurtma 40 daqiqa ichida tayyor bo'ladi.\n\n"
+        "<i>Iltimos, buyurtmani tasdiqlang. Tasdiqlangandan keyin "
+        "sizga maxsus kod beriladi.</i>"
+    )
+
+    keyboard = types.InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                types.InlineKeyboardButton(
+                    text="✅ Tasdiqlash va kod olish",
+                    callback_data=f"confirm_pickup:{pharmacy_id}"
+                )
+            ],
+            [
+                types.InlineKeyboardButton(
+                    text="⬅️ Dorixonani o'zgartirish",
+                    callback_data="change_pharmacy"
+                )
+            ]
+        ]
+    )
+
+    await state.set_state(OrderState.confirming_order)
+    await state.update_data(
+        final_pharmacy_id=pharmacy_id,
+        cart_version=cart_items_version(cart_items)
+    )
+
+    await callback.message.edit_text(
+        confirmation_text,
+        parse_mode="HTML",
+        reply_markup=keyboard
+    )
+    return True
 
 
 @router.callback_query(
@@ -418,36 +424,14 @@ async def change_pharmacy(callback: types.CallbackQuery, state: FSMContext):
         await callback.answer("❌ Dorixonalar ro'yxati topilmadi", show_alert=True)
         return
 
-    pharmacy_text = "<b>🏪 Sizga eng yaqin dorixonalar ro'yxati:</b>\n\n"
-    keyboard_buttons = []
-
-    for i, p in enumerate(pharmacy_list, 1):
-        pharmacy_text += (
-            f"{i}. <b>{p['name']}</b>\n"
-            f"   📍 {p['address']}\n"
-            f"   📏 <i>{p['distance']:.2f} km</i> – {p['status']}\n\n"
-        )
-
-        keyboard_buttons.append([
-            types.InlineKeyboardButton(
-                text=f"{i}. {p['name']} ({p['distance']:.1f} km)",
-                callback_data=f"select_pharmacy:{p['id']}"
-            )
-        ])
-
-    keyboard_buttons.append([
-        types.InlineKeyboardButton(
-            text="⬅️ Ortga",
-            callback_data="place_order"
-        )
-    ])
+    pharmacy_text, keyboard = await pharmacy_choice_view(pharmacy_list, "⬅️ Ortga")
 
     await state.set_state(OrderState.choosing_pharmacy)
 
     await callback.message.edit_text(
         pharmacy_text,
         parse_mode="HTML",
-        reply_markup=types.InlineKeyboardMarkup(inline_keyboard=keyboard_buttons)
+        reply_markup=keyboard
     )
     await callback.answer()
 
@@ -462,35 +446,94 @@ async def finalize_order(callback: types.CallbackQuery, state: FSMContext):
     """
     data = await state.get_data()
     pharmacy_id = data.get("final_pharmacy_id")
-    pharmacy_name = data.get("final_pharmacy_name", "")
-    pharmacy_address = data.get("final_pharmacy_address", "")
-    pharmacy_phone = data.get("final_pharmacy_phone", "")
-    pharmacy_latitude = data.get("final_pharmacy_latitude", 0)
-    pharmacy_longitude = data.get("final_pharmacy_longitude", 0)
-    total_amount = data.get("order_total", 0)
-    order_items = data.get("order_items", [])
-    pickup_code = data.get("pickup_code")
+    confirmed_version = data.get("cart_version")
     user_id = callback.from_user.id
 
-    if not pharmacy_id or not order_items:
+    pharmacy = await get_pharmacy(pharmacy_id) if pharmacy_id else None
+    if not pharmacy or not confirmed_version:
         await callback.answer("❌ Buyurtma ma'lumotlari topilmadi", show_alert=True)
         await state.clear()
         return
 
     try:
+        await cart_service.flush_user(user_id)
+
         async with async_session() as session:
-            # Create new order
+            # The cart is re-read: state only holds its version
+            cart_items = await load_cart(session, user_id)
+            if not cart_items:
+                await callback.answer("🛒 Savatingiz bo'sh!", show_alert=True)
+                await state.clear()
+                return
+
+            if cart_items_version(cart_items) != confirmed_version:
+                # Cart or prices changed after the confirmation was shown
+                await callback.answer(
+                    "🔄 Savatingiz yoki narxlar o'zgardi. Iltimos, buyurtmani qayta tekshiring.",
+                    show_alert=True
+                )
+                await show_order_confirmation(callback, state, pharmacy_id)
+                return
+
+            order_items = [
+                {
+                    "drug_id": drug.id,
+                    "drug_name": drug.name,
+                    "quantity": cart_item.quantity,
+                    "price": drug.price or 0
+                }
+                for cart_item, drug in cart_items
+            ]
+            total_amount = sum(item["price"] * item["quantity"] for item in order_items)
+
+            # Taken atomically; nothing is ordered that the pharmacy does not have
+            short = await take_stock(
+                session, pharmacy_id, [(item["drug_id"], item["quantity"]) for item in order_items]
+            )
+            if short:
+                await session.rollback()
+                names = ", ".join(item["drug_name"] for item in order_items if item["drug_id"] in short)
+                text = f"❌ Dorixonada yetarli emas: {names}"
+                # Alerts are limited to 200 characters
+                if len(text) > 140:
+                    text = text[:139] + "…"
+                await callback.answer(
+                    f"{text}\n\nIltimos, savatni o'zgartiring yoki boshqa dorixonani tanlang.",
+                    show_alert=True
+                )
+                return
+
+            # Same confirmation message and cart -> same key, so a repeated
+            # tap (even one handled by another worker) cannot add a second order
+            idempotency_key = f"{user_id}:{callback.message.message_id}:{confirmed_version}"
+
+            # Create new order (pickup code doubles as temporary phone identifier)
             new_order = Order(
                 user_id=user_id,
                 full_name=callback.from_user.full_name or "Unknown",
-                phone=pickup_code,  # Using pickup code as temporary identifier
                 pharmacy_id=pharmacy_id,
-                address=f"{pharmacy_name}, {pharmacy_address}",
+                address=f"{pharmacy.name}, {pharmacy.address}",
                 total_amount=total_amount,
-                status="pending"
+                status="pending",
+                idempotency_key=idempotency_key
             )
-            session.add(new_order)
-            await session.flush()  # Get order ID
+            try:
+                pickup_code = await add_order_with_pickup_code(session, new_order)
+            except IntegrityError as e:
+                if "uix_orders_idempotency_key" not in str(e.orig):
+                    raise
+                await session.rollback()
+                existing_id = await session.scalar(
+                    select(Order.id).where(Order.idempotency_key == idempotency_key)
+                )
+                logger.info(f"Repeated confirmation of order #{existing_id} by user {user_id}")
+                await callback.answer(
+                    f"✅ Bu buyurtma allaqachon qabul qilingan (#{existing_id}).",
+                    show_alert=True
+                )
+                await state.clear()
+                return
+            await record_transition(session, new_order.id, None, "pending")
 
             # Create order items
             for item in order_items:
@@ -502,39 +545,52 @@ async def finalize_order(callback: types.CallbackQuery, state: FSMContext):
                 )
                 session.add(order_item)
 
-            # Update pharmacy drug stock (reduce residual)
-            for item in order_items:
-                pharmacy_drug_result = await session.execute(
-                    select(PharmacyDrug).where(
-                        PharmacyDrug.pharmacy_id == pharmacy_id,
-                        PharmacyDrug.drug_id == item['drug_id']
-                    )
-                )
-                pharmacy_drug = pharmacy_drug_result.scalar_one_or_none()
-                
-                if pharmacy_drug and pharmacy_drug.residual >= item['quantity']:
-                    pharmacy_drug.residual -= item['quantity']
-                else:
-                    logger.warning(
-                        f"Insufficient stock for drug {item['drug_id']} "
-                        f"at pharmacy {pharmacy_id}"
-                    )
-
             # Clear user's cart
             await session.execute(
                 delete(Cart).where(Cart.user_id == user_id)
             )
-            
+
+            # Notify the pharmacy admin; sent by the outbox once the order is committed
+            admin_tg_id = pharmacy.tg_id
+
+            if admin_tg_id:
+                order_items_text = ""
+                for item in order_items:
+                    order_items_text += (
+                        f"- {item['drug_name']}: {item['quantity']} dona, {item['price']:,} so'm\n"
+                    )
+                admin_message = (
+                    f"🆕 <b>Yangi buyurtma!</b>\n"
+                    f"📋 Buyurtma raqami: #{new_order.id}\n"
+                    f"👤 Mijoz: {callback.from_user.full_name or 'Unknown'}\n"
+                    f"🔐 Pickup kod: <code>{pickup_code}</code>\n"
+                    f"💵 Jami: {total_amount:,} so'm\n"
+                    f"🛍 Buyurtma:\n{order_items_text}\n"
+                    f"🏪 Dorixona: {pharmacy.name}\n"
+                    f"📍 Manzil: {pharmacy.address}\n"
+                    f"⏰ Olib ketish: 40 daqiqa ichida\n"
+                )
+                enqueue(
+                    session,
+                    admin_tg_id,
+                    admin_message,
+                    parse_mode="HTML",
+                    reply_markup=types.InlineKeyboardMarkup(
+                        inline_keyboard=order_action_rows(new_order.id, "pending")
+                    )
+                )
+
             await session.commit()
+            cart_service.invalidate(user_id)
 
             # Send success message with pickup code
             final_message = (
                 "🎉 <b>BUYURTMA MUVAFFAQIYATLI RASMIYLASHTIRILDI!</b>\n\n"
                 f"📋 <b>Buyurtma raqami:</b> #{new_order.id}\n"
                 f"🔐 <b>Pickup kod:</b> <code>{pickup_code}</code>\n\n"
-                f"🏪 <b>Dorixona:</b> {pharmacy_name}\n"
-                f"📞 <b>Telefon:</b> {pharmacy_phone}\n"
-                f"📍 <b>Manzil:</b> <a href='https://www.google.com/maps/search/?api=1&query={pharmacy_latitude},{pharmacy_longitude}'>{pharmacy_address}</a>\n\n"
+                f"🏪 <b>Dorixona:</b> {pharmacy.name}\n"
+                f"📞 <b>Telefon:</b> {pharmacy.phone}\n"
+                f"📍 <b>Manzil:</b> <a href='{pharmacy.map_url}'>{pharmacy.address}</a>\n\n"
                 f"💵 <b>To'lov summasi:</b> {total_amount:,} so'm\n\n"
                 "⏰ <b>Olib ketish vaqti:</b> Hozirdan boshlab 40 daqiqa ichida.\n\n"
                 "<b>⚠️ Muhim eslatmalar:</b>\n"
@@ -572,35 +628,6 @@ async def finalize_order(callback: types.CallbackQuery, state: FSMContext):
                 f"Order #{new_order.id} created successfully for user {user_id} "
                 f"at pharmacy {pharmacy_id}"
             )
-            # --- SEND MESSAGE TO PHARMACY ADMIN ---
-            pharmacy = await session.get(Pharmacy, pharmacy_id)
-            admin_tg_id = pharmacy.tg_id if pharmacy else None
-
-            if admin_tg_id:
-                order_items_text = ""
-                for item in order_items:
-                    order_items_text += (
-                        f"- {item['drug_name']}: {item['quantity']} dona, {item['price']:,} so'm\n"
-                    )
-                admin_message = (
-                    f"🆕 <b>Yangi buyurtma!</b>\n"
-                    f"📋 Buyurtma raqami: #{new_order.id}\n"
-                    f"👤 Mijoz: {callback.from_user.full_name or 'Unknown'}\n"
-                    f"🔐 Pickup kod: <code>{pickup_code}</code>\n"
-                    f"💵 Jami: {total_amount:,} so'm\n"
-                    f"🛍 Buyurtma:\n{order_items_text}\n"
-                    f"🏪 Dorixona: {pharmacy_name}\n"
-                    f"📍 Manzil: {pharmacy_address}\n"
-                    f"⏰ Olib ketish: 40 daqiqa ichida\n"
-                )
-                try:
-                    await bot.send_message(
-                        admin_tg_id,
-                        admin_message,
-                        parse_mode="HTML"
-                    )
-                except TelegramAPIError as err:
-                    logger.error(f"Failed to send order notification to admin: {err}")
 
     except Exception as e:
         logger.error(f"Error finalizing order: {e}", exc_info=True)
@@ -7,12 +7,12 @@ from aiogram import types
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 
-from sqlalchemy import select, delete
+from sqlalchemy import delete
 
-from database.db import async_session
-from database.models import Drug, Cart, Pharmacy, PharmacyDrug, Order, OrderItem
+from database.models import Pharmacy, PharmacyDrug, Order, OrderItem
 
 from keyboards.main_menu import get_main_menu
+from utils.cart_service import cart_service
 
 logger = logging.getLogger(__name__)
 
@@ -76,37 +76,15 @@ async def add_to_cart(callback: CallbackQuery):
         drug_id = int(callback.data.split(":")[1])
         user_id = callback.from_user.id
 
-        async with async_session() as session:
-            # Check if drug exists
-            drug = await session.get(Drug, drug_id)
-            if not drug:
-                await callback.answer("❌ Dori topilmadi!", show_alert=True)
-                return
-
-            # Check if item already in cart
-            existing_cart_item = await session.execute(
-                select(Cart).where(
-                    Cart.user_id == user_id,
-                    Cart.drug_id == drug_id
-                )
-            )
-            cart_item = existing_cart_item.scalar_one_or_none()
-
-            if cart_item:
-                # If exists, increase quantity
-                cart_item.quantity += 1
-                await session.commit()
-                await callback.answer("✅ Dori miqdori oshirildi!", show_alert=True)
-            else:
-                # If not exists, create new cart item
-                new_cart_item = Cart(
-                    user_id=user_id,
-                    drug_id=drug_id,
-                    quantity=1
-                )
-                session.add(new_cart_item)
-                await session.commit()
-                await callback.answer("✅ Dori savatga qo'shildi!", show_alert=True)
+        quantity = await cart_service.add_item(user_id, drug_id)
+        if quantity is None:
+            await callback.answer("❌ Dori topilmadi!", show_alert=True)
+            return
+
+        if quantity > 1:
+            await callback.answer("✅ Dori miqdori oshirildi!", show_alert=True)
+        else:
+            await callback.answer("✅ Dori savatga qo'shildi!", show_alert=True)
 
         # Send main menu
         if callback.message:
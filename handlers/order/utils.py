@@ -1,5 +1,7 @@
+import hashlib
 import math
 
+
 def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
     """
     Calculate distance between two coordinates using Haversine formula.
@@ -19,4 +21,17 @@ def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> fl
          math.sin(dLon / 2) ** 2)
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     distance = R * c
-    return distance
\ No newline at end of file
+    return distance
+
+
+def cart_version(items) -> str:
+    """
+    Short hash of cart contents: (drug_id, quantity, price) triples in any order.
+
+    Stored in FSM state instead of the items themselves; a different hash at
+    confirmation means the cart or a price changed in between.
+    """
+    digest = hashlib.blake2b(digest_size=6)
+    for drug_id, quantity, price in sorted(items):
+        digest.update(f"{drug_id}:{quantity}:{price};".encode())
+    return digest.hexdigest()
@@ -11,8 +11,11 @@ from aiogram.types import (
 from keyboards import get_main_menu, get_pharmacy_menu
 from keyboards.admin_menu import admin_main_menu
 from sqlalchemy import select
-from database.models import Pharmacy, User, UserStatus
+from database.models import User, UserStatus
 from database.db import async_session
+from middlewares.identity import Identity
+from utils.broadcast import mark_unblocked
+from utils.notifications import notify
 from os import getenv
 from sqlalchemy.exc import IntegrityError
 from aiogram.fsm.state import State, StatesGroup
@@ -22,59 +25,49 @@ from handlers.cooperation import ADMIN_ID
 router = Router()
 
 @router.message(Command("start"))
-async def start_handler(message: types.Message):
+async def start_handler(message: types.Message, identity: Identity):
     """
     Handle the /start command.
 
     Greets the user by username (or full name if username is not set),
     asks for their phone number, and shows the appropriate menu based on user status.
+    The caller's role comes from the cached identity; the only query clears
+    the blocked flag of a user who came back after blocking the bot.
     """
-    async with async_session() as session:
-        user_id = message.from_user.id
-        username = message.from_user.username or message.from_user.full_name
-        print(user_id)
-        # Check if the user is the admin
-        if user_id == ADMIN_ID:
-            await message.answer(
-                f"Salom, {username} 👋\n\nSiz admin sifatida tizimga kirdingiz!\nBu qisim keyingi versiyalar uchun, to'liq emas, kamchiliklar bor 📈",
-                reply_markup=admin_main_menu()
-            )
-            return
+    username = message.from_user.username or message.from_user.full_name
 
-        # Check if the user already exists
-        result = await session.execute(
-            select(User).where(User.telegram_id == user_id)
-        )
-        existing_user = result.scalar_one_or_none()
+    if identity.is_registered:
+        await mark_unblocked(message.from_user.id)
 
-        if not existing_user:
-            # Ask for phone number
-            phone_button = ReplyKeyboardMarkup(
-                keyboard=[[KeyboardButton(text="📱 Telefon raqamni yuborish", request_contact=True)]],
-                resize_keyboard=True,
-                one_time_keyboard=True
-            )
-            await message.answer(
-                f"Salom, {username} 👋\n\nIltimos, telefon raqamingizni yuboring:",
-                reply_markup=phone_button
-            )
-        else:
-            # Check if the user is a pharmacy admin by tg_id
-            pharmacy_admin = await session.execute(
-                select(Pharmacy).where(Pharmacy.tg_id == user_id)
-            )
-            pharmacy_admin = pharmacy_admin.scalar_one_or_none()
+    # Check if the user is the admin
+    if identity.is_admin:
+        await message.answer(
+            f"Salom, {username} 👋\n\nSiz admin sifatida tizimga kirdingiz!\nBu qisim keyingi versiyalar uchun, to'liq emas, kamchiliklar bor 📈",
+            reply_markup=admin_main_menu()
+        )
+        return
 
-            if pharmacy_admin:
-                await message.answer(
-                    f"Salom, {username} 👋\n\nSiz dorixona admini sifatida tizimga kirdingiz!",
-                    reply_markup=get_pharmacy_menu()
-                )
-            else:
-                await message.answer(
-                    f"Salom, {username} 👋\n\nSiz allaqachon ro'yxatdan o'tgansiz!",
-                    reply_markup=get_main_menu()
-                )
+    if not identity.is_registered:
+        # Ask for phone number
+        phone_button = ReplyKeyboardMarkup(
+            keyboard=[[KeyboardButton(text="📱 Telefon raqamni yuborish", request_contact=True)]],
+            resize_keyboard=True,
+            one_time_keyboard=True
+        )
+        await message.answer(
+            f"Salom, {username} 👋\n\nIltimos, telefon raqamingizni yuboring:",
+            reply_markup=phone_button
+        )
+    elif identity.is_pharmacy_admin:
+        await message.answer(
+            f"Salom, {username} 👋\n\nSiz dorixona admini sifatida tizimga kirdingiz!",
+            reply_markup=get_pharmacy_menu()
+        )
+    else:
+        await message.answer(
+            f"Salom, {username} 👋\n\nSiz allaqachon ro'yxatdan o'tgansiz!",
+            reply_markup=get_main_menu()
+        )
 
 
 @router.message(F.contact, StateFilter(None))
@@ -180,8 +173,8 @@ async def send_message_to_user(message: types.Message, state: FSMContext):
         await state.clear()
         return
     try:
-        await message.bot.send_message(user_id, text)
-        await message.answer("✅ Xabar muvaffaqiyatli yuborildi!")
+        await notify(user_id, text)
+        await message.answer("✅ Xabar yuborish navbatiga qo'yildi!")
     except Exception as e:
         await message.answer(f"❌ Xabar yuborilmadi. Xatolik: {e}")
 
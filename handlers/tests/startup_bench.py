@@ -0,0 +1,79 @@
+# Startup import benchmark.
+# Imports main.py in a fresh interpreter with "python -X importtime" and
+# prints where the time goes, grouped by top-level package:
+#   python -m handlers.tests.startup_bench [--top 15] [--budget-ms 0]
+# Fails if a lazily loaded library is imported at startup, or if the total
+# import time exceeds --budget-ms (when given).
+import argparse
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+# Must only be imported on first use / by the background pre-warm
+LAZY_MODULES = ("cv2", "numpy", "PIL", "pyzbar", "pandas", "requests", "openpyxl")
+
+LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure() -> list:
+    """
+    Run "import main" under -X importtime and return (self_us, cumulative_us, depth, module).
+    """
+    env = dict(os.environ)
+    env.setdefault("BOT_TOKEN", "123456:benchmark")
+    env.setdefault("ADMIN_ID", "1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        sys.exit(result.returncode)
+
+    rows = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((int(self_us), int(cumulative_us), len(indent) // 2, module))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--budget-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    rows = measure()
+    total_ms = sum(self_us for self_us, _, _, _ in rows) / 1000
+
+    by_package = defaultdict(int)
+    for self_us, _, _, module in rows:
+        by_package[module.split(".")[0]] += self_us
+
+    print(f"Jami import vaqti: {total_ms:.0f} ms ({len(rows)} modul)\n")
+    print(f"{'paket':<30}{'ms':>10}{'%':>8}")
+    for package, us in sorted(by_package.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{package:<30}{us / 1000:>10.1f}{us / 1000 / total_ms * 100:>7.1f}%")
+
+    imported = {module.split(".")[0] for _, _, _, module in rows}
+    eager = [name for name in LAZY_MODULES if name in imported]
+    print()
+    if eager:
+        print(f"❌ Startda yuklanmasligi kerak bo'lgan modullar: {', '.join(eager)}")
+    else:
+        print("✅ Og'ir kutubxonalar startda yuklanmadi")
+
+    over_budget = args.budget_ms and total_ms > args.budget_ms
+    if over_budget:
+        print(f"❌ Import vaqti {total_ms:.0f} ms > {args.budget_ms:.0f} ms")
+
+    if eager or over_budget:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -11,6 +11,8 @@ def admin_main_menu() -> InlineKeyboardMarkup:
              InlineKeyboardButton(text="💊 Mahsulotlar", callback_data="admin:products")],
             [InlineKeyboardButton(text="🧾 Buyurtmalar", callback_data="admin:orders"),
              InlineKeyboardButton(text="⚙️ Sozlamalar", callback_data="admin:settings")],
+            [InlineKeyboardButton(text="🗂 Moderatsiya", callback_data="admin:moderation"),
+             InlineKeyboardButton(text="📣 Xabar yuborish", callback_data="admin:broadcast")],
             [InlineKeyboardButton(text="⬅️ Ortga", callback_data="admin:back")]
         ]
     )
@@ -10,6 +10,7 @@ def get_pharmacy_menu():
         [InlineKeyboardButton(text="⏳ Kutilayotgan", callback_data="pharmacy_pending")],
         [InlineKeyboardButton(text="✅ Tasdiqlangan", callback_data="pharmacy_confirmed")],
         [InlineKeyboardButton(text="🔔 Tayyor", callback_data="pharmacy_ready")],
+        [InlineKeyboardButton(text="🔑 Kod bo'yicha qidirish", callback_data="pharmacy_find_code")],
         [InlineKeyboardButton(text="📊 Statistika", callback_data="pharmacy_stats")],
     ])
     return keyboard
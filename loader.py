@@ -4,6 +4,8 @@ from aiogram import Bot, Dispatcher
 from aiogram.enums import ParseMode
 from dotenv import load_dotenv
 
+from utils.fsm_storage import build_storage
+
 load_dotenv()
 
 API_TOKEN = os.getenv("BOT_TOKEN")
@@ -11,4 +13,7 @@ if not API_TOKEN:
     raise ValueError("BOT_TOKEN .env faylda topilmadi!")
 
 bot = Bot(token=API_TOKEN)
-dp = Dispatcher()
+
+# FSM storage shared by all workers (FSM_STORAGE), with per-user update ordering
+storage, events_isolation = build_storage()
+dp = Dispatcher(storage=storage, events_isolation=events_isolation)
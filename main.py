@@ -1,5 +1,9 @@
+from utils import startup_metrics  # first: reference point for startup timing
+
 import asyncio
 import os
+from aiohttp import web
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
 from dotenv import load_dotenv
 
 from loader import bot, dp
@@ -7,13 +11,30 @@ from handlers import start, cooperation, feedback, filter, order, ai_assistant,
 from handlers.admin.router import router as admin_router
 
 from users import pharmacy
-from database.db import engine, Base
+from middlewares import FirstUpdateMiddleware, IdentityMiddleware, UserLockMiddleware
+from database.migrations import ensure_schema
+from utils.cart_service import cart_service
+from utils.notifications import notification_sender
+from utils.background_jobs import background_jobs
+from utils.broadcast import broadcast_runner
+from utils.catalog_sync import catalog_watcher
+from utils.config import AUTO_MIGRATE, WEBAPP_HOST, WEBAPP_PORT, WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL
+from utils.lazy_import import prewarm
+from utils.moderation import moderation_digest
+from utils.stock_feed import feed_app, feed_watcher, setup_feed_routes
 
 # Load .env
 load_dotenv()
 ADMIN_ID = int(os.getenv("ADMIN_ID"))
 
 
+# Log time from process start to the first handled update
+dp.update.outer_middleware(FirstUpdateMiddleware())
+# One update at a time per user (double taps), different users in parallel
+dp.update.outer_middleware(UserLockMiddleware())
+# Resolve caller role once per Telegram id (cached)
+dp.update.outer_middleware(IdentityMiddleware())
+
 # Connect routers
 dp.include_router(start.router)
 dp.include_router(cooperation.router)
@@ -25,21 +46,98 @@ dp.include_router(ai_assistant.router)
 dp.include_router(barcode_verification.router)
 dp.include_router(admin_router)
 
+startup_metrics.mark("imports")
+
+
+@dp.startup()
+async def on_startup():
+    startup_metrics.mark("serving")
+    # Import heavy optional libraries (barcode scanner, ...) in the background
+    asyncio.create_task(prewarm(delay=1.0))
+
+
+async def run_webhook():
+    """
+    Serve updates over HTTP. Several workers can run behind one load
+    balancer when FSM_STORAGE is shared (redis or postgres).
+    """
+    app = feed_app()
+    SimpleRequestHandler(dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET).register(app, path=WEBHOOK_PATH)
+    setup_feed_routes(app)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    # Every worker sets the same webhook; the call is idempotent
+    await bot.set_webhook(WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH, secret_token=WEBHOOK_SECRET)
+    print(f"🌐 Webhook: {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
 
-async def create_tables():
-    """Create database tables"""
-    async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+
+async def start_feed_server():
+    """
+    Polling mode: serve only the stock feed endpoint (if FEED_TOKEN is set).
+    """
+    app = feed_app()
+    if not setup_feed_routes(app):
+        return None
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT).start()
+    print(f"📦 Stock feeds: {WEBAPP_HOST}:{WEBAPP_PORT}")
+    return runner
 
 
 async def main():
-    # Create database tables
-    await create_tables()
-    print("✅ Database tables created")
+    # One query when the schema is current; pending migrations otherwise
+    await ensure_schema(auto_migrate=AUTO_MIGRATE)
+    print("✅ Database schema is up to date")
+
+    # Replay unflushed cart changes and start the write-behind flusher
+    await cart_service.start()
+
+    # Deliver queued notifications in the background
+    await notification_sender.start()
+
+    # Continue broadcasts interrupted by a restart
+    await broadcast_runner.resume_all()
+
+    # Ingest pharmacy stock feed files
+    await feed_watcher.start()
+
+    # Reload cached carts whose drugs the catalog sync changed
+    catalog_watcher.subscribe(cart_service.reload_drugs)
+    await catalog_watcher.start()
+
+    # Summarise new applications and feedback for the moderators
+    await moderation_digest.start()
 
     # Start the bot
     print("🤖 Bot started...")
-    await dp.start_polling(bot)
+    try:
+        if WEBHOOK_URL:
+            await run_webhook()
+        else:
+            # getUpdates does not work while a webhook is set
+            await bot.delete_webhook()
+            feed_server = await start_feed_server()
+            try:
+                await dp.start_polling(bot)
+            finally:
+                if feed_server:
+                    await feed_server.cleanup()
+    finally:
+        await background_jobs.stop()
+        await moderation_digest.stop()
+        await catalog_watcher.stop()
+        await feed_watcher.stop()
+        await broadcast_runner.stop()
+        await notification_sender.stop()
+        await cart_service.stop()
 
 
 if __name__ == "__main__":
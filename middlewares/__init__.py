@@ -0,0 +1,11 @@
+from .identity import IdentityMiddleware, Identity, Role
+from .startup import FirstUpdateMiddleware
+from .user_lock import UserLockMiddleware
+
+__all__ = [
+    "IdentityMiddleware",
+    "Identity",
+    "Role",
+    "FirstUpdateMiddleware",
+    "UserLockMiddleware",
+]
@@ -0,0 +1,158 @@
+"""
+Identity (role) resolution middleware.
+
+Resolves who the caller is (admin / pharmacy admin / registered user / guest)
+once per Telegram id, caches it with a TTL and injects it into handler data as
+``identity``. Handlers declare an ``identity: Identity`` argument to use it.
+
+When a ``User`` or ``Pharmacy`` row is inserted, updated or deleted through
+the ORM, the affected entries are dropped after the transaction commits.
+Bulk SQL updates, and changes made by another worker process, only become
+visible after ``IDENTITY_CACHE_TTL`` (keep it short when running several
+workers).
+"""
+import enum
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User as TelegramUser
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import object_session
+
+from database.db import async_session
+from database.models import Pharmacy, User
+from utils.config import ADMIN_ID, IDENTITY_CACHE_TTL, MODERATOR_IDS
+from utils.ttl_cache import TTLCache, pop_after_commit
+
+
+class Role(enum.Enum):
+    ADMIN = "admin"
+    PHARMACY_ADMIN = "pharmacy_admin"
+    USER = "user"
+    GUEST = "guest"  # has not shared a phone number yet
+
+
+@dataclass(frozen=True)
+class Identity:
+    """
+    Resolved caller identity.
+    """
+    telegram_id: int
+    role: Role
+    is_registered: bool = False
+    pharmacy_id: Optional[int] = None
+    pharmacy_name: Optional[str] = None
+
+    @property
+    def is_admin(self) -> bool:
+        return self.role is Role.ADMIN
+
+    @property
+    def is_moderator(self) -> bool:
+        """
+        May decide cooperation applications and feedback (MODERATOR_IDS).
+        """
+        return self.is_admin or self.telegram_id in MODERATOR_IDS
+
+    @property
+    def is_pharmacy_admin(self) -> bool:
+        return self.pharmacy_id is not None
+
+
+identity_cache = TTLCache(ttl=IDENTITY_CACHE_TTL)
+
+
+async def resolve_identity(telegram_id: int) -> Identity:
+    """
+    Return the caller's identity, querying the database at most once per TTL.
+    """
+    identity = identity_cache.get(telegram_id)
+    if identity is not None:
+        return identity
+
+    generation = identity_cache.generation
+    async with async_session() as session:
+        # One round trip, both lookups go through unique indexes
+        row = (await session.execute(
+            select(
+                select(User.id).where(User.telegram_id == telegram_id)
+                .scalar_subquery().label("user_id"),
+                select(Pharmacy.id).where(Pharmacy.tg_id == telegram_id)
+                .scalar_subquery().label("pharmacy_id"),
+                select(Pharmacy.name).where(Pharmacy.tg_id == telegram_id)
+                .scalar_subquery().label("pharmacy_name"),
+            )
+        )).one()
+
+    if telegram_id == ADMIN_ID:
+        role = Role.ADMIN
+    elif row.pharmacy_id is not None:
+        role = Role.PHARMACY_ADMIN
+    elif row.user_id is not None:
+        role = Role.USER
+    else:
+        role = Role.GUEST
+
+    identity = Identity(
+        telegram_id=telegram_id,
+        role=role,
+        is_registered=row.user_id is not None,
+        pharmacy_id=row.pharmacy_id,
+        pharmacy_name=row.pharmacy_name,
+    )
+    # Not cached if the row changed while it was being read
+    if identity_cache.generation == generation:
+        identity_cache.set(telegram_id, identity)
+    return identity
+
+
+def invalidate_identity(telegram_id: Optional[int]):
+    """
+    Forget the cached identity of a Telegram user.
+    """
+    if telegram_id is not None:
+        identity_cache.pop(telegram_id)
+
+
+class IdentityMiddleware(BaseMiddleware):
+    """
+    Injects ``identity`` for every update that has a sender.
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: Optional[TelegramUser] = data.get("event_from_user")
+        if user is not None:
+            data["identity"] = await resolve_identity(user.id)
+        return await handler(event, data)
+
+
+def _invalidate_changed(target, attribute: str):
+    """
+    Forget, once the change commits, the identities behind the current and
+    previous value of the Telegram id column of a changed row.
+    """
+    history = inspect(target).attrs[attribute].history
+    session = object_session(target)
+    for telegram_id in {getattr(target, attribute), *history.deleted}:
+        if telegram_id is not None:
+            pop_after_commit(session, identity_cache, telegram_id)
+
+
+@event.listens_for(User, "after_insert")
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _user_changed(mapper, connection, target):
+    _invalidate_changed(target, "telegram_id")
+
+
+@event.listens_for(Pharmacy, "after_insert")
+@event.listens_for(Pharmacy, "after_update")
+@event.listens_for(Pharmacy, "after_delete")
+def _pharmacy_changed(mapper, connection, target):
+    _invalidate_changed(target, "tg_id")
@@ -0,0 +1,33 @@
+"""
+Time-to-first-update metric.
+"""
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from utils import startup_metrics
+
+
+class FirstUpdateMiddleware(BaseMiddleware):
+    """
+    Marks when the first update has been handled, then gets out of the way.
+    """
+
+    def __init__(self):
+        self.seen = False
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        if self.seen:
+            return await handler(event, data)
+        self.seen = True
+        try:
+            return await handler(event, data)
+        finally:
+            startup_metrics.mark("first_update")
+            startup_metrics.report()
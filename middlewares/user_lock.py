@@ -0,0 +1,46 @@
+"""
+Per-user update ordering.
+
+Updates of one user are handled one at a time and in arrival order, so a
+double tap on "✅ Tasdiqlash" cannot run two order finalizations at once.
+Updates of different users still run fully in parallel.
+"""
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject, User as TelegramUser
+
+from utils.keyed_lock import KeyedLock
+
+logger = logging.getLogger(__name__)
+
+# Waits longer than this are logged: some handler of that user is slow
+SLOW_WAIT = 2.0  # seconds
+
+
+class UserLockMiddleware(BaseMiddleware):
+    """
+    Serializes updates per Telegram user; updates without a sender pass through.
+    """
+
+    def __init__(self):
+        self.locks = KeyedLock()
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user: Optional[TelegramUser] = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        started = time.monotonic()
+        async with self.locks(user.id):
+            waited = time.monotonic() - started
+            if waited > SLOW_WAIT:
+                logger.warning(f"Update of user {user.id} waited {waited:.1f}s for the previous one")
+            return await handler(event, data)
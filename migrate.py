@@ -0,0 +1,38 @@
+"""
+Database schema migrations.
+
+    python migrate.py           apply pending migrations
+    python migrate.py status    show current and latest schema version
+"""
+import asyncio
+import logging
+import sys
+
+from database.db import close_db
+from database.migrations import LATEST_VERSION, MIGRATIONS, current_version, migrate
+
+
+async def main(argv):
+    command = argv[0] if argv else "up"
+    try:
+        if command == "status":
+            version = await current_version()
+            print(f"Schema versiyasi: {version} (kod talab qiladi: {LATEST_VERSION})")
+            for step in MIGRATIONS:
+                mark = "✅" if step.version <= version else "⏳"
+                print(f"  {mark} {step.version:>3}  {step.name}")
+        elif command == "up":
+            applied = await migrate()
+            for step in applied:
+                print(f"✅ {step.version}: {step.name}")
+            print(f"Schema versiyasi: {LATEST_VERSION}" if applied else "Schema allaqachon yangi.")
+        else:
+            print(__doc__)
+            sys.exit(2)
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,33 @@
+from sqlalchemy.orm import Session
+
+
+class AsyncSessionAdapter:
+    """
+    The parts of AsyncSession the tested code uses, over a sync Session
+    (in-memory SQLite, so no database server is needed).
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    @property
+    def sync_session(self) -> Session:
+        return self.session
+
+    def add(self, instance):
+        self.session.add(instance)
+
+    async def execute(self, *args, **kwargs):
+        return self.session.execute(*args, **kwargs)
+
+    async def scalars(self, *args, **kwargs):
+        return self.session.scalars(*args, **kwargs)
+
+    async def commit(self):
+        self.session.commit()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
@@ -0,0 +1,11 @@
+import os
+import sys
+
+# utils.config reads these at import time
+os.environ.setdefault("BOT_TOKEN", "123:abc")
+os.environ.setdefault("ADMIN_ID", "1")
+# Tests that need PostgreSQL run only against an explicitly given database
+if os.getenv("TEST_DATABASE_URL"):
+    os.environ["DATABASE_URL"] = os.environ["TEST_DATABASE_URL"]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,42 @@
+import asyncio
+
+from utils.background_jobs import BackgroundJobs
+
+
+def test_one_job_per_name():
+    async def scenario():
+        jobs = BackgroundJobs()
+        release = asyncio.Event()
+        done = []
+
+        async def job(label):
+            await release.wait()
+            done.append(label)
+
+        assert jobs.start("import:1", job("first"))
+        assert not jobs.start("import:1", job("second"))  # refused while the first runs
+        assert jobs.start("import:2", job("other"))
+        assert jobs.running("import:1")
+
+        release.set()
+        await asyncio.sleep(0.01)
+        assert sorted(done) == ["first", "other"]
+        assert not jobs.running("import:1")
+        assert jobs.start("import:1", job("again"))
+        await jobs.stop()
+        assert not jobs.running("import:1")
+
+    asyncio.run(scenario())
+
+
+def test_cancel():
+    async def scenario():
+        jobs = BackgroundJobs()
+        jobs.start("restore", asyncio.sleep(60))
+        await asyncio.sleep(0)
+        assert jobs.cancel("restore")
+        await asyncio.sleep(0.01)
+        assert not jobs.running("restore")
+        assert not jobs.cancel("restore")
+
+    asyncio.run(scenario())
@@ -0,0 +1,87 @@
+"""
+Cart writes against PostgreSQL (``INSERT ... ON CONFLICT``). Skipped unless
+TEST_DATABASE_URL points at a migrated database:
+
+    TEST_DATABASE_URL=postgresql+asyncpg://... python -m pytest tests/test_cart_service.py
+"""
+import asyncio
+import os
+
+import pytest
+from sqlalchemy import delete, select
+
+pytestmark = pytest.mark.skipif(not os.getenv("TEST_DATABASE_URL"), reason="TEST_DATABASE_URL is not set")
+
+# Telegram ids are positive, so this user can never collide with a real one
+TEST_USER_ID = -424242
+
+
+async def _with_cart(check):
+    from database.db import async_session, engine
+    from database.models import Cart, Drug
+
+    async with async_session() as session:
+        drug_id = await session.scalar(select(Drug.id).where(Drug.deleted_at.is_(None)).limit(1))
+        if drug_id is None:
+            pytest.skip("drugs table is empty")
+        await session.execute(delete(Cart).where(Cart.user_id == TEST_USER_ID))
+        await session.commit()
+    try:
+        return await check(drug_id)
+    finally:
+        async with async_session() as session:
+            await session.execute(delete(Cart).where(Cart.user_id == TEST_USER_ID))
+            await session.commit()
+        await engine.dispose()
+
+
+async def _stored_quantity(drug_id: int):
+    from database.db import async_session
+    from database.models import Cart
+
+    async with async_session() as session:
+        return await session.scalar(
+            select(Cart.quantity).where(Cart.user_id == TEST_USER_ID, Cart.drug_id == drug_id)
+        )
+
+
+def test_concurrent_add_item():
+    from utils.cart_service import CartService
+
+    taps = 200
+
+    async def check(drug_id):
+        service = CartService(write_behind=False)
+        results = await asyncio.gather(*(service.add_item(TEST_USER_ID, drug_id) for _ in range(taps)))
+        # Every tap is counted exactly once and sees a distinct quantity
+        assert sorted(results) == list(range(1, taps + 1))
+        assert await _stored_quantity(drug_id) == taps
+
+    asyncio.run(_with_cart(check))
+
+
+def test_add_item_keeps_pending_taps(tmp_path):
+    from utils.cart_service import CartService
+
+    async def check(drug_id):
+        service = CartService(wal_path=str(tmp_path / "cart.wal"), write_behind=True)
+        service._open_wal("w")
+        try:
+            await service.add_item(TEST_USER_ID, drug_id)
+            cart = await service.get_cart(TEST_USER_ID)
+            (line,) = cart.items()
+            await service.change_quantity(TEST_USER_ID, line.cart_id, +2)
+
+            # A tap that lands after add_item flushed but before its upsert returns
+            async def no_flush(user_id):
+                pass
+            service.flush_user = no_flush
+            assert await service.add_item(TEST_USER_ID, drug_id) == 4
+
+            del service.flush_user
+            await service.flush_user(TEST_USER_ID)
+            assert await _stored_quantity(drug_id) == 4
+        finally:
+            service._wal.close()
+
+    asyncio.run(_with_cart(check))
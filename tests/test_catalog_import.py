@@ -0,0 +1,38 @@
+import asyncio
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from async_adapter import AsyncSessionAdapter
+from database.models import Drug
+from utils.catalog_import import ImportReport, ImportRow, process_chunk
+
+
+def make_session() -> Session:
+    engine = create_engine("sqlite://")
+    Drug.__table__.create(engine)
+    return Session(engine)
+
+
+def test_apply_changed_drug():
+    session = make_session()
+    session.add_all([
+        Drug(id=1, drug_id=101, name="Paracetamol", manufacturer="A", price=1000, category="analgesic"),
+        Drug(id=2, drug_id=102, name="Ibuprofen", manufacturer="B", price=2000),
+    ])
+    session.commit()
+
+    rows = [
+        ImportRow(line=2, drug_id=101, drug={"price": 1500, "category": None}),
+        ImportRow(line=3, drug_id=102, drug={"price": 2000, "name": "Ibuprofen forte"}),
+    ]
+    report = ImportReport(rows=len(rows))
+    asyncio.run(process_chunk(AsyncSessionAdapter(session), rows, report, pharmacy_ids=set(), apply=True))
+    session.commit()
+
+    assert report.drugs_changed == 2 and report.error_count == 0
+    stored = {drug.drug_id: drug for drug in session.scalars(select(Drug).execution_options(populate_existing=True))}
+    assert stored[101].price == 1500
+    assert stored[101].category == "analgesic"  # None keeps the stored value
+    assert stored[102].name == "Ibuprofen forte"
+    assert stored[102].price == 2000
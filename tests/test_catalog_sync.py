@@ -0,0 +1,13 @@
+from utils.catalog_sync import drug_values
+
+
+def test_drug_values_skips_malformed_rows():
+    assert drug_values({"drugId": "abc", "name": "Paracetamol"}) is None
+    assert drug_values({"name": "Paracetamol"}) is None
+    assert drug_values({"drugId": 7, "name": ""}) is None
+    assert drug_values({"drugId": 7, "name": "Paracetamol", "price": "n/a"}) is None
+
+    values = drug_values({"drugId": "7", "name": "Paracetamol", "priceBase": "1234.5", "prescription": "Retsipli"})
+    assert values["drug_id"] == 7
+    assert values["price"] == 1234
+    assert values["prescription_required"] is True
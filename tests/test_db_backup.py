@@ -0,0 +1,101 @@
+import gzip
+import hashlib
+
+import pytest
+
+from database.migrations import LATEST_VERSION
+from utils.db_backup import (
+    FORMAT,
+    FORMAT_VERSION,
+    BackupError,
+    _meta_line,
+    _row_line,
+    backup_tables,
+    read_archive,
+)
+
+
+def archive_lines(rows_by_table: dict) -> list:
+    """
+    Lines of an archive as ``create_backup`` writes them.
+    """
+    tables = backup_tables()
+    lines = [_meta_line({
+        "format": FORMAT,
+        "version": FORMAT_VERSION,
+        "schema": LATEST_VERSION,
+        "created_at": "2026-10-19T00:00:00+00:00",
+        "tables": [table.name for table in tables],
+        "sequences": {},
+    })]
+    for table in tables:
+        columns = [column.name for column in table.columns]
+        rows = [_row_line(row) for row in rows_by_table.get(table.name, [])]
+        lines.append(_meta_line({"table": table.name, "columns": columns}))
+        lines.extend(rows)
+        end = {"end": table.name, "rows": len(rows), "sha256": hashlib.sha256(b"".join(rows)).hexdigest()}
+        lines.append(_meta_line(end))
+    return lines
+
+
+def write(path, lines: list) -> str:
+    with gzip.open(path, "wb") as out:
+        out.write(b"".join(lines))
+    return str(path)
+
+
+def pharmacy_rows(count: int) -> list:
+    columns = [column.name for column in next(t for t in backup_tables() if t.name == "pharmacies").columns]
+    return [[index if name == "id" else None for name in columns] for index in range(1, count + 1)]
+
+
+def test_round_trip(tmp_path):
+    path = write(tmp_path / "backup.ndjson.gz", archive_lines({"pharmacies": pharmacy_rows(5)}))
+
+    items = list(read_archive(path, chunk_size=2))
+    assert items[0][0] == "header"
+    tables = [value[0] for kind, value in items if kind == "table"]
+    assert tables == [table.name for table in backup_tables()]
+    rows = [row for kind, chunk in items if kind == "rows" for row in chunk]
+    assert [row[0] for row in rows] == [1, 2, 3, 4, 5]
+    assert max(len(chunk) for kind, chunk in items if kind == "rows") == 2
+    ends = {summary.name: summary.rows for kind, summary in items if kind == "end"}
+    assert ends["pharmacies"] == 5
+
+
+def test_rejects_changed_row(tmp_path):
+    lines = archive_lines({"pharmacies": pharmacy_rows(3)})
+    index = next(i for i, line in enumerate(lines) if line.startswith(b"[2,"))
+    lines[index] = lines[index].replace(b"[2,", b"[7,", 1)
+    path = write(tmp_path / "backup.ndjson.gz", lines)
+
+    with pytest.raises(BackupError, match="nazorat"):
+        list(read_archive(path))
+
+
+def test_rejects_missing_tables(tmp_path):
+    lines = archive_lines({"pharmacies": pharmacy_rows(3)})
+    path = write(tmp_path / "backup.ndjson.gz", lines[:-3])
+
+    with pytest.raises(BackupError, match="to'liq emas"):
+        list(read_archive(path))
+
+
+def test_rejects_truncated_file(tmp_path):
+    path = write(tmp_path / "backup.ndjson.gz", archive_lines({"pharmacies": pharmacy_rows(50)}))
+    with open(path, "rb") as src:
+        data = src.read()
+    with open(path, "wb") as out:
+        out.write(data[: len(data) // 2])
+
+    with pytest.raises(BackupError):
+        list(read_archive(path))
+
+
+def test_rejects_other_schema(tmp_path):
+    lines = archive_lines({})
+    lines[0] = lines[0].replace(f'"schema":{LATEST_VERSION}'.encode(), b'"schema":0')
+    path = write(tmp_path / "backup.ndjson.gz", lines)
+
+    with pytest.raises(BackupError, match="sxema"):
+        list(read_archive(path))
@@ -0,0 +1,30 @@
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from database.models import User
+from middlewares.identity import identity_cache
+
+
+def make_session() -> Session:
+    engine = create_engine("sqlite://")
+    User.__table__.create(engine)
+    return Session(engine)
+
+
+def test_identity_dropped_after_commit_only():
+    session = make_session()
+    identity_cache.set(5, "cached")
+
+    session.add(User(telegram_id=5, fullname="Test"))
+    session.flush()
+    assert identity_cache.get(5) == "cached"  # not committed yet
+
+    session.rollback()
+    assert identity_cache.get(5) == "cached"  # nothing changed
+
+    generation = identity_cache.generation
+    session.add(User(telegram_id=5, fullname="Test"))
+    session.commit()
+    assert identity_cache.get(5) is None
+    # A lookup that started before the commit will not store the old row
+    assert identity_cache.generation != generation
@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import BigInteger, create_engine, select
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+
+from async_adapter import AsyncSessionAdapter
+from database.models import AdminAuditLog, Application, NotificationOutbox
+from utils.moderation import decide
+
+MODERATOR, OTHER = 1, 2
+
+
+@compiles(BigInteger, "sqlite")
+def _bigint_as_integer(type_, compiler, **kw):
+    # SQLite only generates ids for INTEGER PRIMARY KEY columns
+    return "INTEGER"
+
+
+def make_session() -> Session:
+    engine = create_engine("sqlite://")
+    for model in (Application, NotificationOutbox):
+        model.__table__.create(engine)
+    return Session(engine)
+
+
+def application(id: int, **values) -> Application:
+    values.setdefault("user_id", 100 + id)
+    return Application(id=id, full_name="X", phone="1", pharmacy_name="-", **values)
+
+
+def test_decide_touches_only_free_pending_rows():
+    session = make_session()
+    now = datetime.utcnow()
+    session.add_all([
+        application(1),
+        application(2, claimed_by=MODERATOR, claimed_until=now + timedelta(hours=1)),
+        application(3, claimed_by=OTHER, claimed_until=now + timedelta(hours=1)),  # held by another moderator
+        application(4, claimed_by=OTHER, claimed_until=now - timedelta(hours=1)),  # expired claim
+        application(5, approved=False, decided_by=OTHER),  # already decided
+        application(6, user_id=None),
+    ])
+    session.commit()
+
+    rows = asyncio.run(decide(AsyncSessionAdapter(session), "app", [1, 2, 3, 4, 5, 6, 7], True, MODERATOR))
+
+    assert sorted(row.id for row in rows) == [1, 2, 4, 6]
+    # The audit log is PostgreSQL-only (ARRAY column): check the entry and drop it
+    [entry] = [obj for obj in session.new if isinstance(obj, AdminAuditLog)]
+    assert (entry.action, entry.target_ids) == ("applications.approve", [1, 2, 4, 6])
+    session.expunge(entry)
+    session.commit()
+
+    stored = {row.id: row for row in session.scalars(select(Application))}
+    assert {id for id, row in stored.items() if row.approved} == {1, 2, 4, 6}
+    assert all(stored[id].decided_by == MODERATOR for id in (1, 2, 4, 6))
+    assert stored[3].approved is None and stored[3].claimed_by == OTHER
+    assert stored[5].approved is False and stored[5].decided_by == OTHER
+    # Authors are notified; the application without one is not
+    chats = sorted(job.chat_id for job in session.scalars(select(NotificationOutbox)))
+    assert chats == [101, 102, 104]
+
+
+def test_decide_twice_decides_once():
+    session = make_session()
+    session.add(application(1))
+    session.commit()
+    adapter = AsyncSessionAdapter(session)
+
+    assert len(asyncio.run(decide(adapter, "app", [1], False, MODERATOR))) == 1
+    session.expunge_all()
+    session.commit()
+    assert asyncio.run(decide(adapter, "app", [1], True, OTHER)) == []
+    session.commit()
+
+    stored = session.scalars(select(Application)).one()
+    assert (stored.approved, stored.decided_by) == (False, MODERATOR)
+    assert len(session.scalars(select(NotificationOutbox)).all()) == 1
@@ -0,0 +1,33 @@
+import asyncio
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+import utils.notifications as notifications
+from async_adapter import AsyncSessionAdapter
+from database.models import NotificationOutbox
+from utils.notifications import NotificationSender
+
+
+def test_deferred_send_does_not_use_up_an_attempt(monkeypatch):
+    engine = create_engine("sqlite://")
+    NotificationOutbox.__table__.create(engine)
+    session = Session(engine)
+    # As left by the claim, which counts the attempt up front
+    session.add(NotificationOutbox(id=1, chat_id=42, text="Salom", status="sending", attempts=3,
+                                   last_error="Telegram server error"))
+    session.commit()
+    monkeypatch.setattr(notifications, "async_session", lambda: AsyncSessionAdapter(session))
+
+    sender = NotificationSender()
+    sender._chat_limit.penalize(42, 600)
+    job = SimpleNamespace(id=1, chat_id=42, text="Salom", photo=None, parse_mode=None,
+                          reply_markup=None, attempts=3, last_error="Telegram server error")
+    outcome = asyncio.run(sender._send(job))
+    assert outcome["b_status"] == "pending"
+    assert outcome["b_deferred"] == 1
+
+    asyncio.run(sender._record([outcome]))
+    row = session.scalars(select(NotificationOutbox)).one()
+    assert (row.status, row.attempts, row.last_error) == ("pending", 2, "Telegram server error")
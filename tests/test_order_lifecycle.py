@@ -0,0 +1,83 @@
+import asyncio
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+
+from async_adapter import AsyncSessionAdapter
+from database.models import Drug, Order, OrderItem, Pharmacy, PharmacyDrug
+from utils.order_lifecycle import restock, take_stock
+
+
+def make_session() -> Session:
+    engine = create_engine("sqlite://")
+    for model in (Pharmacy, Drug, PharmacyDrug, Order, OrderItem):
+        model.__table__.create(engine)
+    return Session(engine)
+
+
+def test_restock_returns_items_to_their_pharmacy():
+    session = make_session()
+    session.add_all([
+        Pharmacy(id=1, name="A"),
+        Pharmacy(id=2, name="B"),
+        Drug(id=1, drug_id=101, name="Paracetamol"),
+        Drug(id=2, drug_id=102, name="Ibuprofen"),
+        PharmacyDrug(pharmacy_id=1, drug_id=1, residual=3),
+        PharmacyDrug(pharmacy_id=1, drug_id=2, residual=0),
+        PharmacyDrug(pharmacy_id=2, drug_id=1, residual=7),
+    ])
+    for order_id, pharmacy_id in ((1, 1), (2, 1), (3, 2)):
+        session.add(Order(id=order_id, user_id=5, pharmacy_id=pharmacy_id, full_name="X", phone="1", address="-"))
+    session.add_all([
+        OrderItem(order_id=1, drug_id=1, quantity=2, price=1000),
+        OrderItem(order_id=1, drug_id=2, quantity=1, price=2000),
+        OrderItem(order_id=2, drug_id=1, quantity=4, price=1000),
+        OrderItem(order_id=3, drug_id=1, quantity=5, price=1000),
+    ])
+    session.commit()
+
+    updated = asyncio.run(restock(AsyncSessionAdapter(session), [1, 2]))
+    session.commit()
+
+    assert updated == 2
+    stock = {
+        (row.pharmacy_id, row.drug_id): row.residual
+        for row in session.execute(select(PharmacyDrug.pharmacy_id, PharmacyDrug.drug_id, PharmacyDrug.residual))
+    }
+    assert stock == {(1, 1): 9, (1, 2): 1, (2, 1): 7}
+
+
+def test_take_stock_refuses_short_items():
+    session = make_session()
+    session.add_all([
+        Pharmacy(id=1, name="A"),
+        Drug(id=1, drug_id=101, name="Paracetamol"),
+        Drug(id=2, drug_id=102, name="Ibuprofen"),
+        Drug(id=3, drug_id=103, name="Aspirin"),
+        PharmacyDrug(pharmacy_id=1, drug_id=1, residual=3),
+        PharmacyDrug(pharmacy_id=1, drug_id=2, residual=1),
+    ])
+    session.commit()
+
+    # Drug 3 is not listed at all, drug 2 has one unit less than ordered
+    short = asyncio.run(take_stock(AsyncSessionAdapter(session), 1, [(1, 2), (2, 2), (3, 1)]))
+    assert short == {2, 3}
+    session.rollback()
+
+    short = asyncio.run(take_stock(AsyncSessionAdapter(session), 1, [(1, 3), (2, 1)]))
+    session.commit()
+    assert short == set()
+    stock = dict(session.execute(select(PharmacyDrug.drug_id, PharmacyDrug.residual)).all())
+    assert stock == {1: 0, 2: 0}
+
+    # A cancelled order gives back exactly what it took
+    session.add(Order(id=1, user_id=5, pharmacy_id=1, full_name="X", phone="1", address="-"))
+    session.add_all([
+        OrderItem(order_id=1, drug_id=1, quantity=3, price=1000),
+        OrderItem(order_id=1, drug_id=2, quantity=1, price=2000),
+    ])
+    session.commit()
+    asyncio.run(restock(AsyncSessionAdapter(session), [1]))
+    session.commit()
+    stock = dict(session.execute(select(PharmacyDrug.drug_id, PharmacyDrug.residual)).all())
+    assert stock == {1: 3, 2: 1}
@@ -0,0 +1,48 @@
+from datetime import date
+
+import pytest
+
+from handlers.admin.orders import BULK_LIMIT, parse_order_ids
+from utils.order_search import OrderQuery, parse_order_query
+from utils.pickup_code import encode_pickup_code
+
+
+def test_parse_order_query_shapes():
+    code = encode_pickup_code(42)
+    assert parse_order_query(code) == OrderQuery("code", code)
+    assert parse_order_query(f"  {code[3:].lower()} ") == OrderQuery("code", code)
+    assert parse_order_query("#1234") == OrderQuery("id", 1234)
+    assert parse_order_query("# 7") == OrderQuery("id", 7)
+    assert parse_order_query("1234") == OrderQuery("number", "1234")
+    assert parse_order_query("+998 (90) 123-45-67") == OrderQuery("number", "998901234567")
+    assert parse_order_query("14.10.2026") == OrderQuery("dates", (date(2026, 10, 14), date(2026, 10, 14)))
+
+
+def test_parse_order_query_date_range_is_ordered():
+    expected = OrderQuery("dates", (date(2026, 10, 1), date(2026, 10, 14)))
+    assert parse_order_query("01.10.2026-14.10.2026") == expected
+    assert parse_order_query("14.10.2026 – 1.10.2026") == expected
+    assert expected.describe == "01.10.2026 – 14.10.2026"
+
+
+@pytest.mark.parametrize("raw", ["", "   ", "31.02.2026", "#", "#12a", "aspirin", "- ()"])
+def test_parse_order_query_rejects(raw):
+    assert parse_order_query(raw) is None
+
+
+def test_parse_order_ids():
+    assert parse_order_ids("12, 15 20-22;12") == [12, 15, 20, 21, 22]
+    assert parse_order_ids(f"1-{BULK_LIMIT}") == list(range(1, BULK_LIMIT + 1))
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    " , ",
+    "12 abc",
+    "#12",
+    "20-10",
+    f"1-{BULK_LIMIT + 1}",
+    f"1-{BULK_LIMIT} {BULK_LIMIT + 5}",
+])
+def test_parse_order_ids_rejects(text):
+    assert parse_order_ids(text) is None
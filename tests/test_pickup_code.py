@@ -0,0 +1,30 @@
+from utils.pickup_code import ALPHABET, _check_char, encode_pickup_code, normalize_pickup_code
+
+
+def test_codes_round_trip():
+    for number in range(1, 5000):
+        code = encode_pickup_code(number)
+        assert normalize_pickup_code(code) == code
+        assert normalize_pickup_code(code[3:].lower()) == code
+
+
+def test_check_char_catches_typos_and_swaps():
+    # A sum mod 31 gave 0 and Z the same value
+    assert _check_char("00000") != _check_char("0000Z")
+    for number in range(1, 500):
+        body = encode_pickup_code(number)[3:-1]
+        check = _check_char(body)
+        for position in range(len(body)):
+            for ch in ALPHABET:
+                if ch != body[position]:
+                    assert _check_char(body[:position] + ch + body[position + 1:]) != check
+            swapped = body[:position] + body[position + 1:position + 2] + body[position] + body[position + 2:]
+            if swapped != body:
+                assert _check_char(swapped) != check
+
+
+def test_mistyped_codes_rejected():
+    code = encode_pickup_code(42)
+    typo = code[:-1] + ("0" if code[-1] != "0" else "1")
+    assert normalize_pickup_code(typo) is None
+    assert normalize_pickup_code(code[:-1]) is None
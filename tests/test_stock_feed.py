@@ -0,0 +1,59 @@
+import pytest
+
+from utils.stock_feed import FeedDropWatcher, FeedError, parse_csv, parse_feed
+
+
+def test_parse_json_feed():
+    body = b'{"mode": "full", "items": [{"drug_id": 101, "residual": 5, "price": 12000}, {"drug_id": 102, "residual": "3"}]}'
+    assert parse_feed(body, "application/json", None) == ("full", [(101, 5, 12000), (102, 3, None)])
+
+
+def test_parse_feed_mode_defaults():
+    # The body's mode wins over the query's; without either the feed is a delta
+    assert parse_feed(b'{"mode": "delta", "items": []}', "application/json", "full")[0] == "delta"
+    assert parse_feed(b'[{"drug_id": 1, "residual": 0}]', "application/json", "FULL")[0] == "full"
+    assert parse_feed(b"[]", "application/json", None)[0] == "delta"
+
+
+@pytest.mark.parametrize("body, content_type, mode", [
+    (b"{not json", "application/json", None),
+    (b'{"items": {}}', "application/json", None),
+    (b"[]", "application/json", "partial"),
+    (b'[{"residual": 1}]', "application/json", None),
+    (b'[{"drug_id": 1, "residual": -1}]', "application/json", None),
+    (b'[{"drug_id": 1, "residual": "NaN"}]', "application/json", None),
+    (b'[{"drug_id": 1, "residual": 1, "price": 1e12}]', "application/json", None),
+    (b"name,residual\nParacetamol,5\n", "text/csv", None),
+])
+def test_parse_feed_rejects(body, content_type, mode):
+    with pytest.raises(FeedError):
+        parse_feed(body, content_type, mode)
+
+
+def test_parse_csv():
+    body = (
+        "\ufeffDrug_ID, Residual ,price,deleted\n"
+        "101,5,12000,\n"
+        "102,,,true\n"
+        ",7,,\n"
+        "103,2,,0\n"
+    ).encode("utf-8")
+    assert parse_csv(body) == [(101, 5, 12000), (102, None, None), (103, 2, None)]
+
+
+def test_parse_csv_feed_takes_mode_from_query():
+    assert parse_feed(b"drug_id,residual\n1,4\n", "text/csv; charset=utf-8", "full") == ("full", [(1, 4, None)])
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("12_full.json", (12, "full")),
+    ("12_DELTA_2024-05-01.csv", (12, "delta")),
+])
+def test_parse_name(name, expected):
+    assert FeedDropWatcher.parse_name(name) == expected
+
+
+@pytest.mark.parametrize("name", ["full_12.csv", "12.csv", "12_partial.json", "x12_full.csv"])
+def test_parse_name_rejects(name):
+    with pytest.raises(FeedError):
+        FeedDropWatcher.parse_name(name)
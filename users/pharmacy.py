@@ -1,206 +1,238 @@
+import html
+from datetime import datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+
 from aiogram import Router, types, F
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from keyboards import get_pharmacy_menu
-from sqlalchemy import select, func
-from database.models import Pharmacy, Order
+from sqlalchemy import select
+from database.models import Pharmacy, Order, OrderItem, Drug, ACTIVE_ORDER_STATUSES
 from database.db import async_session
+from middlewares.identity import Identity
+from utils.config import ORDERS_PER_PAGE, TIMEZONE
+from utils.order_lifecycle import STATUS_LABELS, notify_customer, order_action_rows, transition_order
+from utils.pagination import NEXT, PREV, Page, decode_cursor, fetch_page
+from utils.pickup_code import normalize_pickup_code
+from utils.render_fingerprint import edit_if_changed
+from utils.stats_rollup import pharmacy_totals
 
 router = Router()
 
 
-@router.callback_query(F.data == "pharmacy_orders")
-async def show_all_orders(callback: types.CallbackQuery):
+class PickupLookupState(StatesGroup):
     """
-    Display all recent orders belonging to the pharmacy owner.
-    Shows up to 10 latest orders in descending order by creation date.
+    FSM state for finding an order by its pickup code.
     """
-    async with async_session() as session:
-        user_id = callback.from_user.id
-        result = await session.execute(
-            select(Pharmacy).where(Pharmacy.tg_id == user_id)
-        )
-        pharmacy = result.scalar_one_or_none()
+    waiting_for_code = State()
+
+
+# Order list filters: callback value -> (button label, title)
+STATUS_FILTERS = {
+    "all": ("Hammasi", "📋 Barcha"),
+    "pending": ("⏳", "⏳ Kutilayotgan"),
+    "confirmed": ("✅", "✅ Tasdiqlangan"),
+    "ready": ("🔔", "🔔 Tayyor"),
+    "completed": ("✔️", "✔️ Yakunlangan"),
+    "cancelled": ("❌", "❌ Bekor qilingan"),
+}
+PERIOD_FILTERS = {
+    "all": "Barchasi",
+    "1d": "Bugun",
+    "7d": "7 kun",
+    "30d": "30 kun",
+}
+STATUS_EMOJI = {
+    "pending": "⏳",
+    "confirmed": "✅",
+    "ready": "🔔",
+    "completed": "✔️",
+    "cancelled": "❌",
+}
+LOCAL_TZ = ZoneInfo(TIMEZONE)
+# Separates an order message from its current status line
+STATUS_MARKER = "\n\n📊 Holat: "
+
+
+def orders_callback(status: str, period: str, cursor: Optional[str] = None, direction: str = NEXT) -> str:
+    """
+    Callback data for an order list page: "ph:o:<status>:<period>:<direction><cursor>".
+    """
+    return f"ph:o:{status}:{period}:{direction + cursor if cursor else ''}"
 
-        # If the user is not a pharmacy owner
-        if not pharmacy:
-            await callback.answer("Siz dorixona egasi emassiz!", show_alert=True)
-            return
 
-        # Retrieve the last 10 orders for the pharmacy
-        result = await session.execute(
-            select(Order)
-            .where(Order.pharmacy_id == pharmacy.id)
-            .order_by(Order.created_at.desc())
-            .limit(10)
-        )
-        orders = result.scalars().all()
-
-        # If there are no orders
-        if not orders:
-            await callback.message.edit_text(
-                "Hozircha buyurtmalar yo‘q.",
-                reply_markup=InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [InlineKeyboardButton(text="🔙 Orqaga", callback_data="back_to_pharmacy_menu")]
-                    ]
-                ),
-            )
-            return
+def period_start(period: str) -> Optional[datetime]:
+    """
+    Lower bound of ``created_at`` for a period filter (local calendar days).
+    """
+    if period == "all":
+        return None
+    days = int(period[:-1])
+    today = datetime.now(LOCAL_TZ).replace(hour=0, minute=0, second=0, microsecond=0)
+    return today - timedelta(days=days - 1)
 
-        # Build message text
-        text = f"📋 <b>{pharmacy.name}</b> - Buyurtmalar\n\n"
-
-        for order in orders:
-            # Emoji for order status
-            status_emoji = {
-                "pending": "⏳",
-                "confirmed": "✅",
-                "ready": "🔔",
-                "completed": "✔️",
-                "cancelled": "❌",
-            }.get(order.status, "❓")
-
-            # Add order details to message text
-            text += (
-                f"{status_emoji} <b>Buyurtma #{order.id}</b>\n"
-                f"👤 {order.full_name}\n"
-                f"📞 {order.phone}\n"
-                f"💰 {order.total_amount:,} so‘m\n"
-                f"📍 {order.delivery_type}\n"
-                f"📊 Status: {order.status}\n"
-                f"{'🔑 Kod: ' + order.pickup_code if order.pickup_code else ''}\n"
-                f"━━━━━━━━━━━━━━━\n\n"
-            )
 
-        # Back button
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="🔙 Orqaga", callback_data="back_to_pharmacy_menu")]
-            ]
+def orders_keyboard(status: str, period: str, page: Page) -> InlineKeyboardMarkup:
+    """
+    Page navigation plus status and period filter buttons.
+    """
+    rows = []
+
+    nav = []
+    if page.prev_cursor:
+        nav.append(InlineKeyboardButton(
+            text="⬅️ Oldingi", callback_data=orders_callback(status, period, page.prev_cursor, PREV)
+        ))
+    if page.next_cursor:
+        nav.append(InlineKeyboardButton(
+            text="Keyingi ➡️", callback_data=orders_callback(status, period, page.next_cursor, NEXT)
+        ))
+    if nav:
+        rows.append(nav)
+
+    rows.append([
+        InlineKeyboardButton(
+            text=f"• {label} •" if key == status else label,
+            callback_data=orders_callback(key, period),
         )
-
-        # Send message with orders
-        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+        for key, (label, _) in STATUS_FILTERS.items()
+    ])
+    rows.append([
+        InlineKeyboardButton(
+            text=f"• {label} •" if key == period else label,
+            callback_data=orders_callback(status, key),
+        )
+        for key, label in PERIOD_FILTERS.items()
+    ])
+    rows.append([InlineKeyboardButton(text="🔙 Orqaga", callback_data="back_to_pharmacy_menu")])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
 
-@router.callback_query(F.data.in_(["pharmacy_pending", "pharmacy_confirmed", "pharmacy_ready"]))
-async def show_orders_by_status(callback: types.CallbackQuery):
+def render_order(order: Order) -> str:
     """
-    Display pharmacy orders filtered by their current status.
+    Short order card used in the order lists.
+    """
+    created = order.created_at.astimezone(LOCAL_TZ).strftime("%d.%m %H:%M") if order.created_at else ""
+    text = (
+        f"{STATUS_EMOJI.get(order.status, '❓')} <b>Buyurtma #{order.id}</b> · {created}\n"
+        f"👤 {html.escape(order.full_name or '')}\n"
+        f"📞 {html.escape(order.phone or '')}\n"
+        f"💰 {order.total_amount or 0:,} so‘m\n"
+        f"📍 {order.delivery_type}\n"
+    )
+    if order.pickup_code:
+        text += f"🔑 Kod: {order.pickup_code}\n"
+    return text + "━━━━━━━━━━━━━━━\n\n"
+
+
+async def show_orders_page(
+    callback: types.CallbackQuery,
+    identity: Identity,
+    status: str = "all",
+    period: str = "all",
+    cursor: Optional[str] = None,
+    direction: str = NEXT,
+):
     """
+    Render one keyset-paginated page of the pharmacy's orders.
+    """
+    # If the user is not a pharmacy owner
+    if not identity.is_pharmacy_admin:
+        await callback.answer("Siz dorixona egasi emassiz!", show_alert=True)
+        return
+
+    stmt = select(Order).where(Order.pharmacy_id == identity.pharmacy_id)
+    if status != "all":
+        stmt = stmt.where(Order.status == status)
+    since = period_start(period)
+    if since:
+        stmt = stmt.where(Order.created_at >= since)
+
     async with async_session() as session:
-        user_id = callback.from_user.id
-        status_map = {
-            "pharmacy_pending": "pending",
-            "pharmacy_confirmed": "confirmed",
-            "pharmacy_ready": "ready",
-        }
-        status = status_map[callback.data]
-
-        # Get pharmacy by Telegram user ID
-        result = await session.execute(
-            select(Pharmacy).where(Pharmacy.tg_id == user_id)
+        page = await fetch_page(
+            session, stmt, Order.created_at, Order.id,
+            limit=ORDERS_PER_PAGE, cursor=cursor, direction=direction,
         )
-        pharmacy = result.scalar_one_or_none()
 
-        # If user is not a pharmacy owner
-        if not pharmacy:
-            await callback.answer("Siz dorixona egasi emassiz!", show_alert=True)
-            return
+    title = STATUS_FILTERS[status][1]
+    if page.items:
+        text = f"<b>{html.escape(identity.pharmacy_name or '')}</b> · {title} buyurtmalar\n\n"
+        text += "".join(render_order(order) for order in page.items)
+    else:
+        text = f"{title} buyurtmalar yo‘q."
 
-        # Get orders by selected status
-        result = await session.execute(
-            select(Order)
-            .where(Order.pharmacy_id == pharmacy.id, Order.status == status)
-            .order_by(Order.created_at.desc())
-        )
-        orders = result.scalars().all()
-
-        # Status title mapping
-        status_titles = {
-            "pending": "⏳ Kutilayotgan",
-            "confirmed": "✅ Tasdiqlangan",
-            "ready": "🔔 Tayyor",
-        }
-
-        # If there are no orders for this status
-        if not orders:
-            await callback.message.edit_text(
-                f"{status_titles[status]} buyurtmalar yo‘q.",
-                reply_markup=InlineKeyboardMarkup(
-                    inline_keyboard=[
-                        [InlineKeyboardButton(text="🔙 Orqaga", callback_data="back_to_pharmacy_menu")]
-                    ]
-                ),
-            )
-            return
+    await edit_if_changed(
+        callback.message,
+        text,
+        reply_markup=orders_keyboard(status, period, page),
+        parse_mode="HTML",
+    )
+    await callback.answer()
 
-        # Build message text
-        text = f"<b>{status_titles[status]} buyurtmalar</b>\n\n"
-
-        for order in orders:
-            # Add order details
-            text += (
-                f"<b>Buyurtma #{order.id}</b>\n"
-                f"👤 {order.full_name}\n"
-                f"📞 {order.phone}\n"
-                f"💰 {order.total_amount:,} so‘m\n"
-                f"📍 {order.delivery_type}\n"
-                f"{'🔑 Kod: ' + order.pickup_code if order.pickup_code else ''}\n"
-                f"━━━━━━━━━━━━━━━\n\n"
-            )
 
-        # Back button
-        keyboard = InlineKeyboardMarkup(
-            inline_keyboard=[
-                [InlineKeyboardButton(text="🔙 Orqaga", callback_data="back_to_pharmacy_menu")]
-            ]
-        )
+@router.callback_query(F.data == "pharmacy_orders")
+async def show_all_orders(callback: types.CallbackQuery, identity: Identity):
+    """
+    Display the latest orders of the pharmacy, newest first, page by page.
+    """
+    await show_orders_page(callback, identity)
+
+
+@router.callback_query(F.data.in_(["pharmacy_pending", "pharmacy_confirmed", "pharmacy_ready"]))
+async def show_orders_by_status(callback: types.CallbackQuery, identity: Identity):
+    """
+    Display pharmacy orders filtered by their current status.
+    """
+    status = callback.data.removeprefix("pharmacy_")
+    await show_orders_page(callback, identity, status=status)
+
 
-        # Send result message
-        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+@router.callback_query(F.data.startswith("ph:o:"))
+async def paginate_orders(callback: types.CallbackQuery, identity: Identity):
+    """
+    Handle page and filter buttons of the order lists.
+    """
+    try:
+        _, _, status, period, position = callback.data.split(":")
+        if status not in STATUS_FILTERS or period not in PERIOD_FILTERS:
+            raise ValueError(callback.data)
+        direction, cursor = (position[0], position[1:]) if position else (NEXT, None)
+        if cursor:
+            decode_cursor(cursor)
+    except ValueError:
+        await callback.answer("❌ Noto‘g‘ri ma’lumot", show_alert=True)
+        return
+
+    await show_orders_page(callback, identity, status, period, cursor, direction)
 
 
 @router.callback_query(F.data == "pharmacy_stats")
-async def show_pharmacy_stats(callback: types.CallbackQuery):
+async def show_pharmacy_stats(callback: types.CallbackQuery, identity: Identity):
     """
     Display summarized statistics for the pharmacy:
     total orders, status breakdown, and total revenue.
     """
-    async with async_session() as session:
-        user_id = callback.from_user.id
-        result = await session.execute(
-            select(Pharmacy).where(Pharmacy.tg_id == user_id)
-        )
-        pharmacy = result.scalar_one_or_none()
-
-        # If not a pharmacy owner
-        if not pharmacy:
-            await callback.answer("Siz dorixona egasi emassiz!", show_alert=True)
-            return
+    # If not a pharmacy owner
+    if not identity.is_pharmacy_admin:
+        await callback.answer("Siz dorixona egasi emassiz!", show_alert=True)
+        return
 
-        # Query statistics for this pharmacy
-        result = await session.execute(
-            select(
-                func.count(Order.id).label("total"),
-                func.count(Order.id).filter(Order.status == "pending").label("pending"),
-                func.count(Order.id).filter(Order.status == "confirmed").label("confirmed"),
-                func.count(Order.id).filter(Order.status == "ready").label("ready"),
-                func.count(Order.id).filter(Order.status == "completed").label("completed"),
-                func.sum(Order.total_amount).filter(Order.status == "completed").label("total_revenue"),
-            ).where(Order.pharmacy_id == pharmacy.id)
-        )
-        stats = result.one()
+    async with async_session() as session:
+        # Summed from per-day rollup rows instead of scanning all orders
+        stats = await pharmacy_totals(session, identity.pharmacy_id)
 
         # Build message text with statistics
         text = (
-            f"📊 <b>{pharmacy.name}</b> - Statistika\n\n"
+            f"📊 <b>{identity.pharmacy_name}</b> - Statistika\n\n"
             f"📦 Jami buyurtmalar: {stats.total}\n"
             f"⏳ Kutilayotgan: {stats.pending or 0}\n"
             f"✅ Tasdiqlangan: {stats.confirmed or 0}\n"
             f"🔔 Tayyor: {stats.ready or 0}\n"
-            f"✔️ Yakunlangan: {stats.completed or 0}\n\n"
-            f"💰 Jami daromad: {stats.total_revenue or 0:,} so‘m"
+            f"✔️ Yakunlangan: {stats.completed or 0}\n"
+            f"❌ Bekor qilingan: {stats.cancelled or 0}\n\n"
+            f"💰 Jami daromad: {stats.revenue or 0:,} so‘m"
         )
 
         # Back button
@@ -211,29 +243,175 @@ async def show_pharmacy_stats(callback: types.CallbackQuery):
         )
 
         # Send statistics message
-        await callback.message.edit_text(text, reply_markup=keyboard, parse_mode="HTML")
+        await edit_if_changed(callback.message, text, reply_markup=keyboard, parse_mode="HTML")
 
 
 @router.callback_query(F.data == "back_to_pharmacy_menu")
-async def back_to_menu(callback: types.CallbackQuery):
+async def back_to_menu(callback: types.CallbackQuery, state: FSMContext, identity: Identity):
     """
     Return to the pharmacy management main menu.
     """
+    await state.clear()
+    pharmacy = None
+    if identity.is_pharmacy_admin:
+        async with async_session() as session:
+            pharmacy = await session.get(Pharmacy, identity.pharmacy_id)
+
+    # Show pharmacy info and control buttons
+    if pharmacy:
+        await edit_if_changed(
+            callback.message,
+            f"<b>{pharmacy.name}</b> dorixonasi\n\n"
+            f"Manzil: {pharmacy.address or 'Ko‘rsatilmagan'}\n\n"
+            f"Quyidagi tugmalar orqali buyurtmalarni boshqaring:",
+            reply_markup=get_pharmacy_menu(),
+            parse_mode="HTML",
+        )
+    else:
+        await callback.answer("Xatolik yuz berdi!", show_alert=True)
+
+
+@router.callback_query(F.data == "pharmacy_find_code")
+async def ask_pickup_code(callback: types.CallbackQuery, state: FSMContext):
+    """
+    Ask the pharmacy owner for the customer's pickup code.
+    """
+    await state.set_state(PickupLookupState.waiting_for_code)
+    await callback.message.edit_text(
+        "🔑 Mijozning pickup kodini yuboring (masalan: <code>PX-7KQ2MC</code>):",
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[
+                [InlineKeyboardButton(text="🔙 Orqaga", callback_data="back_to_pharmacy_menu")]
+            ]
+        ),
+        parse_mode="HTML",
+    )
+    await callback.answer()
+
+
+@router.message(PickupLookupState.waiting_for_code, F.text)
+async def find_order_by_pickup_code(message: types.Message, state: FSMContext, identity: Identity):
+    """
+    Find an active order of this pharmacy by pickup code.
+    Mistyped codes are rejected by the checksum before touching the database.
+    """
+    code = normalize_pickup_code(message.text)
+    if not code:
+        await message.answer("❌ Kod noto‘g‘ri. Iltimos, kodni tekshirib qayta yuboring.")
+        return
+
+    if not identity.is_pharmacy_admin:
+        await state.clear()
+        await message.answer("Siz dorixona egasi emassiz!")
+        return
+
     async with async_session() as session:
-        user_id = callback.from_user.id
+        # Served by the partial unique index on active pickup codes
         result = await session.execute(
-            select(Pharmacy).where(Pharmacy.tg_id == user_id)
+            select(Order).where(
+                Order.pickup_code == code,
+                Order.status.in_(ACTIVE_ORDER_STATUSES),
+                Order.pharmacy_id == identity.pharmacy_id,
+            )
         )
-        pharmacy = result.scalar_one_or_none()
-
-        # Show pharmacy info and control buttons
-        if pharmacy:
-            await callback.message.edit_text(
-                f"<b>{pharmacy.name}</b> dorixonasi\n\n"
-                f"Manzil: {pharmacy.address or 'Ko‘rsatilmagan'}\n\n"
-                f"Quyidagi tugmalar orqali buyurtmalarni boshqaring:",
-                reply_markup=get_pharmacy_menu(),
+        order = result.scalar_one_or_none()
+
+        if not order:
+            await message.answer(
+                f"❌ <code>{code}</code> kodli faol buyurtma topilmadi.",
                 parse_mode="HTML",
             )
-        else:
-            await callback.answer("Xatolik yuz berdi!", show_alert=True)
+            return
+
+        result = await session.execute(
+            select(OrderItem.quantity, OrderItem.price, Drug.name)
+            .join(Drug, Drug.id == OrderItem.drug_id)
+            .where(OrderItem.order_id == order.id)
+        )
+        items = result.all()
+
+    await state.clear()
+
+    items_text = "".join(
+        f"- {html.escape(item.name)}: {item.quantity} dona, {item.price:,} so‘m\n" for item in items
+    )
+    text = (
+        f"<b>Buyurtma #{order.id}</b>\n"
+        f"🔑 Kod: <code>{order.pickup_code}</code>\n"
+        f"👤 {html.escape(order.full_name or '')}\n"
+        f"💰 {order.total_amount:,} so‘m\n"
+        f"🛍 Buyurtma:\n{items_text}"
+        f"{STATUS_MARKER}{STATUS_LABELS.get(order.status, order.status)}"
+    )
+    await message.answer(
+        text,
+        reply_markup=InlineKeyboardMarkup(
+            inline_keyboard=[
+                *order_action_rows(order.id, order.status),
+                [InlineKeyboardButton(text="🔙 Orqaga", callback_data="back_to_pharmacy_menu")],
+            ]
+        ),
+        parse_mode="HTML",
+    )
+
+
+@router.callback_query(F.data.startswith("ord:"))
+async def change_order_status(callback: types.CallbackQuery, identity: Identity):
+    """
+    Move an order to the next status from the action buttons under an order
+    message and tell the customer.
+    """
+    if not identity.is_pharmacy_admin:
+        await callback.answer("Siz dorixona egasi emassiz!", show_alert=True)
+        return
+
+    try:
+        _, order_id, new_status = callback.data.split(":")
+        order_id = int(order_id)
+    except ValueError:
+        await callback.answer("❌ Noto‘g‘ri ma'lumot", show_alert=True)
+        return
+
+    async with async_session() as session:
+        result = await transition_order(session, order_id, new_status, identity.pharmacy_id)
+        if result is None:
+            current = await session.scalar(
+                select(Order.status).where(
+                    Order.id == order_id, Order.pharmacy_id == identity.pharmacy_id
+                )
+            )
+            await callback.answer(
+                f"⚠️ Holatni o‘zgartirib bo‘lmaydi. Joriy holat: {STATUS_LABELS.get(current, 'noma’lum')}",
+                show_alert=True,
+            )
+            await refresh_order_message(callback, order_id, current)
+            return
+        order, _ = result
+        notify_customer(session, order)
+        await session.commit()
+
+    await callback.answer(f"{STATUS_LABELS[new_status]} ✔")
+    await refresh_order_message(callback, order_id, new_status)
+
+
+async def refresh_order_message(callback: types.CallbackQuery, order_id: int, status: Optional[str]):
+    """
+    Show the current status at the bottom of an order message and keep only
+    the action buttons that are still allowed.
+    """
+    text = callback.message.html_text.split(STATUS_MARKER)[0].rstrip("\n")
+    if status:
+        text += STATUS_MARKER + STATUS_LABELS.get(status, status)
+
+    # Keep the non-action buttons (e.g. "Orqaga") of the original keyboard
+    other_rows = [
+        row for row in (callback.message.reply_markup.inline_keyboard if callback.message.reply_markup else [])
+        if not any(button.callback_data and button.callback_data.startswith("ord:") for button in row)
+    ]
+    rows = (order_action_rows(order_id, status) if status else []) + other_rows
+    await edit_if_changed(
+        callback.message,
+        text,
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=rows) if rows else None,
+        parse_mode="HTML",
+    )
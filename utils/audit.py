@@ -0,0 +1,37 @@
+"""
+Audit log of admin actions.
+
+``audit`` adds a row to ``admin_audit_log`` in the caller's transaction, so
+an action is logged exactly when it is committed.
+"""
+import json
+from typing import Any, Iterable, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import AdminAuditLog
+
+
+def audit(
+    session: AsyncSession,
+    admin_id: int,
+    action: str,
+    target_ids: Optional[Iterable[int]] = None,
+    **details: Any,
+) -> AdminAuditLog:
+    """
+    Log an admin action. The caller commits.
+
+    Args:
+        action: Dotted name, e.g. "orders.status"
+        target_ids: Ids of the rows the action changed
+        details: Anything else worth keeping (stored as JSON)
+    """
+    entry = AdminAuditLog(
+        admin_id=admin_id,
+        action=action,
+        target_ids=sorted(target_ids) if target_ids is not None else None,
+        details=json.dumps(details, ensure_ascii=False, separators=(",", ":"), default=str) if details else None,
+    )
+    session.add(entry)
+    return entry
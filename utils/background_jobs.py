@@ -0,0 +1,76 @@
+"""
+Long admin jobs (catalog imports, backups, restores) as background tasks.
+
+``UserLockMiddleware`` handles one update per user at a time, so a job awaited
+inside its handler would hold every other tap of that admin - including the
+cancel and back buttons - until it finished. The handler starts the job here
+and returns at once; the job reports progress and its result by editing the
+admin's message.
+"""
+import asyncio
+import logging
+from typing import Coroutine, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundJobs:
+    """
+    Named background tasks; at most one per name.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def running(self, name: str) -> bool:
+        return name in self._tasks
+
+    def start(self, name: str, job: Coroutine) -> bool:
+        """
+        Run ``job`` in the background unless a job of that name is running.
+
+        Returns:
+            False (and ``job`` is discarded) if one was already running
+        """
+        if name in self._tasks:
+            job.close()
+            return False
+        task = asyncio.create_task(self._run(name, job))
+        self._tasks[name] = task
+        task.add_done_callback(lambda _: self._forget(name, task, job))
+        return True
+
+    def _forget(self, name: str, task: asyncio.Task, job: Coroutine):
+        if self._tasks.get(name) is task:
+            del self._tasks[name]
+        # A job cancelled before it started was never awaited
+        job.close()
+
+    def cancel(self, name: str) -> bool:
+        task = self._tasks.get(name)
+        if task is None:
+            return False
+        task.cancel()
+        return True
+
+    async def stop(self):
+        """
+        Cancel all jobs on shutdown.
+        """
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    async def _run(self, name: str, job: Coroutine):
+        try:
+            await job
+        except asyncio.CancelledError:
+            logger.info(f"Background job {name} cancelled")
+            raise
+        except Exception as e:
+            # Jobs report their own failures; this only catches what they missed
+            logger.error(f"Background job {name} failed: {e}", exc_info=True)
+
+
+background_jobs = BackgroundJobs()
@@ -0,0 +1,308 @@
+"""
+Broadcasts: one admin message copied to every user.
+
+Recipients are streamed from ``users`` in chunks ordered by ``users.id``.
+After each chunk the cursor, the delivery counters and newly blocked users
+are saved in one transaction, so after a crash the broadcast resumes from
+the last saved chunk (users of the unfinished chunk may get the message
+twice, nobody is skipped). Sends share the global token bucket with the
+notification outbox, so together they stay below Telegram's limit.
+"""
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, Message
+from sqlalchemy import case, func, select, text, update
+
+from database.db import async_session, engine
+from database.models import Broadcast, User
+from loader import bot
+from utils.config import BROADCAST_CHUNK_SIZE, BROADCAST_CONCURRENCY, BROADCAST_PROGRESS_INTERVAL
+from utils.notifications import global_send_limit
+
+logger = logging.getLogger(__name__)
+
+SENT, FAILED, BLOCKED = "sent", "failed", "blocked"
+
+# First key of the per-broadcast advisory lock
+BROADCAST_LOCK_NAMESPACE = 3_501
+
+
+def recipients_filter():
+    """
+    Users a broadcast is sent to.
+    """
+    return User.is_blocked.is_(False)
+
+
+async def count_recipients() -> int:
+    """
+    Number of users a new broadcast would reach.
+    """
+    async with async_session() as session:
+        return await session.scalar(select(func.count(User.id)).where(recipients_filter()))
+
+
+async def mark_unblocked(telegram_id: int):
+    """
+    The user talks to the bot again: include them in broadcasts.
+    """
+    async with async_session() as session:
+        await session.execute(
+            update(User)
+            .where(User.telegram_id == telegram_id, User.is_blocked.is_(True))
+            .values(is_blocked=False, blocked_at=None)
+        )
+        await session.commit()
+
+
+def progress_text(broadcast: Broadcast) -> str:
+    """
+    Progress and delivery statistics shown to the admin.
+    """
+    done = broadcast.sent + broadcast.failed + broadcast.blocked
+    percent = min(100, done * 100 // broadcast.total) if broadcast.total else 100
+    title = {
+        "running": "📣 Xabar yuborilmoqda...",
+        "done": "✅ Xabar yuborish yakunlandi",
+        "cancelled": "⛔ Xabar yuborish to'xtatildi",
+    }.get(broadcast.status, broadcast.status)
+    return (
+        f"{title}\n\n"
+        f"📊 Jarayon: {done}/{broadcast.total} ({percent}%)\n"
+        f"✅ Yetkazildi: {broadcast.sent}\n"
+        f"🚫 Botni bloklagan: {broadcast.blocked}\n"
+        f"❌ Xatolik: {broadcast.failed}"
+    )
+
+
+def progress_keyboard(broadcast: Broadcast) -> Optional[InlineKeyboardMarkup]:
+    """
+    Cancel button while the broadcast is running.
+    """
+    if broadcast.status != "running":
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="⛔ To'xtatish", callback_data=f"admin:broadcast:cancel:{broadcast.id}")
+    ]])
+
+
+class BroadcastRunner:
+    """
+    Runs broadcasts as background tasks, one task per broadcast.
+    """
+
+    def __init__(self, chunk_size: int = BROADCAST_CHUNK_SIZE, concurrency: int = BROADCAST_CONCURRENCY,
+                 progress_interval: float = BROADCAST_PROGRESS_INTERVAL):
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.progress_interval = progress_interval
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    async def create(self, admin_id: int, source_chat_id: int, source_message_id: int,
+                     progress_message: Message) -> Broadcast:
+        """
+        Save a new broadcast and start sending it.
+
+        Args:
+            source_chat_id, source_message_id: The admin's message to copy
+            progress_message: Message that is edited to show the progress
+        """
+        total = await count_recipients()
+        async with async_session() as session:
+            broadcast = Broadcast(
+                created_by=admin_id,
+                source_chat_id=source_chat_id,
+                source_message_id=source_message_id,
+                progress_chat_id=progress_message.chat.id,
+                progress_message_id=progress_message.message_id,
+                total=total,
+            )
+            session.add(broadcast)
+            await session.commit()
+        self._spawn(broadcast.id)
+        return broadcast
+
+    async def resume_all(self):
+        """
+        Continue broadcasts interrupted by a restart.
+        """
+        async with async_session() as session:
+            ids = (await session.scalars(select(Broadcast.id).where(Broadcast.status == "running"))).all()
+        for broadcast_id in ids:
+            logger.info(f"Resuming broadcast #{broadcast_id}")
+            self._spawn(broadcast_id)
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        """
+        Stop a running broadcast. The current chunk is finished first.
+        """
+        async with async_session() as session:
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast_id, Broadcast.status == "running")
+                .values(status="cancelled", finished_at=func.now())
+            )
+            await session.commit()
+        return result.rowcount > 0
+
+    async def stop(self):
+        """
+        Interrupt all tasks on shutdown; they resume on next start.
+        """
+        for task in self._tasks.values():
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        self._tasks.clear()
+
+    def _spawn(self, broadcast_id: int):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(broadcast_id))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def _run(self, broadcast_id: int):
+        # With several workers every one of them resumes running broadcasts at
+        # startup; the session-level advisory lock lets exactly one send each.
+        async with engine.connect() as lock_conn:
+            locked = await lock_conn.scalar(
+                text("SELECT pg_try_advisory_lock(:ns, :id)"),
+                {"ns": BROADCAST_LOCK_NAMESPACE, "id": broadcast_id},
+            )
+            await lock_conn.commit()
+            if not locked:
+                return
+            try:
+                await self._send_all(broadcast_id)
+            finally:
+                await lock_conn.execute(
+                    text("SELECT pg_advisory_unlock(:ns, :id)"),
+                    {"ns": BROADCAST_LOCK_NAMESPACE, "id": broadcast_id},
+                )
+                await lock_conn.commit()
+
+    async def _send_all(self, broadcast_id: int):
+        try:
+            async with async_session() as session:
+                broadcast = await session.get(Broadcast, broadcast_id)
+            last_progress = 0.0
+
+            while broadcast.status == "running":
+                async with async_session() as session:
+                    chunk = (await session.execute(
+                        select(User.id, User.telegram_id)
+                        .where(User.id > broadcast.last_user_id, recipients_filter())
+                        .order_by(User.id)
+                        .limit(self.chunk_size)
+                    )).all()
+
+                if not chunk:
+                    broadcast = await self._save(broadcast, broadcast.last_user_id, {}, [], finished=True)
+                    break
+
+                outcomes = await self._send_chunk(broadcast, [row.telegram_id for row in chunk])
+                blocked_ids = [row.id for row, outcome in zip(chunk, outcomes) if outcome == BLOCKED]
+                counts = {key: outcomes.count(key) for key in (SENT, FAILED, BLOCKED)}
+                broadcast = await self._save(broadcast, chunk[-1].id, counts, blocked_ids)
+
+                if time.monotonic() - last_progress >= self.progress_interval:
+                    await self._show_progress(broadcast)
+                    last_progress = time.monotonic()
+
+            await self._show_progress(broadcast)
+            logger.info(
+                f"Broadcast #{broadcast_id} {broadcast.status}: sent={broadcast.sent} "
+                f"blocked={broadcast.blocked} failed={broadcast.failed}"
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Status stays "running": the broadcast is resumed on next start
+            logger.error(f"Broadcast #{broadcast_id} interrupted: {e}", exc_info=True)
+
+    async def _send_chunk(self, broadcast: Broadcast, chat_ids: List[int]) -> List[str]:
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(chat_id: int) -> str:
+            async with semaphore:
+                return await self._send_one(broadcast, chat_id)
+
+        return await asyncio.gather(*(send(chat_id) for chat_id in chat_ids))
+
+    async def _send_one(self, broadcast: Broadcast, chat_id: int) -> str:
+        for _ in range(3):
+            await global_send_limit.acquire()
+            try:
+                await bot.copy_message(chat_id, broadcast.source_chat_id, broadcast.source_message_id)
+                return SENT
+            except TelegramRetryAfter as e:
+                # Flood limit hit: slow down every sender, then try this user again
+                global_send_limit.penalize(e.retry_after)
+            except TelegramForbiddenError:
+                return BLOCKED
+            except TelegramBadRequest as e:
+                logger.debug(f"Broadcast #{broadcast.id} to {chat_id} failed: {e}")
+                return FAILED
+            except Exception as e:
+                logger.warning(f"Broadcast #{broadcast.id} to {chat_id} failed: {e}")
+                return FAILED
+        return FAILED
+
+    async def _save(self, broadcast: Broadcast, last_user_id: int, counts: Dict[str, int],
+                    blocked_ids: List[int], finished: bool = False) -> Broadcast:
+        """
+        Save one chunk's results in one transaction and return the fresh row.
+        A cancel from the admin is seen here through the returned status.
+        """
+        values = {
+            "last_user_id": last_user_id,
+            "sent": Broadcast.sent + counts.get(SENT, 0),
+            "failed": Broadcast.failed + counts.get(FAILED, 0),
+            "blocked": Broadcast.blocked + counts.get(BLOCKED, 0),
+        }
+        if finished:
+            # A cancel that landed meanwhile keeps its status and time
+            running = Broadcast.status == "running"
+            values.update(
+                status=case((running, "done"), else_=Broadcast.status),
+                finished_at=case((running, func.now()), else_=Broadcast.finished_at),
+            )
+
+        async with async_session() as session:
+            if blocked_ids:
+                await session.execute(
+                    update(User)
+                    .where(User.id.in_(blocked_ids))
+                    .values(is_blocked=True, blocked_at=func.now())
+                )
+            result = await session.execute(
+                update(Broadcast)
+                .where(Broadcast.id == broadcast.id)
+                .values(**values)
+                .returning(Broadcast)
+                .execution_options(synchronize_session=False)
+            )
+            broadcast = result.scalar_one()
+            await session.commit()
+        return broadcast
+
+    async def _show_progress(self, broadcast: Broadcast):
+        if not broadcast.progress_chat_id:
+            return
+        try:
+            await bot.edit_message_text(
+                progress_text(broadcast),
+                chat_id=broadcast.progress_chat_id,
+                message_id=broadcast.progress_message_id,
+                reply_markup=progress_keyboard(broadcast),
+            )
+        except TelegramBadRequest as e:
+            if "message is not modified" not in str(e):
+                logger.warning(f"Could not update broadcast #{broadcast.id} progress: {e}")
+
+
+broadcast_runner = BroadcastRunner()
@@ -0,0 +1,478 @@
+"""
+In-memory cart cache with write-behind persistence.
+
+Quantity taps (➕/➖/❌) only touch the cached cart and append a record to a
+write-behind log; a background task flushes the accumulated changes to the
+``carts`` table in one transaction. Before anything that reads ``carts``
+from the database (order placement), ``flush_user`` must be awaited.
+
+Log format (one JSON object per line):
+    {"u": user_id, "c": cart_id, "q": quantity}  - absolute quantity, 0 = removed
+    {"u": user_id, "f": 1}                       - everything before is in the DB
+
+Quantities are absolute, so replaying the log after a crash is idempotent.
+A tap is answered once its record is fsynced; taps arriving meanwhile share
+the next fsync (group commit), which runs in a worker thread.
+
+With ``CART_WRITE_BEHIND=false`` (several bot workers) nothing is cached:
+every read loads the cart and every change is written at once.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import BigInteger, bindparam, delete, func, literal, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from database.db import async_session
+from database.models import Cart, Drug
+from utils.config import CART_CACHE_TTL, CART_FLUSH_INTERVAL, CART_WAL_PATH, CART_WRITE_BEHIND
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CartLine:
+    """
+    One cart row together with the drug fields needed to render the cart.
+    """
+    cart_id: int
+    drug_id: int
+    name: str
+    price: int
+    quantity: int
+
+
+@dataclass
+class UserCart:
+    """
+    Cached cart of a single user.
+    """
+    lines: Dict[int, CartLine] = field(default_factory=dict)  # cart_id -> line
+    dirty: Set[int] = field(default_factory=set)  # cart_ids not yet in the DB
+    touched_at: float = field(default_factory=time.monotonic)
+
+    def items(self) -> List[CartLine]:
+        """Lines in a stable order (by cart row id), hiding removed ones."""
+        return [line for _, line in sorted(self.lines.items()) if line.quantity > 0]
+
+
+class CartService:
+    """
+    Authoritative per-user cart cache backed by the ``carts`` table.
+    """
+
+    def __init__(self, wal_path: str = CART_WAL_PATH, flush_interval: float = CART_FLUSH_INTERVAL,
+                 ttl: float = CART_CACHE_TTL, write_behind: bool = CART_WRITE_BEHIND):
+        self.wal_path = wal_path
+        self.write_behind = write_behind
+        self.flush_interval = flush_interval
+        self.ttl = ttl
+        self._carts: Dict[int, UserCart] = {}
+        self._load_locks: Dict[int, asyncio.Lock] = {}
+        self._flush_lock = asyncio.Lock()
+        self._wal = None
+        self._sync_lock = asyncio.Lock()
+        self._wal_written = 0  # records appended to the log
+        self._wal_synced = 0  # records known to be on disk
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------- lifecycle ----------
+
+    async def start(self):
+        """
+        Replay a leftover write-behind log and start the background flusher.
+        """
+        await self._replay()
+        if not self.write_behind:
+            return
+        self._open_wal("w")
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """
+        Stop the background flusher and write all pending changes.
+        """
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush_all()
+        if self._wal:
+            self._wal.close()
+            self._wal = None
+
+    # ---------- reads ----------
+
+    async def get_cart(self, user_id: int) -> UserCart:
+        """
+        Return the user's cart, loading it from the database on first access.
+        """
+        if not self.write_behind:
+            return await self._load(user_id)
+        cart = self._carts.get(user_id)
+        if cart is None:
+            lock = self._load_locks.setdefault(user_id, asyncio.Lock())
+            async with lock:
+                cart = self._carts.get(user_id)
+                if cart is None:
+                    cart = await self._load(user_id)
+                    self._carts[user_id] = cart
+            self._load_locks.pop(user_id, None)
+        cart.touched_at = time.monotonic()
+        return cart
+
+    async def _load(self, user_id: int) -> UserCart:
+        async with async_session() as session:
+            result = await session.execute(
+                select(Cart.id, Cart.drug_id, Cart.quantity, Drug.name, Drug.price)
+                .join(Drug, Drug.id == Cart.drug_id)
+                .where(Cart.user_id == user_id)
+            )
+            rows = result.all()
+
+        cart = UserCart()
+        for row in rows:
+            cart.lines[row.id] = CartLine(
+                cart_id=row.id,
+                drug_id=row.drug_id,
+                name=row.name,
+                price=row.price or 0,
+                quantity=row.quantity,
+            )
+        return cart
+
+    # ---------- writes ----------
+
+    async def change_quantity(self, user_id: int, cart_id: int, delta: int) -> Optional[CartLine]:
+        """
+        Change a line's quantity by ``delta``; a quantity of 0 removes the line.
+
+        Returns:
+            The updated line, or None if the line does not belong to the user
+        """
+        cart = await self.get_cart(user_id)
+        line = cart.lines.get(cart_id)
+        if not line or line.quantity <= 0:
+            return None
+
+        line.quantity = max(0, line.quantity + delta)
+        await self._persist(user_id, cart, line)
+        return line
+
+    async def remove(self, user_id: int, cart_id: int) -> Optional[CartLine]:
+        """
+        Remove a line from the cart.
+        """
+        cart = await self.get_cart(user_id)
+        line = cart.lines.get(cart_id)
+        if not line or line.quantity <= 0:
+            return None
+
+        line.quantity = 0
+        await self._persist(user_id, cart, line)
+        return line
+
+    async def add_item(self, user_id: int, drug_id: int) -> Optional[int]:
+        """
+        Add one unit of a drug to the cart in a single round trip.
+
+        ``INSERT ... SELECT ... ON CONFLICT (user_id, drug_id) DO UPDATE`` makes
+        concurrent taps safe; the SELECT doubles as the check that the drug
+        exists and was not removed from the catalog.
+
+        Returns:
+            The new quantity, or None if the drug does not exist
+        """
+        # Pending taps must reach the DB before the row is changed directly
+        await self.flush_user(user_id)
+
+        stmt = (
+            insert(Cart)
+            .from_select(
+                ["user_id", "drug_id", "quantity"],
+                select(literal(user_id, BigInteger), Drug.id, literal(1)).where(
+                    Drug.id == drug_id, Drug.deleted_at.is_(None)
+                ),
+            )
+            .on_conflict_do_update(
+                constraint="uix_user_drug_cart",
+                set_={"quantity": Cart.quantity + 1, "updated_at": func.now()},
+            )
+            .returning(Cart.id, Cart.quantity)
+        )
+        async with async_session() as session:
+            row = (await session.execute(stmt)).one_or_none()
+            if row is None:
+                return None
+            await session.commit()
+
+        cart = self._carts.get(user_id)
+        line = cart.lines.get(row.id) if cart else None
+        if line is None:
+            # New line: reload with drug name and price on next view
+            self.invalidate(user_id)
+            return row.quantity
+        if row.id in cart.dirty:
+            # Tapped while the row was written: the flush will overwrite the
+            # DB quantity, so count this unit on top of the pending taps
+            line.quantity += 1
+            await self._persist(user_id, cart, line)
+        else:
+            line.quantity = row.quantity
+        return line.quantity
+
+    def invalidate(self, user_id: int):
+        """
+        Drop the cached cart so the next read reloads it from the database.
+        Call after ``flush_user``, or once the user's DB rows were replaced.
+        """
+        self._carts.pop(user_id, None)
+
+    def forget_drug(self, drug_id: int):
+        """
+        Drop cached carts containing a drug whose cart rows were deleted
+        (the drug was taken off sale); pending changes to them are moot.
+        """
+        for user_id, cart in list(self._carts.items()):
+            if any(line.drug_id == drug_id for line in cart.lines.values()):
+                self.invalidate(user_id)
+
+    @asynccontextmanager
+    async def suspended(self):
+        """
+        Hold off every flush while the ``carts`` table is replaced (database
+        restore). Pending changes are written first, in case the restore fails;
+        then cached carts and the log are dropped, before the block runs and
+        again after it: their row ids mean nothing afterwards.
+        """
+        async with self._flush_lock:
+            changes = {user_id: self._snapshot(cart) for user_id, cart in self._carts.items() if cart.dirty}
+            if changes:
+                await self._apply(changes)
+            self._discard()
+            try:
+                yield
+            finally:
+                self._discard()
+
+    def _discard(self):
+        rotated = self._rotate_wal()
+        self._carts.clear()
+        if rotated:
+            os.remove(rotated)
+
+    async def reload_drugs(self, drug_ids: Set[int]):
+        """
+        Reload cached carts containing any of ``drug_ids`` (changed or removed
+        by a catalog sync), keeping their pending changes.
+        """
+        for user_id, cart in list(self._carts.items()):
+            if any(line.drug_id in drug_ids for line in cart.lines.values()):
+                await self.flush_user(user_id)
+                self.invalidate(user_id)
+
+    async def _persist(self, user_id: int, cart: UserCart, line: CartLine):
+        if self.write_behind:
+            self._mark_dirty(user_id, cart, line)
+            # Once the handler answers, the change must survive a crash
+            await self._sync_wal()
+        else:
+            await self._apply({user_id: {line.cart_id: line.quantity}})
+
+    def _mark_dirty(self, user_id: int, cart: UserCart, line: CartLine):
+        self._write_wal({"u": user_id, "c": line.cart_id, "q": line.quantity})
+        cart.dirty.add(line.cart_id)
+
+    # ---------- flushing ----------
+
+    async def flush_user(self, user_id: int):
+        """
+        Write the user's pending changes to the database.
+        """
+        async with self._flush_lock:
+            cart = self._carts.get(user_id)
+            if not cart or not cart.dirty:
+                return
+            changes = {user_id: self._snapshot(cart)}
+            await self._apply(changes)
+            self._settle(changes)
+            if not cart.dirty:
+                # Not synced: losing it only replays changes that are already applied
+                self._write_wal({"u": user_id, "f": 1})
+
+    async def flush_all(self):
+        """
+        Write every pending change to the database and rotate the log.
+        """
+        async with self._flush_lock:
+            # Rotate before collecting: everything in the old log is covered
+            # by the snapshot below, taps made meanwhile go to the fresh log.
+            rotated = self._rotate_wal()
+            changes = {
+                user_id: self._snapshot(cart)
+                for user_id, cart in self._carts.items() if cart.dirty
+            }
+            if changes:
+                await self._apply(changes)
+                self._settle(changes)
+            if rotated:
+                os.remove(rotated)
+
+    @staticmethod
+    def _snapshot(cart: UserCart) -> Dict[int, int]:
+        return {cart_id: cart.lines[cart_id].quantity for cart_id in cart.dirty}
+
+    def _settle(self, changes: Dict[int, Dict[int, int]]):
+        """
+        Mark written lines clean unless they were tapped again while writing.
+        """
+        for user_id, lines in changes.items():
+            cart = self._carts.get(user_id)
+            if not cart:
+                continue
+            for cart_id, quantity in lines.items():
+                line = cart.lines.get(cart_id)
+                if line and line.quantity == quantity:
+                    cart.dirty.discard(cart_id)
+                    if quantity == 0:
+                        del cart.lines[cart_id]
+
+    async def _apply(self, changes: Dict[int, Dict[int, int]]):
+        """
+        Apply {user_id: {cart_id: quantity}} to the ``carts`` table in one transaction.
+        """
+        updates = []
+        removed = []
+        for lines in changes.values():
+            for cart_id, quantity in lines.items():
+                if quantity > 0:
+                    updates.append({"b_id": cart_id, "b_quantity": quantity})
+                else:
+                    removed.append(cart_id)
+
+        carts = Cart.__table__
+        async with async_session() as session:
+            if updates:
+                # Core executemany: rows deleted meanwhile (order placed) are just skipped
+                await session.execute(
+                    update(carts)
+                    .where(carts.c.id == bindparam("b_id"))
+                    .values(quantity=bindparam("b_quantity")),
+                    updates,
+                )
+            if removed:
+                await session.execute(delete(carts).where(carts.c.id.in_(removed)))
+            await session.commit()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush_all()
+                self._evict_idle()
+            except Exception as e:
+                logger.error(f"Cart write-behind flush failed: {e}", exc_info=True)
+
+    def _evict_idle(self):
+        deadline = time.monotonic() - self.ttl
+        for user_id, cart in list(self._carts.items()):
+            if not cart.dirty and cart.touched_at < deadline:
+                del self._carts[user_id]
+
+    # ---------- write-behind log ----------
+
+    def _open_wal(self, mode: str):
+        directory = os.path.dirname(self.wal_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._wal = open(self.wal_path, mode, encoding="utf-8")
+
+    def _write_wal(self, record: dict):
+        """
+        Append a record (to the OS, not yet to disk; see ``_sync_wal``).
+        """
+        if not self._wal:
+            return
+        self._wal.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self._wal.flush()
+        self._wal_written += 1
+
+    async def _sync_wal(self):
+        """
+        Wait until every record appended so far is on disk. One fsync covers
+        all records appended before it starts.
+        """
+        target = self._wal_written
+        async with self._sync_lock:
+            if self._wal_synced >= target or not self._wal:
+                return
+            written = self._wal_written
+            # A duplicate descriptor stays valid if the log is rotated meanwhile
+            fd = os.dup(self._wal.fileno())
+            try:
+                await asyncio.to_thread(os.fsync, fd)
+            finally:
+                os.close(fd)
+            self._wal_synced = max(self._wal_synced, written)
+
+    def _rotate_wal(self) -> Optional[str]:
+        rotated = self.wal_path + ".flushing"
+        if not self._wal or self._wal.tell() == 0:
+            return rotated if os.path.exists(rotated) else None
+
+        self._wal.close()
+        if os.path.exists(rotated):
+            # The previous flush failed: keep its records in front of ours
+            with open(rotated, "a", encoding="utf-8") as dst, \
+                    open(self.wal_path, encoding="utf-8") as src:
+                dst.write(src.read())
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.remove(self.wal_path)
+        else:
+            os.replace(self.wal_path, rotated)
+        self._open_wal("w")
+        return rotated
+
+    async def _replay(self):
+        """
+        Apply changes left in the log(s) by a previous process.
+        """
+        pending: Dict[tuple, int] = {}
+        paths = [self.wal_path + ".flushing", self.wal_path]
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # torn last write
+                    if record.get("f"):
+                        pending = {k: q for k, q in pending.items() if k[0] != record["u"]}
+                    else:
+                        pending[(record["u"], record["c"])] = record["q"]
+
+        if pending:
+            logger.info(f"Replaying {len(pending)} cart changes from write-behind log")
+            changes: Dict[int, Dict[int, int]] = {}
+            for (user_id, cart_id), quantity in pending.items():
+                changes.setdefault(user_id, {})[cart_id] = quantity
+            await self._apply(changes)
+
+        for path in paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+cart_service = CartService()
@@ -0,0 +1,486 @@
+"""
+Bulk catalog import from CSV/XLSX files.
+
+A file has one row per drug, or per drug and pharmacy when it also carries
+stock. Recognized columns (case-insensitive, English or Uzbek names):
+
+    drug_id, name, manufacturer, dosage_form, strength, category, price,
+    prescription_required, description, pharmacy_id, residual, pharmacy_price
+
+Drugs are matched by ``drug_id`` (catalog API id) when given, otherwise by
+exact name and manufacturer. Empty cells leave the stored value unchanged.
+
+The file is read in chunks of ``IMPORT_CHUNK_SIZE`` rows in a worker thread
+(pandas for CSV, openpyxl read-only mode for XLSX), so neither the whole
+file nor the parsing ever sits on the event loop. Every chunk is validated,
+compared with ``drugs`` / ``pharmacy_drugs`` and, when applying, written
+with bulk upserts in one transaction. A dry run does the same without
+writing, which gives the admin the diff to confirm.
+"""
+import asyncio
+import logging
+import os
+from dataclasses import dataclass, field
+from decimal import Decimal, InvalidOperation
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import bindparam, func, or_, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import insert
+
+from database.db import async_session
+from database.models import Drug, Pharmacy, PharmacyDrug
+from utils.config import IMPORT_CHUNK_SIZE
+from utils.lazy_import import lazy_import
+
+logger = logging.getLogger(__name__)
+
+pandas = lazy_import("pandas")
+openpyxl = lazy_import("openpyxl")
+
+SUPPORTED_EXTENSIONS = (".csv", ".xlsx")
+
+# Imports of several admins apply their chunks one at a time
+IMPORT_LOCK_KEY = 4_410_044
+
+# Canonical column -> accepted header names
+COLUMN_ALIASES = {
+    "drug_id": ("drug_id", "api_id", "dori_id"),
+    "name": ("name", "nomi", "nom"),
+    "manufacturer": ("manufacturer", "ishlab_chiqaruvchi"),
+    "dosage_form": ("dosage_form", "shakli"),
+    "strength": ("strength", "dozasi"),
+    "category": ("category", "kategoriya"),
+    "price": ("price", "narx", "narxi"),
+    "prescription_required": ("prescription_required", "prescription", "retsept"),
+    "description": ("description", "tavsif"),
+    "pharmacy_id": ("pharmacy_id", "dorixona_id"),
+    "residual": ("residual", "stock", "qoldiq"),
+    "pharmacy_price": ("pharmacy_price", "dorixona_narxi"),
+}
+_HEADER_LOOKUP = {alias: column for column, aliases in COLUMN_ALIASES.items() for alias in aliases}
+
+DRUG_FIELDS = (
+    "name", "manufacturer", "dosage_form", "strength", "category",
+    "price", "prescription_required", "description",
+)
+
+_TRUE = {"1", "true", "yes", "ha", "bor", "retsipli", "+"}
+_FALSE = {"0", "false", "no", "yo'q", "yoq", "retsiptsiz", "-"}
+
+MAX_REPORTED_ERRORS = 10
+
+
+class ImportFileError(ValueError):
+    """
+    The file cannot be imported at all (unknown format, no usable columns).
+    """
+
+
+@dataclass
+class ImportRow:
+    """
+    One validated file row. ``drug`` holds the drug columns of the file;
+    None values mean "keep the stored value".
+    """
+    line: int
+    drug_id: Optional[int]
+    drug: Dict[str, Any]
+    pharmacy_id: Optional[int] = None
+    residual: Optional[int] = None
+    pharmacy_price: Optional[int] = None
+
+    @property
+    def name_key(self) -> Tuple[Optional[str], Optional[str]]:
+        return self.drug.get("name"), self.drug.get("manufacturer")
+
+
+@dataclass
+class ImportReport:
+    """
+    Running totals of an import (or of its dry run).
+    """
+    rows: int = 0
+    drugs_new: int = 0
+    drugs_changed: int = 0
+    drugs_unchanged: int = 0
+    stock_new: int = 0
+    stock_changed: int = 0
+    stock_unchanged: int = 0
+    error_count: int = 0
+    errors: List[str] = field(default_factory=list)
+
+    def error(self, line: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"{line}-qator: {message}")
+
+    @property
+    def changes(self) -> int:
+        return self.drugs_new + self.drugs_changed + self.stock_new + self.stock_changed
+
+
+# ---------- reading (worker thread) ----------
+
+def _normalize_header(value: Any) -> str:
+    return str(value or "").strip().lower().replace(" ", "_").replace("-", "_")
+
+
+def map_header(header: List[Any]) -> Dict[int, str]:
+    """
+    Column position -> canonical column; unknown columns are ignored.
+
+    Raises:
+        ImportFileError: if neither ``name`` nor ``drug_id`` is present
+    """
+    mapping = {}
+    for position, value in enumerate(header):
+        column = _HEADER_LOOKUP.get(_normalize_header(value))
+        if column and column not in mapping.values():
+            mapping[position] = column
+    if not {"name", "drug_id"} & set(mapping.values()):
+        raise ImportFileError("Faylda \"name\" yoki \"drug_id\" ustuni bo'lishi kerak")
+    return mapping
+
+
+def _csv_chunks(path: str, chunk_size: int) -> Iterator[List[list]]:
+    reader = pandas.read_csv(
+        path, sep=None, engine="python", dtype=str, keep_default_na=False,
+        encoding="utf-8-sig", header=None, chunksize=chunk_size,
+    )
+    for frame in reader:
+        yield frame.values.tolist()
+
+
+def _xlsx_chunks(path: str, chunk_size: int) -> Iterator[List[list]]:
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+    try:
+        chunk = []
+        for row in workbook.active.iter_rows(values_only=True):
+            chunk.append(list(row))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        workbook.close()
+
+
+def read_rows(path: str, chunk_size: int = IMPORT_CHUNK_SIZE) -> Iterator[Tuple[Dict[int, str], int, List[list]]]:
+    """
+    Yield (header mapping, line number of the first row, raw rows) per chunk.
+    Runs in a worker thread; every ``next()`` reads one chunk.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".csv":
+        chunks = _csv_chunks(path, chunk_size)
+    elif extension == ".xlsx":
+        chunks = _xlsx_chunks(path, chunk_size)
+    else:
+        raise ImportFileError(f"Qo'llab-quvvatlanmaydigan format: {extension}")
+
+    mapping = None
+    line = 1
+    for chunk in chunks:
+        if mapping is None:
+            if not chunk:
+                continue
+            mapping = map_header(chunk[0])
+            chunk = chunk[1:]
+            line += 1
+        yield mapping, line, chunk
+        line += len(chunk)
+    if mapping is None:
+        raise ImportFileError("Fayl bo'sh")
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    value = str(value).strip()
+    return value or None
+
+
+def _integer(value: Any, column: str) -> Optional[int]:
+    value = _text(value)
+    if value is None:
+        return None
+    try:
+        number = Decimal(value.replace(" ", "").replace("\u00a0", "").replace(",", "."))
+    except InvalidOperation:
+        raise ValueError(f"{column} son emas: {value}")
+    if number < 0 or number != number.to_integral_value():
+        raise ValueError(f"{column} musbat butun son bo'lishi kerak: {value}")
+    return int(number)
+
+
+def _boolean(value: Any, column: str) -> Optional[bool]:
+    value = _text(value)
+    if value is None:
+        return None
+    value = value.lower()
+    if value in _TRUE:
+        return True
+    if value in _FALSE:
+        return False
+    raise ValueError(f"{column} ha/yo'q bo'lishi kerak: {value}")
+
+
+def validate_rows(mapping: Dict[int, str], first_line: int, raw_rows: List[list],
+                  report: ImportReport) -> List[ImportRow]:
+    """
+    Parse raw cells into ``ImportRow``s; invalid rows are reported and skipped.
+    """
+    present = set(mapping.values())
+    rows = []
+    for offset, raw in enumerate(raw_rows):
+        line = first_line + offset
+        cells = {column: raw[position] if position < len(raw) else None for position, column in mapping.items()}
+        if all(_text(value) is None for value in cells.values()):
+            continue  # blank line
+        report.rows += 1
+        try:
+            drug = {}
+            for column in DRUG_FIELDS:
+                if column not in present:
+                    continue
+                if column == "price":
+                    drug[column] = _integer(cells[column], column)
+                elif column == "prescription_required":
+                    drug[column] = _boolean(cells[column], column)
+                else:
+                    drug[column] = _text(cells[column])
+
+            row = ImportRow(
+                line=line,
+                drug_id=_integer(cells.get("drug_id"), "drug_id"),
+                drug=drug,
+                pharmacy_id=_integer(cells.get("pharmacy_id"), "pharmacy_id"),
+                residual=_integer(cells.get("residual"), "residual"),
+                pharmacy_price=_integer(cells.get("pharmacy_price"), "pharmacy_price"),
+            )
+            if row.drug_id is None and not drug.get("name"):
+                raise ValueError("drug_id yoki name to'ldirilmagan")
+            if row.pharmacy_id is None and (row.residual is not None or row.pharmacy_price is not None):
+                raise ValueError("qoldiq uchun pharmacy_id kerak")
+        except ValueError as e:
+            report.error(line, str(e))
+            continue
+        rows.append(row)
+    return rows
+
+
+# ---------- diff and apply (event loop, one transaction per chunk) ----------
+
+def _merge(rows: List[ImportRow]) -> List[ImportRow]:
+    """
+    One row per drug key; later non-empty cells win.
+    """
+    merged: Dict[Any, ImportRow] = {}
+    for row in rows:
+        key = ("id", row.drug_id) if row.drug_id is not None else ("name", row.name_key)
+        if key in merged:
+            target = merged[key]
+            target.drug.update({k: v for k, v in row.drug.items() if v is not None})
+        else:
+            merged[key] = ImportRow(row.line, row.drug_id, dict(row.drug))
+    return list(merged.values())
+
+
+async def _existing_drugs(session, drug_rows: List[ImportRow]) -> Dict[Any, Drug]:
+    api_ids = {row.drug_id for row in drug_rows if row.drug_id is not None}
+    names = {row.name_key for row in drug_rows if row.drug_id is None}
+    conditions = []
+    if api_ids:
+        conditions.append(Drug.drug_id.in_(api_ids))
+    if names:
+        conditions.append(Drug.name.in_({name for name, _ in names}))
+    if not conditions:
+        return {}
+
+    found = {}
+    for drug in (await session.execute(select(Drug).where(or_(*conditions)))).scalars():
+        if drug.drug_id in api_ids:
+            found[("id", drug.drug_id)] = drug
+        if (drug.name, drug.manufacturer) in names:
+            found.setdefault(("name", (drug.name, drug.manufacturer)), drug)
+    return found
+
+
+def _differs(drug: Drug, values: Dict[str, Any]) -> bool:
+    return any(value is not None and getattr(drug, column) != value for column, value in values.items())
+
+
+async def process_chunk(session, rows: List[ImportRow], report: ImportReport,
+                        pharmacy_ids: set, apply: bool):
+    """
+    Compare one chunk with the database and, if ``apply``, write it.
+    """
+    drug_rows = _merge(rows)
+    existing = await _existing_drugs(session, drug_rows)
+
+    drug_ids: Dict[Any, int] = {}
+    rejected = set()
+    new_drugs, changed_drugs = [], []
+    for row in drug_rows:
+        key = ("id", row.drug_id) if row.drug_id is not None else ("name", row.name_key)
+        drug = existing.get(key)
+        if drug is None:
+            if not row.drug.get("name"):
+                report.error(row.line, f"drug_id {row.drug_id} katalogda yo'q, yangi dori uchun name kerak")
+                rejected.add(key)
+                continue
+            report.drugs_new += 1
+            new_drugs.append((key, row))
+        else:
+            drug_ids[key] = drug.id
+            if _differs(drug, row.drug):
+                report.drugs_changed += 1
+                changed_drugs.append((drug.id, row))
+            else:
+                report.drugs_unchanged += 1
+
+    if apply and new_drugs:
+        values = [
+            {
+                **{column: None for column in DRUG_FIELDS},
+                "price": 0,
+                "prescription_required": False,
+                **{column: value for column, value in row.drug.items() if value is not None},
+                "drug_id": row.drug_id,
+            }
+            for _, row in new_drugs
+        ]
+        inserted = (await session.execute(
+            insert(Drug).values(values).returning(Drug.id)
+        )).scalars().all()
+        # RETURNING keeps the order of a multi-row VALUES insert
+        for (key, _), drug_id in zip(new_drugs, inserted):
+            drug_ids[key] = drug_id
+
+    if apply and changed_drugs:
+        columns = [column for column in DRUG_FIELDS if any(column in row.drug for _, row in changed_drugs)]
+        # Core table: an ORM update() with a list of parameters is a bulk UPDATE by primary key
+        drugs = Drug.__table__
+        await session.execute(
+            update(drugs)
+            .where(drugs.c.id == bindparam("b_id"))
+            .values({column: func.coalesce(bindparam(f"b_{column}"), drugs.c[column]) for column in columns}),
+            [
+                {"b_id": drug_id, **{f"b_{column}": row.drug.get(column) for column in columns}}
+                for drug_id, row in changed_drugs
+            ],
+        )
+
+    await _process_stock(session, rows, drug_ids, rejected, report, pharmacy_ids, apply)
+
+
+async def _process_stock(session, rows: List[ImportRow], drug_ids: Dict[Any, int], rejected: set,
+                         report: ImportReport, pharmacy_ids: set, apply: bool):
+    stock: Dict[Tuple[int, Any], ImportRow] = {}
+    for row in rows:
+        key = ("id", row.drug_id) if row.drug_id is not None else ("name", row.name_key)
+        if row.pharmacy_id is None or key in rejected:
+            continue
+        if row.pharmacy_id not in pharmacy_ids:
+            report.error(row.line, f"dorixona #{row.pharmacy_id} topilmadi")
+            continue
+        stock[(row.pharmacy_id, key)] = row  # later rows win
+
+    if not stock:
+        return
+
+    # Dry run: drugs that would be created have no id yet, their stock is new
+    known = {
+        (pharmacy_id, drug_ids[key]): row
+        for (pharmacy_id, key), row in stock.items() if key in drug_ids
+    }
+    current = {}
+    if known:
+        result = await session.execute(
+            select(PharmacyDrug.pharmacy_id, PharmacyDrug.drug_id, PharmacyDrug.residual, PharmacyDrug.price)
+            .where(tuple_(PharmacyDrug.pharmacy_id, PharmacyDrug.drug_id).in_(list(known)))
+        )
+        current = {(r.pharmacy_id, r.drug_id): r for r in result}
+
+    report.stock_new += len(stock) - len(known)
+    for pair, row in known.items():
+        stored = current.get(pair)
+        if stored is None:
+            report.stock_new += 1
+        elif (row.residual is not None and row.residual != stored.residual) or \
+                (row.pharmacy_price is not None and row.pharmacy_price != stored.price):
+            report.stock_changed += 1
+        else:
+            report.stock_unchanged += 1
+
+    if not apply or not known:
+        return
+
+    stmt = insert(PharmacyDrug).values([
+        {
+            "pharmacy_id": pharmacy_id,
+            "drug_id": drug_id,
+            "residual": row.residual,
+            "price": row.pharmacy_price if row.pharmacy_price is not None else row.drug.get("price"),
+        }
+        for (pharmacy_id, drug_id), row in known.items()
+    ])
+    residual = func.coalesce(stmt.excluded.residual, PharmacyDrug.residual)
+    price = func.coalesce(stmt.excluded.price, PharmacyDrug.price)
+    await session.execute(stmt.on_conflict_do_update(
+        constraint="uix_pharmacy_drug",
+        set_={"residual": residual, "price": price},
+        where=or_(
+            PharmacyDrug.residual.is_distinct_from(residual),
+            PharmacyDrug.price.is_distinct_from(price),
+        ),
+    ))
+
+
+async def run_import(
+    path: str,
+    apply: bool = False,
+    progress: Optional[Callable[[ImportReport], Awaitable[None]]] = None,
+    chunk_size: int = IMPORT_CHUNK_SIZE,
+) -> ImportReport:
+    """
+    Validate and diff the file; with ``apply`` also write it, one
+    transaction per chunk.
+
+    Args:
+        progress: Awaited after every chunk with the running report
+
+    Raises:
+        ImportFileError: if the file cannot be read as a catalog
+    """
+    report = ImportReport()
+    async with async_session() as session:
+        pharmacy_ids = set((await session.execute(select(Pharmacy.id))).scalars())
+
+    chunks = await asyncio.to_thread(read_rows, path, chunk_size)
+    while True:
+        chunk = await asyncio.to_thread(next, chunks, None)
+        if chunk is None:
+            break
+        mapping, first_line, raw_rows = chunk
+        rows = await asyncio.to_thread(validate_rows, mapping, first_line, raw_rows, report)
+
+        async with async_session() as session:
+            if apply:
+                await session.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": IMPORT_LOCK_KEY})
+            await process_chunk(session, rows, report, pharmacy_ids, apply)
+            if apply:
+                await session.commit()
+
+        if progress:
+            await progress(report)
+
+    if apply:
+        logger.info(
+            f"Catalog import {os.path.basename(path)}: {report.rows} rows, "
+            f"{report.drugs_new} new / {report.drugs_changed} changed drugs, "
+            f"{report.stock_new} new / {report.stock_changed} changed stock rows, "
+            f"{report.error_count} errors"
+        )
+    return report
@@ -0,0 +1,385 @@
+"""
+Delta sync of the PharmAgency drug catalog (run by ``python -m data.transfer``).
+
+Every API row is mapped to drug columns and hashed; ``drugs.content_hash``
+keeps the hash from the previous sync, so a run only writes new drugs and
+drugs whose hash changed. Drugs missing from a complete run are tombstoned
+(``deleted_at``) rather than deleted, because order history refers to them;
+search and ordering skip tombstoned drugs, and one that reappears in the API
+is restored.
+
+Each run is recorded in ``catalog_sync_runs`` and every drug it wrote in
+``catalog_changes``. ``CatalogChangeWatcher`` follows that log in the bot and
+passes the changed drug ids to caches holding drug data. A finished run
+drops the changes of all but the last ``CATALOG_CHANGES_KEEP_RUNS`` runs.
+
+Admin edits of a synced drug (catalog import) stay until the drug changes in
+the API: the stored hash is the one of the last synced API content.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import Integer, all_, bindparam, delete, func, select, text, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+
+from database.db import async_session, engine
+from database.models import Cart, CatalogChange, CatalogSyncRun, Drug
+from utils.config import CATALOG_CHANGES_KEEP_RUNS, CATALOG_CHANGES_POLL_INTERVAL, CATALOG_SYNC_MAX_DELETE_RATIO
+
+logger = logging.getLogger(__name__)
+
+# Only one sync at a time (session-level advisory lock)
+SYNC_LOCK_KEY = 4_600_046
+
+# Drug columns filled from the API; their values make up the content hash
+SYNC_FIELDS = (
+    "name",
+    "description",
+    "manufacturer",
+    "price",
+    "expiration_date",
+    "prescription_required",
+    "category",
+    "image_url",
+)
+
+
+# catalog_changes.change -> SyncReport counter
+_REPORT_COUNTERS = {"insert": "inserted", "update": "updated", "restore": "restored"}
+
+
+class SyncBusyError(Exception):
+    """
+    Another catalog sync is running.
+    """
+
+
+def drug_values(item: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Drug columns of one API row, or None if it has no name or its drugId or
+    price is not a number.
+    """
+    name = item.get("name")
+    price = item.get("priceBase") or item.get("price")
+    try:
+        api_id = int(item["drugId"])
+        # API prices may be fractional; the catalog keeps whole so'm
+        price = int(round(float(price))) if price else 0
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return None
+    if not name:
+        return None
+
+    expiration_date = None
+    raw_date = item.get("priceDate")
+    if raw_date:
+        try:
+            expiration_date = datetime.fromisoformat(raw_date).date()
+        except (TypeError, ValueError):
+            pass
+
+    return {
+        "drug_id": api_id,
+        "name": name,
+        "description": item.get("trademark"),
+        "manufacturer": item.get("manufacturer"),
+        "price": price,
+        "expiration_date": expiration_date,
+        # 'Retsipli' -> True, 'Retsiptsiz' -> False
+        "prescription_required": item.get("prescription") == "Retsipli",
+        "category": item.get("currency"),
+        "image_url": item.get("imgUrl"),
+    }
+
+
+def content_hash(values: Dict[str, Any]) -> str:
+    """
+    32 hex characters identifying the synced fields of a drug.
+    """
+    payload = json.dumps(
+        [values[column] for column in SYNC_FIELDS], default=str, ensure_ascii=False, separators=(",", ":")
+    )
+    return hashlib.blake2b(payload.encode(), digest_size=16).hexdigest()
+
+
+@dataclass
+class SyncReport:
+    fetched: int = 0
+    skipped: int = 0  # API rows without a name or with a malformed drugId or price
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    restored: int = 0
+    deleted: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def written(self) -> int:
+        return self.inserted + self.updated + self.restored + self.deleted
+
+    @property
+    def duration_ms(self) -> int:
+        return int((time.monotonic() - self.started) * 1000)
+
+
+class CatalogSync:
+    """
+    One sync run: ``async with CatalogSync() as sync``, then ``apply_page`` for
+    every API page and ``finish(complete=True)`` once the last page was read.
+    Leaving the block without ``finish`` (an error) records a failed run and
+    tombstones nothing.
+    """
+
+    def __init__(self, max_delete_ratio: float = CATALOG_SYNC_MAX_DELETE_RATIO,
+                 keep_runs: int = CATALOG_CHANGES_KEEP_RUNS):
+        self.max_delete_ratio = max_delete_ratio
+        self.keep_runs = keep_runs
+        self.report = SyncReport()
+        self.run_id: Optional[int] = None
+        self._seen: set = set()
+        self._lock_conn = None
+        self._finished = False
+
+    async def __aenter__(self) -> "CatalogSync":
+        self._lock_conn = await engine.connect()
+        locked = await self._lock_conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": SYNC_LOCK_KEY})
+        await self._lock_conn.commit()
+        if not locked:
+            await self._lock_conn.close()
+            raise SyncBusyError("Catalog sync is already running")
+
+        async with async_session() as session:
+            self.run_id = (await session.execute(
+                insert(CatalogSyncRun).values(status="running").returning(CatalogSyncRun.id)
+            )).scalar_one()
+            await session.commit()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if not self._finished:
+                error = repr(exc) if exc else "interrupted before the last page"
+                await self._record("failed", error=error[:1000])
+        finally:
+            await self._lock_conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": SYNC_LOCK_KEY})
+            await self._lock_conn.commit()
+            await self._lock_conn.close()
+
+    async def apply_page(self, items: Iterable[Dict[str, Any]]):
+        """
+        Write the new and changed drugs of one API page in one transaction.
+        """
+        rows: Dict[int, Dict[str, Any]] = {}
+        for item in items:
+            self.report.fetched += 1
+            values = drug_values(item)
+            if values is None:
+                self.report.skipped += 1
+                continue
+            values["content_hash"] = content_hash(values)
+            rows[values["drug_id"]] = values  # a repeated drugId: the later row wins
+        if not rows:
+            return
+        self._seen.update(rows)
+
+        async with async_session() as session:
+            current = {
+                row.drug_id: row
+                for row in (await session.execute(
+                    select(Drug.drug_id, Drug.content_hash, Drug.deleted_at).where(Drug.drug_id.in_(list(rows)))
+                )).all()
+            }
+
+            changes: Dict[int, str] = {}
+            for api_id, values in rows.items():
+                row = current.get(api_id)
+                if row is None:
+                    changes[api_id] = "insert"
+                elif row.deleted_at is not None:
+                    changes[api_id] = "restore"
+                elif row.content_hash != values["content_hash"]:
+                    changes[api_id] = "update"
+                else:
+                    self.report.unchanged += 1
+            if not changes:
+                return
+
+            stmt = insert(Drug).values([rows[api_id] for api_id in changes])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[Drug.drug_id],
+                set_={
+                    **{column: getattr(stmt.excluded, column) for column in (*SYNC_FIELDS, "content_hash")},
+                    "deleted_at": None,
+                },
+            ).returning(Drug.id, Drug.drug_id)
+            written = (await session.execute(stmt)).all()
+
+            await session.execute(insert(CatalogChange).values([
+                {"run_id": self.run_id, "drug_id": row.id, "change": changes[row.drug_id]}
+                for row in written
+            ]))
+            await session.commit()
+
+        for change in changes.values():
+            counter = _REPORT_COUNTERS[change]
+            setattr(self.report, counter, getattr(self.report, counter) + 1)
+
+    async def finish(self, complete: bool = True) -> SyncReport:
+        """
+        Tombstone drugs the API no longer lists (only after a complete run),
+        record the run and prune ``catalog_changes``.
+        """
+        error = None
+        if complete and self._seen:
+            error = await self._tombstone_missing()
+        await self._record("done", error=error)
+        self._finished = True
+        await self._prune_changes()
+        return self.report
+
+    async def _prune_changes(self):
+        """
+        Delete the changes of all but the last ``keep_runs`` runs. The bot
+        reads the log within seconds, so older entries are never needed.
+        """
+        oldest_kept = (
+            select(CatalogSyncRun.id).order_by(CatalogSyncRun.id.desc())
+            .offset(self.keep_runs - 1).limit(1).scalar_subquery()
+        )
+        async with async_session() as session:
+            result = await session.execute(delete(CatalogChange).where(CatalogChange.run_id < oldest_kept))
+            await session.commit()
+        if result.rowcount:
+            logger.info(f"Catalog sync #{self.run_id}: pruned {result.rowcount} old catalog changes")
+
+    async def _tombstone_missing(self) -> Optional[str]:
+        seen = bindparam("seen", list(self._seen), type_=ARRAY(Integer))
+        missing = (Drug.drug_id.isnot(None), Drug.deleted_at.is_(None), Drug.drug_id != all_(seen))
+
+        async with async_session() as session:
+            active = await session.scalar(
+                select(func.count()).select_from(Drug).where(Drug.drug_id.isnot(None), Drug.deleted_at.is_(None))
+            )
+            gone = await session.scalar(select(func.count()).select_from(Drug).where(*missing))
+            if not gone:
+                return None
+            # A truncated API answer must not hide most of the catalog
+            if active and gone > active * self.max_delete_ratio:
+                message = f"{gone} of {active} drugs missing from the API, tombstones skipped"
+                logger.warning(f"Catalog sync #{self.run_id}: {message}")
+                return message
+
+            drug_ids = (await session.execute(
+                update(Drug).where(*missing).values(deleted_at=func.now()).returning(Drug.id)
+            )).scalars().all()
+            # Gone drugs cannot be ordered any more
+            await session.execute(delete(Cart).where(Cart.drug_id.in_(drug_ids)))
+            await session.execute(insert(CatalogChange).values([
+                {"run_id": self.run_id, "drug_id": drug_id, "change": "delete"} for drug_id in drug_ids
+            ]))
+            await session.commit()
+        self.report.deleted = len(drug_ids)
+        return None
+
+    async def _record(self, status: str, error: Optional[str] = None):
+        report = self.report
+        async with async_session() as session:
+            await session.execute(
+                update(CatalogSyncRun)
+                .where(CatalogSyncRun.id == self.run_id)
+                .values(
+                    status=status,
+                    fetched=report.fetched,
+                    inserted=report.inserted,
+                    updated=report.updated,
+                    unchanged=report.unchanged,
+                    restored=report.restored,
+                    deleted=report.deleted,
+                    duration_ms=report.duration_ms,
+                    error=error,
+                    finished_at=func.now(),
+                )
+            )
+            await session.commit()
+
+
+async def last_sync_run(session) -> Optional[CatalogSyncRun]:
+    """
+    The latest finished sync run, if any.
+    """
+    return (await session.execute(
+        select(CatalogSyncRun)
+        .where(CatalogSyncRun.status != "running")
+        .order_by(CatalogSyncRun.id.desc())
+        .limit(1)
+    )).scalar_one_or_none()
+
+
+class CatalogChangeWatcher:
+    """
+    Follows ``catalog_changes`` in the bot process and awaits every subscribed
+    listener with the set of changed drug ids (``drugs.id``). Starts at the end
+    of the log: caches are empty at startup anyway.
+    """
+
+    def __init__(self, interval: float = CATALOG_CHANGES_POLL_INTERVAL, batch_size: int = 1000):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._listeners: List[Callable[[set], Awaitable[None]]] = []
+        self._cursor = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def subscribe(self, listener: Callable[[set], Awaitable[None]]):
+        self._listeners.append(listener)
+
+    async def start(self):
+        async with async_session() as session:
+            self._cursor = await session.scalar(select(func.coalesce(func.max(CatalogChange.id), 0)))
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def poll(self) -> int:
+        """
+        Deliver changes logged since the last poll; returns how many were read.
+        """
+        read = 0
+        while True:
+            async with async_session() as session:
+                rows = (await session.execute(
+                    select(CatalogChange.id, CatalogChange.drug_id)
+                    .where(CatalogChange.id > self._cursor)
+                    .order_by(CatalogChange.id)
+                    .limit(self.batch_size)
+                )).all()
+            if not rows:
+                return read
+            self._cursor = rows[-1].id
+            read += len(rows)
+            drug_ids = {row.drug_id for row in rows}
+            for listener in self._listeners:
+                await listener(drug_ids)
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Catalog change poll failed: {e}", exc_info=True)
+
+
+catalog_watcher = CatalogChangeWatcher()
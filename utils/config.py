@@ -13,6 +13,9 @@ ADMIN_ID = int(os.getenv("ADMIN_ID"))
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
+# Local time zone for daily statistics and date filters
+TIMEZONE = os.getenv("TIMEZONE", "Asia/Tashkent")
+
 # Redis URL (agar kerak bo'lsa)
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 
@@ -21,3 +24,82 @@ MAX_FILE_SIZE = int(os.getenv("MAX_FILE_SIZE", 10 * 1024 * 1024))  # 10MB
 
 # Pagination
 DRUGS_PER_PAGE = int(os.getenv("DRUGS_PER_PAGE", 10))
+ORDERS_PER_PAGE = int(os.getenv("ORDERS_PER_PAGE", 5))
+
+# Cart cache (write-behind)
+CART_WAL_PATH = os.getenv("CART_WAL_PATH", "var/cart_wal.log")
+CART_FLUSH_INTERVAL = float(os.getenv("CART_FLUSH_INTERVAL", 2))  # seconds
+CART_CACHE_TTL = float(os.getenv("CART_CACHE_TTL", 15 * 60))  # seconds
+
+# Message re-rendering
+RENDER_DEBOUNCE = float(os.getenv("RENDER_DEBOUNCE", 0.3))  # seconds to coalesce edits
+CHAT_EDIT_INTERVAL = float(os.getenv("CHAT_EDIT_INTERVAL", 0.5))  # min seconds between edits per chat
+
+# Identity (role) cache
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", 5 * 60))  # seconds
+
+# Pharmacy details shown in the order flow
+PHARMACY_CACHE_TTL = float(os.getenv("PHARMACY_CACHE_TTL", 10 * 60))  # seconds
+
+# Outgoing notifications (outbox sender)
+NOTIFY_GLOBAL_RATE = float(os.getenv("NOTIFY_GLOBAL_RATE", 30))  # messages per second, whole bot
+NOTIFY_CHAT_INTERVAL = float(os.getenv("NOTIFY_CHAT_INTERVAL", 1))  # min seconds between messages per chat
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", 50))
+NOTIFY_POLL_INTERVAL = float(os.getenv("NOTIFY_POLL_INTERVAL", 2))  # seconds
+NOTIFY_MAX_ATTEMPTS = int(os.getenv("NOTIFY_MAX_ATTEMPTS", 8))
+
+# Broadcasts
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", 200))  # recipients per saved step
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 10))  # sends in flight
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", 5))  # seconds between progress edits
+
+# Schema migrations: apply pending ones at bot startup (otherwise run "python migrate.py")
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "true").lower() in ("1", "true", "yes")
+
+# FSM storage: "memory" (single process), "redis" (REDIS_URL) or "postgres" (DATABASE_URL)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory").lower()
+FSM_TTL = int(os.getenv("FSM_TTL", 24 * 60 * 60))  # seconds an unfinished form is kept
+FSM_LOCK_POOL_SIZE = int(os.getenv("FSM_LOCK_POOL_SIZE", 20))  # postgres: users handled at once per worker
+
+# Webhook mode (several workers behind a load balancer); polling when WEBHOOK_URL is empty
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # public base URL, e.g. https://bot.example.uz
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBAPP_HOST = os.getenv("WEBAPP_HOST", "0.0.0.0")
+WEBAPP_PORT = int(os.getenv("WEBAPP_PORT", 8080))
+
+# Cart changes are cached per process; turn off when running several workers
+CART_WRITE_BEHIND = os.getenv("CART_WRITE_BEHIND", "true").lower() in ("1", "true", "yes")
+
+# Admin catalog import (CSV/XLSX)
+IMPORT_DIR = os.getenv("IMPORT_DIR", "var/imports")
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", 1000))  # rows per transaction
+IMPORT_PROGRESS_INTERVAL = float(os.getenv("IMPORT_PROGRESS_INTERVAL", 2))  # seconds between progress edits
+
+# Pharmacy stock feeds (HTTP endpoint and file drop directory)
+FEED_TOKEN = os.getenv("FEED_TOKEN")  # HTTP endpoint is disabled without it
+FEED_PATH = os.getenv("FEED_PATH", "/feeds/stock")
+FEED_DROP_DIR = os.getenv("FEED_DROP_DIR", "var/feeds")
+FEED_POLL_INTERVAL = float(os.getenv("FEED_POLL_INTERVAL", 10))  # seconds between drop directory scans
+FEED_CONCURRENCY = int(os.getenv("FEED_CONCURRENCY", 4))  # pharmacies ingested at once
+FEED_MAX_BYTES = int(os.getenv("FEED_MAX_BYTES", 20 * 1024 * 1024))
+FEED_MIN_AGE = float(os.getenv("FEED_MIN_AGE", 10))  # seconds a dropped file must be unmodified
+
+# PharmAgency catalog sync (python -m data.transfer)
+CATALOG_SYNC_PAGE_SIZE = int(os.getenv("CATALOG_SYNC_PAGE_SIZE", 500))
+CATALOG_SYNC_MAX_DELETE_RATIO = float(os.getenv("CATALOG_SYNC_MAX_DELETE_RATIO", 0.2))  # larger drops skip tombstones
+CATALOG_CHANGES_POLL_INTERVAL = float(os.getenv("CATALOG_CHANGES_POLL_INTERVAL", 60))  # seconds, bot side
+CATALOG_CHANGES_KEEP_RUNS = int(os.getenv("CATALOG_CHANGES_KEEP_RUNS", 30))  # runs whose catalog_changes are kept
+
+# Admin database backups
+BACKUP_DIR = os.getenv("BACKUP_DIR", "var/backups")
+BACKUP_CHUNK_SIZE = int(os.getenv("BACKUP_CHUNK_SIZE", 2000))  # rows per read / COPY
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", 5))  # archives kept on disk
+
+# Moderation of applications and feedback; ADMIN_ID is always a moderator
+MODERATOR_IDS = {ADMIN_ID} | {
+    int(value) for value in os.getenv("MODERATOR_IDS", "").replace(" ", "").split(",") if value
+}
+MODERATION_BATCH_SIZE = int(os.getenv("MODERATION_BATCH_SIZE", 10))  # items claimed per queue page
+MODERATION_CLAIM_TTL = float(os.getenv("MODERATION_CLAIM_TTL", 15 * 60))  # seconds a claimed batch stays reserved
+MODERATION_DIGEST_INTERVAL = float(os.getenv("MODERATION_DIGEST_INTERVAL", 5 * 60))  # seconds between digests
@@ -0,0 +1,430 @@
+"""
+Database backup and restore as gzip-compressed NDJSON.
+
+Archive layout, one JSON value per line:
+    {"format": "pharma-backup", "version": 1, "schema": 8, "created_at": "...", "tables": [...],
+     "sequences": {"pickup_code_seq": 1042}}       - next value of each standalone sequence
+    {"table": "users", "columns": ["id", ...]}
+    [1, 123456789, ...]                          - one row, values in column order
+    ...
+    {"end": "users", "rows": 1520, "sha256": "..."}
+
+Tables follow foreign key order (parents first). ``sha256`` covers the row
+lines of the table, so a damaged or truncated archive is rejected before
+anything is written.
+
+A backup reads every table from one REPEATABLE READ snapshot through a
+server-side cursor, ``BACKUP_CHUNK_SIZE`` rows at a time, so memory use does
+not depend on table size. A restore replaces all tables in one transaction:
+TRUNCATE, COPY chunk by chunk, compare row counts and checksums, move the id
+sequences past the restored ids, then commit - any mismatch rolls everything
+back. Standalone sequences (pickup codes) are moved to the archived value
+unless they are already further, so restored active orders never collide
+with new codes.
+
+A restore must run with every other bot worker stopped: a running worker
+keeps cached carts, identities and pharmacies and may write stale rows
+back. In this process ``cart_service.suspended()`` holds cart writes off.
+"""
+import asyncio
+import enum
+import gzip
+import hashlib
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from datetime import date, datetime, time as dt_time, timezone
+from decimal import Decimal
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Date, DateTime, Float, Integer, Table, Time, text
+
+from database.db import Base, engine
+from database.migrations import LATEST_VERSION
+from database.models import pickup_code_seq
+from utils.config import BACKUP_CHUNK_SIZE, BACKUP_DIR, BACKUP_KEEP
+
+logger = logging.getLogger(__name__)
+
+FORMAT = "pharma-backup"
+FORMAT_VERSION = 1
+
+# Short-lived state that is not worth restoring
+SKIPPED_TABLES = {"fsm_state"}
+
+# Sequences not owned by a table column; serial id sequences are reset from the data
+STANDALONE_SEQUENCES = (pickup_code_seq.name,)
+
+# Serializes restores of several bot workers
+RESTORE_LOCK_KEY = 4_700_047
+
+# One backup or restore at a time in this process
+_busy = asyncio.Lock()
+
+
+class BackupError(Exception):
+    """
+    The archive cannot be restored (damaged, foreign or from another schema version).
+    """
+
+
+@dataclass
+class TableSummary:
+    name: str
+    rows: int = 0
+
+
+@dataclass
+class BackupSummary:
+    schema: int
+    created_at: str
+    tables: List[TableSummary] = field(default_factory=list)
+
+    @property
+    def rows(self) -> int:
+        return sum(table.rows for table in self.tables)
+
+
+def backup_tables() -> List[Table]:
+    """
+    Tables included in a backup, parents before children.
+    """
+    return [table for table in Base.metadata.sorted_tables if table.name not in SKIPPED_TABLES]
+
+
+def busy() -> bool:
+    return _busy.locked()
+
+
+# ---------- encoding ----------
+
+def _encode(value: Any) -> Any:
+    if isinstance(value, (datetime, date, dt_time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, enum.Enum):
+        return value.value
+    raise TypeError(f"Cannot back up value of type {type(value).__name__}")
+
+
+def _row_line(row) -> bytes:
+    return (json.dumps(list(row), default=_encode, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+
+
+def _meta_line(meta: Dict[str, Any]) -> bytes:
+    return (json.dumps(meta, ensure_ascii=False, separators=(",", ":")) + "\n").encode()
+
+
+def _decoder(column) -> Optional[Callable[[Any], Any]]:
+    """
+    Turn a JSON value back into what asyncpg expects for the column.
+    """
+    if isinstance(column.type, DateTime):
+        return datetime.fromisoformat
+    if isinstance(column.type, Date):
+        return date.fromisoformat
+    if isinstance(column.type, Time):
+        return dt_time.fromisoformat
+    if isinstance(column.type, Float):
+        return float
+    return None
+
+
+def _quoted(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+# ---------- backup ----------
+
+def _next_value_sql(sequence: str) -> str:
+    # Sequences are not transactional: this is the value nextval() would return now
+    return f"SELECT CASE WHEN is_called THEN last_value + 1 ELSE last_value END FROM {_quoted(sequence)}"
+
+
+def _prune(directory: str, keep: int):
+    archives = sorted(
+        (entry for entry in os.scandir(directory) if entry.name.endswith(".ndjson.gz")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in archives[:-keep] if keep else []:
+        os.remove(entry.path)
+
+
+async def create_backup(
+    progress: Optional[Callable[[str, int], Awaitable[None]]] = None,
+    directory: str = BACKUP_DIR,
+    chunk_size: int = BACKUP_CHUNK_SIZE,
+) -> Tuple[str, BackupSummary]:
+    """
+    Write a backup archive of all tables.
+
+    Args:
+        progress: Awaited after every chunk with (table name, rows written so far)
+
+    Returns:
+        (path of the archive, summary)
+    """
+    os.makedirs(directory, exist_ok=True)
+    created_at = datetime.now(timezone.utc)
+    path = os.path.join(directory, f"pharma_backup_{created_at:%Y%m%d_%H%M%S}.ndjson.gz")
+    partial = path + ".part"
+    summary = BackupSummary(schema=LATEST_VERSION, created_at=created_at.isoformat())
+
+    async with _busy:
+        out = await asyncio.to_thread(gzip.open, partial, "wb", 6)
+        try:
+            async with engine.connect() as conn:
+                conn = await conn.execution_options(isolation_level="REPEATABLE READ")
+                async with conn.begin():
+                    # One snapshot for all tables
+                    await conn.execute(text("SET TRANSACTION READ ONLY"))
+                    tables = backup_tables()
+                    header = {
+                        "format": FORMAT,
+                        "version": FORMAT_VERSION,
+                        "schema": LATEST_VERSION,
+                        "created_at": summary.created_at,
+                        "tables": [table.name for table in tables],
+                        "sequences": {
+                            name: await conn.scalar(text(_next_value_sql(name)))
+                            for name in STANDALONE_SEQUENCES
+                        },
+                    }
+                    await asyncio.to_thread(out.write, _meta_line(header))
+                    for table in tables:
+                        summary.tables.append(await _dump_table(conn, out, table, chunk_size, progress))
+            await asyncio.to_thread(out.close)
+        except BaseException:
+            await asyncio.to_thread(out.close)
+            os.remove(partial)
+            raise
+
+        os.replace(partial, path)
+        await asyncio.to_thread(_prune, directory, BACKUP_KEEP)
+
+    logger.info(f"Backup {os.path.basename(path)}: {len(summary.tables)} tables, {summary.rows} rows")
+    return path, summary
+
+
+async def _dump_table(conn, out, table: Table, chunk_size: int, progress) -> TableSummary:
+    columns = [column.name for column in table.columns]
+    order = ", ".join(_quoted(column.name) for column in table.primary_key.columns) or "1"
+    query = text(f"SELECT {', '.join(map(_quoted, columns))} FROM {_quoted(table.name)} ORDER BY {order}")
+
+    await asyncio.to_thread(out.write, _meta_line({"table": table.name, "columns": columns}))
+    summary = TableSummary(table.name)
+    digest = hashlib.sha256()
+
+    result = await conn.stream(query.execution_options(yield_per=chunk_size))
+    async for rows in result.partitions(chunk_size):
+        data = b"".join(_row_line(row) for row in rows)
+        digest.update(data)
+        await asyncio.to_thread(out.write, data)
+        summary.rows += len(rows)
+        if progress:
+            await progress(table.name, summary.rows)
+
+    end = {"end": table.name, "rows": summary.rows, "sha256": digest.hexdigest()}
+    await asyncio.to_thread(out.write, _meta_line(end))
+    return summary
+
+
+# ---------- restore ----------
+
+def read_archive(path: str, chunk_size: int = BACKUP_CHUNK_SIZE) -> Iterator[Tuple[str, Any]]:
+    """
+    Parse an archive lazily, checking its structure and checksums.
+
+    Yields:
+        ("header", dict), ("table", (name, columns)), ("rows", [row, ...]),
+        ("end", TableSummary) - rows in chunks of ``chunk_size``
+
+    Raises:
+        BackupError: on any inconsistency; rows yielded before it must be discarded
+    """
+    known = {table.name: table for table in backup_tables()}
+    try:
+        with gzip.open(path, "rb") as src:
+            first = src.readline()
+            try:
+                header = json.loads(first)
+            except ValueError:
+                raise BackupError("Zaxira fayli emas")
+            if not isinstance(header, dict) or header.get("format") != FORMAT:
+                raise BackupError("Zaxira fayli emas")
+            if header.get("version") != FORMAT_VERSION:
+                raise BackupError(f"Zaxira formati versiyasi mos emas: {header.get('version')}")
+            if header.get("schema") != LATEST_VERSION:
+                raise BackupError(
+                    f"Zaxira sxema versiyasi {header.get('schema')}, baza {LATEST_VERSION} - mos emas"
+                )
+            if set(header.get("tables") or ()) != set(known):
+                raise BackupError("Zaxiradagi jadvallar ro'yxati bazaga mos emas")
+            yield "header", header
+
+            seen = []
+            current, columns, digest, rows, chunk = None, None, None, 0, []
+            for number, line in enumerate(src, start=2):
+                if line.startswith(b"["):
+                    if current is None:
+                        raise BackupError(f"{number}-qator: jadvaldan tashqarida ma'lumot")
+                    digest.update(line)
+                    values = json.loads(line)
+                    if len(values) != len(columns):
+                        raise BackupError(f"{number}-qator: ustunlar soni noto'g'ri")
+                    chunk.append(values)
+                    rows += 1
+                    if len(chunk) >= chunk_size:
+                        yield "rows", chunk
+                        chunk = []
+                    continue
+
+                meta = json.loads(line)
+                if "table" in meta:
+                    name = meta["table"]
+                    if current is not None or name not in known or name in seen:
+                        raise BackupError(f"{number}-qator: kutilmagan jadval {name}")
+                    columns = meta.get("columns") or []
+                    unknown = set(columns) - {column.name for column in known[name].columns}
+                    if unknown:
+                        raise BackupError(f"{name}: noma'lum ustunlar {', '.join(sorted(unknown))}")
+                    current, digest, rows = name, hashlib.sha256(), 0
+                    yield "table", (name, columns)
+                elif "end" in meta:
+                    if meta["end"] != current:
+                        raise BackupError(f"{number}-qator: jadval oxiri mos emas")
+                    if chunk:
+                        yield "rows", chunk
+                        chunk = []
+                    if meta.get("rows") != rows or meta.get("sha256") != digest.hexdigest():
+                        raise BackupError(f"{current}: nazorat yig'indisi mos emas, fayl buzilgan")
+                    seen.append(current)
+                    yield "end", TableSummary(current, rows)
+                    current = None
+                else:
+                    raise BackupError(f"{number}-qator: noma'lum yozuv")
+
+            if current is not None or len(seen) != len(known):
+                raise BackupError("Fayl to'liq emas")
+    except (OSError, EOFError, gzip.BadGzipFile) as e:
+        raise BackupError(f"Faylni o'qib bo'lmadi: {e}")
+    except ValueError as e:
+        raise BackupError(f"Fayl buzilgan: {e}")
+
+
+async def _iterate(path: str, chunk_size: int):
+    """
+    Run ``read_archive`` in a worker thread, one item at a time.
+    """
+    items = read_archive(path, chunk_size)
+    while True:
+        item = await asyncio.to_thread(next, items, None)
+        if item is None:
+            return
+        yield item
+
+
+async def check_backup(path: str, chunk_size: int = BACKUP_CHUNK_SIZE) -> BackupSummary:
+    """
+    Read the whole archive and verify it without touching the database.
+
+    Raises:
+        BackupError: if it cannot be restored
+    """
+    summary = None
+    async for kind, value in _iterate(path, chunk_size):
+        if kind == "header":
+            summary = BackupSummary(schema=value["schema"], created_at=value.get("created_at", ""))
+        elif kind == "end":
+            summary.tables.append(value)
+    return summary
+
+
+async def restore_backup(
+    path: str,
+    progress: Optional[Callable[[str, int], Awaitable[None]]] = None,
+    chunk_size: int = BACKUP_CHUNK_SIZE,
+) -> BackupSummary:
+    """
+    Replace the contents of all backed up tables with the archive, in one
+    transaction.
+
+    Raises:
+        BackupError: if the archive is damaged or the loaded data does not match it
+    """
+    tables = {table.name: table for table in backup_tables()}
+    summary = None
+    sequences = {}
+
+    async with _busy:
+        async with engine.connect() as conn:
+            async with conn.begin():
+                await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": RESTORE_LOCK_KEY})
+                await conn.execute(text(
+                    f"TRUNCATE {', '.join(map(_quoted, tables))} RESTART IDENTITY CASCADE"
+                ))
+                raw = (await conn.get_raw_connection()).driver_connection
+
+                columns, decoders, loaded = None, None, 0
+                async for kind, value in _iterate(path, chunk_size):
+                    if kind == "header":
+                        summary = BackupSummary(schema=value["schema"], created_at=value.get("created_at", ""))
+                        sequences = value.get("sequences") or {}
+                    elif kind == "table":
+                        name, columns = value
+                        by_name = tables[name].columns
+                        decoders = [(index, _decoder(by_name[column])) for index, column in enumerate(columns)]
+                        decoders = [(index, decode) for index, decode in decoders if decode]
+                        loaded = 0
+                    elif kind == "rows":
+                        for row in value:
+                            for index, decode in decoders:
+                                if row[index] is not None:
+                                    row[index] = decode(row[index])
+                        await raw.copy_records_to_table(
+                            name, records=[tuple(row) for row in value], columns=columns
+                        )
+                        loaded += len(value)
+                        if progress:
+                            await progress(name, loaded)
+                    elif kind == "end":
+                        count = await conn.scalar(text(f"SELECT count(*) FROM {_quoted(value.name)}"))
+                        if count != value.rows:
+                            raise BackupError(f"{value.name}: {value.rows} qator kutilgan, {count} yozildi")
+                        summary.tables.append(value)
+
+                await _reset_sequences(conn, tables.values())
+                await _restore_sequences(conn, sequences)
+
+    logger.info(f"Restored backup {os.path.basename(path)}: {len(summary.tables)} tables, {summary.rows} rows")
+    return summary
+
+
+async def _reset_sequences(conn, tables):
+    """
+    Move serial sequences past the restored ids.
+    """
+    for table in tables:
+        key = list(table.primary_key.columns)
+        if len(key) != 1 or not isinstance(key[0].type, Integer):
+            continue
+        column = key[0]
+        await conn.execute(text(
+            f"SELECT setval(pg_get_serial_sequence(:table, :column), "
+            f"coalesce(max({_quoted(column.name)}), 0) + 1, false) FROM {_quoted(table.name)}"
+        ), {"table": _quoted(table.name), "column": column.name})
+
+
+async def _restore_sequences(conn, sequences: Dict[str, Any]):
+    """
+    Move standalone sequences to their archived next value, never backwards.
+    """
+    for name in STANDALONE_SEQUENCES:
+        value = sequences.get(name)
+        if not isinstance(value, int) or isinstance(value, bool):
+            continue
+        await conn.execute(text(
+            f"SELECT setval('{_quoted(name)}', greatest(CAST(:value AS bigint), ({_next_value_sql(name)})), false)"
+        ), {"value": value})
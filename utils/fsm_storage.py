@@ -0,0 +1,165 @@
+"""
+FSM storage shared by all bot workers.
+
+``FSM_STORAGE`` selects the backend:
+- ``memory``   - aiogram's default; one process only, lost on restart;
+- ``redis``    - aiogram's RedisStorage on ``REDIS_URL``, per-user Redis locks;
+- ``postgres`` - the ``fsm_state`` table, per-user advisory locks.
+
+For the shared backends the events isolation holds a per-user lock while an
+update is handled, so two updates of one user are processed in order even
+when they reach different workers. Within one process ``UserLockMiddleware``
+already does that, so the memory backend needs no isolation of its own.
+State data is stored as compact JSON.
+"""
+import json
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import Any, AsyncGenerator, Dict, Mapping, Optional, Tuple
+
+from aiogram.exceptions import DataNotDictLikeError
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import (
+    BaseEventIsolation,
+    BaseStorage,
+    DefaultKeyBuilder,
+    StateType,
+    StorageKey,
+)
+from aiogram.fsm.storage.memory import DisabledEventIsolation, MemoryStorage
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database.db import async_session
+from database.models import FsmState
+from utils.config import DATABASE_URL, FSM_LOCK_POOL_SIZE, FSM_STORAGE, FSM_TTL, REDIS_URL
+from utils.keyed_lock import KeyedLock
+
+KEY_PREFIX = "pharma_fsm"
+
+
+def dumps(data: Mapping[str, Any]) -> str:
+    """
+    Compact JSON: no spaces, non-ASCII (Uzbek text) kept as is.
+    """
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM storage in the ``fsm_state`` table; every call is one short transaction.
+    Rows idle for longer than ``ttl`` are treated as empty.
+    """
+
+    def __init__(self, ttl: int = FSM_TTL):
+        self.ttl = timedelta(seconds=ttl)
+        self.key_builder = DefaultKeyBuilder(prefix=KEY_PREFIX)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await self._upsert(self.key_builder.build(key), state=value)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._get(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        if not isinstance(data, dict):
+            raise DataNotDictLikeError(
+                f"Data must be a dict or dict-like object, got {type(data).__name__}"
+            )
+        await self._upsert(self.key_builder.build(key), data=dumps(data) if data else None)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._get(self.key_builder.build(key))
+        return json.loads(data) if data else {}
+
+    async def close(self) -> None:
+        pass
+
+    async def _get(self, storage_key: str) -> Tuple[Optional[str], Optional[str]]:
+        async with async_session() as session:
+            row = (await session.execute(
+                select(FsmState.state, FsmState.data).where(
+                    FsmState.key == storage_key,
+                    FsmState.updated_at > func.now() - self.ttl,
+                )
+            )).one_or_none()
+        return (row.state, row.data) if row else (None, None)
+
+    async def _upsert(self, storage_key: str, **values):
+        stmt = insert(FsmState).values(key=storage_key, updated_at=func.now(), **values)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[FsmState.key],
+            set_={**{name: getattr(stmt.excluded, name) for name in values}, "updated_at": func.now()},
+        )
+        async with async_session() as session:
+            await session.execute(stmt)
+            if all(value is None for value in values.values()):
+                # Nothing left to remember: drop the row
+                await session.execute(
+                    delete(FsmState).where(
+                        FsmState.key == storage_key,
+                        FsmState.state.is_(None),
+                        FsmState.data.is_(None),
+                    )
+                )
+            await session.commit()
+
+
+class PostgresEventIsolation(BaseEventIsolation):
+    """
+    Per-user lock across workers: a transaction-scoped advisory lock held
+    while the update is handled.
+
+    Locks use their own small connection pool, so waiting for a lock never
+    takes connections away from the handlers.
+    """
+
+    def __init__(self, pool_size: int = FSM_LOCK_POOL_SIZE):
+        self.engine = create_async_engine(
+            DATABASE_URL, pool_size=pool_size, max_overflow=0, pool_pre_ping=True, pool_recycle=300
+        )
+        self.key_builder = DefaultKeyBuilder(prefix=KEY_PREFIX)
+        # Updates of one user in this worker queue here instead of each holding a connection
+        self._local = KeyedLock()
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        lock_key = self.key_builder.build(key, "lock")
+        async with self._local(lock_key):
+            async with self.engine.connect() as conn:
+                async with conn.begin():
+                    await conn.execute(
+                        text("SELECT pg_advisory_xact_lock(hashtextextended(:key, 0))"),
+                        {"key": lock_key},
+                    )
+                    yield
+
+    async def close(self) -> None:
+        await self.engine.dispose()
+
+
+def build_storage() -> Tuple[BaseStorage, BaseEventIsolation]:
+    """
+    FSM storage and events isolation for the Dispatcher, chosen by ``FSM_STORAGE``.
+    """
+    if FSM_STORAGE == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage
+
+        storage = RedisStorage.from_url(
+            REDIS_URL,
+            key_builder=DefaultKeyBuilder(prefix=KEY_PREFIX),
+            state_ttl=FSM_TTL,
+            data_ttl=FSM_TTL,
+            json_dumps=dumps,
+        )
+        return storage, storage.create_isolation()
+
+    if FSM_STORAGE == "postgres":
+        return PostgresStorage(), PostgresEventIsolation()
+
+    if FSM_STORAGE != "memory":
+        raise ValueError(f"Unknown FSM_STORAGE: {FSM_STORAGE!r} (memory, redis or postgres)")
+    return MemoryStorage(), DisabledEventIsolation()
@@ -0,0 +1,41 @@
+"""
+Per-key asyncio locks that do not pile up.
+
+A lock exists only while someone holds or waits for it, so one entry per
+active user instead of one per user ever seen.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Dict, Hashable, List
+
+
+class KeyedLock:
+    """
+    ``async with locks(key):`` serializes callers with the same key;
+    different keys never wait for each other.
+    """
+
+    def __init__(self):
+        # key -> [lock, holders and waiters]
+        self._locks: Dict[Hashable, List] = {}
+
+    @asynccontextmanager
+    async def __call__(self, key: Hashable) -> AsyncGenerator[None, None]:
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def locked(self, key: Hashable) -> bool:
+        entry = self._locks.get(key)
+        return entry is not None and entry[0].locked()
+
+    def __len__(self) -> int:
+        return len(self._locks)
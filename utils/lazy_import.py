@@ -0,0 +1,101 @@
+"""
+Lazy imports for heavy optional libraries.
+
+``lazy_import("cv2")`` returns a proxy that imports the module on first
+attribute access, so importing a handler module stays cheap. ``prewarm``
+imports every registered lazy module in a worker thread once the bot is
+running, so the first user of a feature usually does not pay the import
+either.
+"""
+import asyncio
+import importlib
+import logging
+import time
+from types import ModuleType
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+_registry: Dict[str, "LazyModule"] = {}
+
+
+class LazyModule:
+    """
+    Module proxy that imports ``name`` on first use.
+    """
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+        self.__dict__["_error"] = None
+
+    def load(self) -> ModuleType:
+        """
+        Import the module (once) and return it.
+
+        Raises:
+            ImportError: if the library is not installed
+        """
+        if self._module is None:
+            if self._error is not None:
+                raise self._error
+            try:
+                self.__dict__["_module"] = importlib.import_module(self._name)
+            except ImportError as e:
+                self.__dict__["_error"] = e
+                raise
+        return self._module
+
+    @property
+    def available(self) -> bool:
+        """
+        True if the library can be imported (imports it on first check).
+        """
+        try:
+            self.load()
+        except ImportError:
+            return False
+        return True
+
+    @property
+    def loaded(self) -> bool:
+        return self._module is not None
+
+    def __getattr__(self, attr: str):
+        return getattr(self.load(), attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.loaded else "not loaded"
+        return f"<LazyModule {self._name!r} ({state})>"
+
+
+def lazy_import(name: str) -> LazyModule:
+    """
+    Return a lazy proxy of module ``name``; one proxy per module.
+    """
+    module = _registry.get(name)
+    if module is None:
+        module = _registry[name] = LazyModule(name)
+    return module
+
+
+async def prewarm(delay: float = 0.0, names: Optional[list] = None):
+    """
+    Import lazy modules in a worker thread, one by one.
+
+    Args:
+        delay: Seconds to wait first, so startup work finishes undisturbed
+        names: Modules to import; all registered ones by default
+    """
+    if delay:
+        await asyncio.sleep(delay)
+    for name in names or list(_registry):
+        module = lazy_import(name)
+        if module.loaded:
+            continue
+        started = time.perf_counter()
+        available = await asyncio.to_thread(lambda: module.available)
+        if available:
+            logger.info(f"Pre-warmed {name} in {(time.perf_counter() - started) * 1000:.0f} ms")
+        else:
+            logger.warning(f"Optional module {name} is not installed")
@@ -0,0 +1,272 @@
+"""
+Moderation of cooperation applications and feedback.
+
+Both are stored as pending rows (``approved IS NULL``) when the user submits
+them. Moderators (``MODERATOR_IDS``, always including ``ADMIN_ID``) work
+through the queue in batches:
+
+- ``claim_batch`` reserves up to MODERATION_BATCH_SIZE pending rows for one
+  moderator (``claimed_by``/``claimed_until``) with ``FOR UPDATE SKIP LOCKED``,
+  so two moderators opening the queue at once get different rows; a claim
+  that is not acted on expires after MODERATION_CLAIM_TTL;
+- ``decide`` approves or rejects the selected rows with one UPDATE guarded by
+  ``approved IS NULL`` and the claim, so a row is decided exactly once and
+  never out from under another moderator; the authors' notifications are
+  queued with one INSERT in the same transaction;
+- instead of one admin message per submission, ``ModerationDigest`` sends
+  every moderator a periodic summary of what arrived.
+
+Pending rows are read through the partial indexes ``ix_applications_pending``
+and ``ix_comments_pending`` (migration 10).
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+from sqlalchemy import case, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.db import async_session
+from database.models import Application, Comment
+from utils.audit import audit
+from utils.config import MODERATION_CLAIM_TTL, MODERATION_DIGEST_INTERVAL, MODERATOR_IDS
+from utils.notifications import enqueue_many
+
+logger = logging.getLogger(__name__)
+
+CLAIM_TTL = timedelta(seconds=MODERATION_CLAIM_TTL)
+
+
+@dataclass(frozen=True)
+class ModerationKind:
+    """
+    What is moderated and what the user is told about the decision.
+    """
+    key: str  # used in callback data
+    model: type
+    title: str
+    approved_text: str  # formatted with the row id
+    rejected_text: str
+
+
+KINDS: Dict[str, ModerationKind] = {
+    kind.key: kind for kind in (
+        ModerationKind(
+            key="app",
+            model=Application,
+            title="🤝 Hamkorlik so'rovlari",
+            approved_text="🎉 Tabriklaymiz! Hamkorlik so'rovingiz tasdiqlandi!\n📝 Ariza raqami: #{id}",
+            rejected_text="❌ Afsuski, hamkorlik so'rovingiz rad etildi.\n"
+                          "Batafsil ma'lumot uchun admin bilan bog'laning.",
+        ),
+        ModerationKind(
+            key="fb",
+            model=Comment,
+            title="💬 Fikrlar",
+            approved_text="✅ Fikringiz tasdiqlandi! Rahmat.",
+            rejected_text="❌ Fikringiz rad etildi.",
+        ),
+    )
+}
+
+APPROVE = "a"
+REJECT = "r"
+
+
+def _free_for(model, moderator_id: int):
+    """
+    Rows nobody else holds a live claim on.
+    """
+    return or_(
+        model.claimed_by.is_(None),
+        model.claimed_by == moderator_id,
+        model.claimed_until < func.now(),
+    )
+
+
+def pending_query(kind: str):
+    model = KINDS[kind].model
+    return select(model).where(model.approved.is_(None))
+
+
+async def claim_batch(
+    session: AsyncSession,
+    kind: str,
+    moderator_id: int,
+    limit: int,
+    after_id: int = 0,
+) -> List:
+    """
+    Reserve up to ``limit`` pending rows for ``moderator_id``, oldest first,
+    and return them. Rows the moderator already holds come first and have
+    their claim renewed. Rows locked by a concurrent claim are skipped.
+    The caller commits.
+    """
+    model = KINDS[kind].model
+    batch = (
+        select(model.id)
+        .where(model.approved.is_(None), model.id > after_id, _free_for(model, moderator_id))
+        .order_by(case((model.claimed_by == moderator_id, 0), else_=1), model.id)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+        .cte("batch")
+    )
+    rows = (await session.scalars(
+        update(model)
+        .where(model.id == batch.c.id)
+        .values(claimed_by=moderator_id, claimed_until=func.now() + CLAIM_TTL)
+        .returning(model)
+        .execution_options(synchronize_session=False)
+    )).all()
+    return sorted(rows, key=lambda row: row.id)
+
+
+async def claimed_rows(session: AsyncSession, kind: str, moderator_id: int) -> List:
+    """
+    Pending rows the moderator holds a live claim on, oldest first.
+    """
+    model = KINDS[kind].model
+    return (await session.scalars(
+        pending_query(kind)
+        .where(model.claimed_by == moderator_id, model.claimed_until >= func.now())
+        .order_by(model.id)
+    )).all()
+
+
+async def release(session: AsyncSession, kind: str, moderator_id: int) -> int:
+    """
+    Give the moderator's pending rows back to the queue. The caller commits.
+    """
+    model = KINDS[kind].model
+    result = await session.execute(
+        update(model)
+        .where(model.approved.is_(None), model.claimed_by == moderator_id)
+        .values(claimed_by=None, claimed_until=None)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+async def decide(
+    session: AsyncSession,
+    kind: str,
+    ids: Iterable[int],
+    approve: bool,
+    moderator_id: int,
+) -> List:
+    """
+    Approve or reject pending rows with one UPDATE and queue their authors'
+    notifications with one INSERT. Rows that are already decided or claimed
+    by another moderator are left alone. The caller commits.
+
+    Returns:
+        Rows of the decided items (id, user_id)
+    """
+    spec = KINDS[kind]
+    model = spec.model
+    ids = list(ids)
+    rows = (await session.execute(
+        update(model)
+        .where(model.id.in_(ids), model.approved.is_(None), _free_for(model, moderator_id))
+        .values(approved=approve, decided_at=func.now(), decided_by=moderator_id, claimed_until=None)
+        .returning(model.id, model.user_id)
+        .execution_options(synchronize_session=False)
+    )).all()
+
+    text = spec.approved_text if approve else spec.rejected_text
+    # Applications submitted before migration 10 have no author
+    await enqueue_many(session, [(row.user_id, text.format(id=row.id)) for row in rows if row.user_id])
+    if rows:
+        action = "approve" if approve else "reject"
+        audit(session, moderator_id, f"{model.__tablename__}.{action}", [row.id for row in rows],
+              requested=len(ids))
+    return rows
+
+
+async def pending_counts(session: AsyncSession) -> Dict[str, int]:
+    """
+    Number of pending rows per kind (index-only scans of the partial indexes).
+    """
+    counts = {}
+    for key, spec in KINDS.items():
+        counts[key] = await session.scalar(
+            select(func.count()).select_from(spec.model).where(spec.model.approved.is_(None))
+        )
+    return counts
+
+
+def open_queue_keyboard() -> InlineKeyboardMarkup:
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🗂 Ko'rib chiqish", callback_data="admin:moderation")],
+    ])
+
+
+class ModerationDigest:
+    """
+    Periodically tells every moderator how many items arrived since the last
+    digest. Each new row is marked ``digested_at`` by the same UPDATE that
+    counts it, so several bot processes never report a row twice.
+    """
+
+    def __init__(self, interval: float = MODERATION_DIGEST_INTERVAL):
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def poll(self) -> Dict[str, int]:
+        """
+        Send one digest if anything new is pending; returns the new counts.
+        """
+        async with async_session() as session:
+            new = {}
+            for key, spec in KINDS.items():
+                model = spec.model
+                result = await session.execute(
+                    update(model)
+                    .where(model.approved.is_(None), model.digested_at.is_(None))
+                    .values(digested_at=func.now())
+                    .execution_options(synchronize_session=False)
+                )
+                new[key] = result.rowcount
+            if not any(new.values()):
+                return new
+
+            pending = await pending_counts(session)
+            lines = [
+                f"{spec.title}: +{new[key]} (jami {pending[key]} ta kutilmoqda)"
+                for key, spec in KINDS.items() if new[key]
+            ]
+            text = "🗂 Moderatsiya: yangi so'rovlar\n\n" + "\n".join(lines)
+            await enqueue_many(
+                session,
+                [(moderator_id, text) for moderator_id in sorted(MODERATOR_IDS)],
+                reply_markup=open_queue_keyboard(),
+            )
+            await session.commit()
+        logger.info(f"Moderation digest: {new}")
+        return new
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.poll()
+            except Exception as e:
+                logger.error(f"Moderation digest failed: {e}", exc_info=True)
+
+
+moderation_digest = ModerationDigest()
@@ -0,0 +1,347 @@
+"""
+Notification outbox.
+
+Handlers never call the Telegram API to notify someone else. They add a row
+to ``notification_outbox`` with ``enqueue`` in the same transaction as the
+change the message announces, and answer their own user right away.
+``NotificationSender`` delivers the rows in the background:
+
+- rows are claimed in batches with ``FOR UPDATE SKIP LOCKED`` and a lease,
+  so several bot processes can share the queue and a crashed sender's rows
+  are picked up again once the lease expires;
+- sends respect a global token bucket (Telegram allows ~30 messages/s per
+  bot) and a per-chat interval;
+- 429 and 5xx/network errors are retried with exponential backoff; 400/403
+  (bad request, bot blocked) fail the row permanently.
+"""
+import asyncio
+import logging
+import random
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Tuple
+
+from aiogram import types
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNotFound,
+    TelegramRetryAfter,
+)
+from sqlalchemy import bindparam, event, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from database.db import async_session
+from database.models import NotificationOutbox, User
+from loader import bot
+from utils.config import (
+    NOTIFY_BATCH_SIZE,
+    NOTIFY_CHAT_INTERVAL,
+    NOTIFY_GLOBAL_RATE,
+    NOTIFY_MAX_ATTEMPTS,
+    NOTIFY_POLL_INTERVAL,
+)
+from utils.rate_limit import KeyedRateLimiter, TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# How long a claimed row belongs to its sender before others may retry it
+LEASE = timedelta(seconds=120)
+BACKOFF_BASE = 2.0  # seconds
+BACKOFF_MAX = 15 * 60.0
+# A chat that is throttled for longer than this is skipped instead of holding up the batch
+MAX_CHAT_WAIT = 5.0
+
+# Errors that will not go away by retrying
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest, TelegramNotFound)
+
+# Shared by everything that sends bulk messages
+global_send_limit = TokenBucket(NOTIFY_GLOBAL_RATE)
+
+
+def enqueue(
+    session: AsyncSession,
+    chat_id: int,
+    text: Optional[str] = None,
+    *,
+    parse_mode: Optional[str] = None,
+    reply_markup: Optional[types.InlineKeyboardMarkup] = None,
+    photo: Optional[str] = None,
+) -> NotificationOutbox:
+    """
+    Queue a message in the caller's transaction. It is sent after commit.
+
+    Args:
+        photo: Telegram file_id; the message is sent as a photo with ``text`` as caption
+    """
+    job = NotificationOutbox(
+        chat_id=chat_id,
+        text=text,
+        photo=photo,
+        parse_mode=parse_mode,
+        reply_markup=reply_markup.model_dump_json(exclude_none=True) if reply_markup else None,
+    )
+    session.add(job)
+    session.sync_session.info["notifications_enqueued"] = True
+    return job
+
+
+async def enqueue_many(
+    session: AsyncSession,
+    messages: Iterable[Tuple[int, str]],
+    *,
+    parse_mode: Optional[str] = None,
+    reply_markup: Optional[types.InlineKeyboardMarkup] = None,
+) -> int:
+    """
+    Queue many ``(chat_id, text)`` messages with one INSERT in the caller's
+    transaction; returns how many were queued.
+    """
+    markup = reply_markup.model_dump_json(exclude_none=True) if reply_markup else None
+    rows = [
+        {"chat_id": chat_id, "text": text, "parse_mode": parse_mode, "reply_markup": markup}
+        for chat_id, text in messages
+    ]
+    if not rows:
+        return 0
+    await session.execute(insert(NotificationOutbox), rows)
+    session.sync_session.info["notifications_enqueued"] = True
+    return len(rows)
+
+
+async def notify(chat_id: int, text: Optional[str] = None, **kwargs):
+    """
+    Queue a single message in its own transaction.
+    For handlers that do not write anything else to the database.
+    """
+    async with async_session() as session:
+        enqueue(session, chat_id, text, **kwargs)
+        await session.commit()
+
+
+@event.listens_for(Session, "after_commit")
+def _wake_sender(session: Session):
+    # Committed rows are due now: don't make them wait for the next poll
+    if session.info.pop("notifications_enqueued", False):
+        notification_sender.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_enqueued(session: Session):
+    session.info.pop("notifications_enqueued", None)
+
+
+def backoff(attempts: int) -> float:
+    """
+    Seconds to wait before retry number ``attempts`` (full jitter).
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempts))
+
+
+class NotificationSender:
+    """
+    Background delivery of ``notification_outbox`` rows.
+    """
+
+    def __init__(self, batch_size: int = NOTIFY_BATCH_SIZE, poll_interval: float = NOTIFY_POLL_INTERVAL,
+                 chat_interval: float = NOTIFY_CHAT_INTERVAL, max_attempts: int = NOTIFY_MAX_ATTEMPTS):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._chat_limit = KeyedRateLimiter(chat_interval)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.metrics = Counter()  # sent, retried, throttled, failed, batches
+        self.max_lag = 0.0  # seconds between enqueue and delivery, since last report
+        self._reported_at = time.monotonic()
+        self._blocked_chats = set()  # users who blocked the bot, saved with the batch
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def queue_depth(self) -> int:
+        """
+        Number of messages waiting to be sent.
+        """
+        async with async_session() as session:
+            return await session.scalar(
+                select(func.count()).select_from(NotificationOutbox)
+                .where(NotificationOutbox.status.in_(("pending", "sending")))
+            )
+
+    async def _run(self):
+        while True:
+            try:
+                claimed = await self._drain()
+            except Exception as e:
+                logger.error(f"Notification sender failed: {e}", exc_info=True)
+                claimed = 0
+            self._report()
+            if claimed < self.batch_size:
+                # Queue is drained: sleep until something is enqueued or a retry is due
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def _drain(self) -> int:
+        jobs = await self._claim()
+        if jobs:
+            self.metrics["batches"] += 1
+            # Per-chat slots are reserved in row order, so one chat's messages keep their order
+            results = await asyncio.gather(*(self._send(job) for job in jobs))
+            await self._record(results)
+        return len(jobs)
+
+    async def _claim(self) -> list:
+        table = NotificationOutbox.__table__
+        due = (
+            select(table.c.id)
+            .where(or_(
+                (table.c.status == "pending") & (table.c.next_attempt_at <= func.now()),
+                (table.c.status == "sending") & (table.c.locked_until < func.now()),
+            ))
+            .order_by(table.c.next_attempt_at, table.c.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        async with async_session() as session:
+            result = await session.execute(
+                update(table)
+                .where(table.c.id.in_(due.scalar_subquery()))
+                .values(
+                    status="sending",
+                    locked_until=func.now() + LEASE,
+                    attempts=table.c.attempts + 1,
+                )
+                .returning(table)
+            )
+            jobs = sorted(result.all(), key=lambda job: (job.next_attempt_at, job.id))
+            await session.commit()
+        return jobs
+
+    async def _send(self, job) -> dict:
+        """
+        Deliver one row. Returns the row's new state.
+        """
+        outcome = {
+            "b_id": job.id, "b_status": "sent", "b_next": None, "b_error": None, "b_sent": None, "b_deferred": 0,
+        }
+        markup = (
+            types.InlineKeyboardMarkup.model_validate_json(job.reply_markup) if job.reply_markup else None
+        )
+        chat_delay = self._chat_limit.delay(job.chat_id)
+        if chat_delay > MAX_CHAT_WAIT:
+            # Not sent, so the claim's attempt is given back
+            outcome.update(
+                b_status="pending",
+                b_next=datetime.now(timezone.utc) + timedelta(seconds=chat_delay),
+                b_error=job.last_error,
+                b_deferred=1,
+            )
+            return outcome
+        await self._chat_limit.wait(job.chat_id)
+        await global_send_limit.acquire()
+        try:
+            if job.photo:
+                await bot.send_photo(
+                    job.chat_id, job.photo, caption=job.text,
+                    parse_mode=job.parse_mode, reply_markup=markup,
+                )
+            else:
+                await bot.send_message(
+                    job.chat_id, job.text,
+                    parse_mode=job.parse_mode, reply_markup=markup,
+                )
+        except TelegramRetryAfter as e:
+            self.metrics["throttled"] += 1
+            self._chat_limit.penalize(job.chat_id, e.retry_after)
+            return self._retry(outcome, job, e, delay=e.retry_after)
+        except PERMANENT_ERRORS as e:
+            if isinstance(e, TelegramForbiddenError):
+                self._blocked_chats.add(job.chat_id)
+            self.metrics["failed"] += 1
+            logger.warning(f"Notification {job.id} to {job.chat_id} dropped: {e}")
+            outcome.update(b_status="failed", b_error=str(e))
+            return outcome
+        except Exception as e:
+            # 5xx, network errors, timeouts
+            return self._retry(outcome, job, e, delay=backoff(job.attempts))
+
+        self.metrics["sent"] += 1
+        now = datetime.now(timezone.utc)
+        if job.created_at:
+            self.max_lag = max(self.max_lag, (now - job.created_at).total_seconds())
+        outcome["b_sent"] = now
+        return outcome
+
+    def _retry(self, outcome: dict, job, error: Exception, delay: float) -> dict:
+        if job.attempts >= self.max_attempts:
+            self.metrics["failed"] += 1
+            logger.error(f"Notification {job.id} to {job.chat_id} failed after {job.attempts} attempts: {error}")
+            outcome.update(b_status="failed", b_error=str(error))
+        else:
+            self.metrics["retried"] += 1
+            outcome.update(
+                b_status="pending",
+                b_error=str(error),
+                b_next=datetime.now(timezone.utc) + timedelta(seconds=delay),
+            )
+        return outcome
+
+    async def _record(self, results: List[dict]):
+        table = NotificationOutbox.__table__
+        async with async_session() as session:
+            await session.execute(
+                update(table)
+                .where(table.c.id == bindparam("b_id"))
+                .values(
+                    status=bindparam("b_status"),
+                    attempts=table.c.attempts - bindparam("b_deferred"),
+                    next_attempt_at=func.coalesce(bindparam("b_next"), table.c.next_attempt_at),
+                    last_error=bindparam("b_error"),
+                    sent_at=bindparam("b_sent"),
+                    locked_until=None,
+                ),
+                results,
+            )
+            if self._blocked_chats:
+                # Broadcasts skip users who blocked the bot
+                await session.execute(
+                    update(User)
+                    .where(User.telegram_id.in_(self._blocked_chats), User.is_blocked.is_(False))
+                    .values(is_blocked=True, blocked_at=func.now())
+                )
+                self._blocked_chats = set()
+            await session.commit()
+
+    def _report(self, every: float = 60.0):
+        now = time.monotonic()
+        if now - self._reported_at < every or not self.metrics:
+            return
+        logger.info(
+            "Notifications in the last %.0fs: sent=%d retried=%d throttled=%d failed=%d, max lag %.1fs",
+            now - self._reported_at, self.metrics["sent"], self.metrics["retried"],
+            self.metrics["throttled"], self.metrics["failed"], self.max_lag,
+        )
+        self.metrics.clear()
+        self.max_lag = 0.0
+        self._reported_at = now
+
+
+notification_sender = NotificationSender()
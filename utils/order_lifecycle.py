@@ -0,0 +1,276 @@
+"""
+Order lifecycle: validated status transitions.
+
+    pending ──► confirmed ──► ready ──► completed
+       │            │           │
+       └────────────┴───────────┴──► cancelled
+
+A transition is a compare-and-set ``UPDATE ... WHERE status = <old>``, so two
+staff members tapping different buttons at once cannot both win. The
+statistics rollup and the customer notification are written in the same
+transaction.
+
+Placing an order takes its items out of the pharmacy's stock
+(``pharmacy_drugs.residual``) with ``take_stock``, and is refused if any of
+them is short, so every item of an order was taken. Cancelling or deleting an
+order that was not completed puts them back in the same transaction.
+"""
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from aiogram.types import InlineKeyboardButton
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Order, OrderItem, PharmacyDrug
+from utils.notifications import enqueue
+from utils.stats_rollup import record_transition, record_transitions
+
+TRANSITIONS: Dict[str, Tuple[str, ...]] = {
+    "pending": ("confirmed", "cancelled"),
+    "confirmed": ("ready", "cancelled"),
+    "ready": ("completed", "cancelled"),
+    "completed": (),
+    "cancelled": (),
+}
+
+# Statuses whose items are still held out of the pharmacy's stock
+STOCK_HELD = tuple(status for status, targets in TRANSITIONS.items() if "cancelled" in targets)
+
+STATUS_LABELS = {
+    "pending": "⏳ Kutilmoqda",
+    "confirmed": "✅ Tasdiqlangan",
+    "ready": "🔔 Tayyor",
+    "completed": "✔️ Yakunlangan",
+    "cancelled": "❌ Bekor qilingan",
+}
+
+# Button text for moving an order into a status
+ACTION_LABELS = {
+    "confirmed": "✅ Tasdiqlash",
+    "ready": "🔔 Tayyor",
+    "completed": "✔️ Berildi",
+    "cancelled": "❌ Bekor qilish",
+}
+
+# Message sent to the customer after a transition
+CUSTOMER_MESSAGES = {
+    "confirmed": "✅ <b>Buyurtma #{id}</b> dorixona tomonidan tasdiqlandi. Dorilar tayyorlanmoqda.",
+    "ready": (
+        "🔔 <b>Buyurtma #{id} tayyor!</b>\n\n"
+        "Dorixonaga borib, pickup kodingizni ko'rsating: <code>{code}</code>"
+    ),
+    "completed": "✔️ <b>Buyurtma #{id}</b> yakunlandi. Xaridingiz uchun rahmat!",
+    "cancelled": "❌ <b>Buyurtma #{id}</b> dorixona tomonidan bekor qilindi.",
+}
+
+
+def can_transition(old_status: str, new_status: str) -> bool:
+    return new_status in TRANSITIONS.get(old_status, ())
+
+
+def order_status_callback(order_id: int, status: str) -> str:
+    """
+    Callback data of a status action button: "ord:<order_id>:<status>".
+    """
+    return f"ord:{order_id}:{status}"
+
+
+def order_action_rows(order_id: int, status: str) -> List[List[InlineKeyboardButton]]:
+    """
+    Keyboard rows with the transitions allowed from ``status``.
+    """
+    buttons = [
+        InlineKeyboardButton(text=ACTION_LABELS[target], callback_data=order_status_callback(order_id, target))
+        for target in TRANSITIONS.get(status, ())
+    ]
+    return [buttons] if buttons else []
+
+
+async def transition_order(
+    session: AsyncSession,
+    order_id: int,
+    new_status: str,
+    pharmacy_id: Optional[int] = None,
+) -> Optional[Tuple[Order, str]]:
+    """
+    Move an order to ``new_status``. The caller commits.
+
+    Args:
+        pharmacy_id: If given, the order must belong to this pharmacy
+
+    Returns:
+        (order, old_status), or None if the order does not exist, belongs to
+        another pharmacy, or the transition is not allowed from its status
+    """
+    stmt = select(Order.status).where(Order.id == order_id)
+    if pharmacy_id is not None:
+        stmt = stmt.where(Order.pharmacy_id == pharmacy_id)
+    old_status = await session.scalar(stmt)
+    if old_status is None or not can_transition(old_status, new_status):
+        return None
+
+    values = {"status": new_status}
+    if new_status == "completed":
+        values["completed_at"] = func.now()
+
+    result = await session.execute(
+        update(Order)
+        .where(Order.id == order_id, Order.status == old_status)
+        .values(**values)
+        .returning(Order)
+        .execution_options(synchronize_session=False)
+    )
+    order = result.scalar_one_or_none()
+    if order is None:
+        # Someone else changed the status between our read and write
+        return None
+
+    if new_status == "cancelled":
+        await restock(session, [order_id])
+    await record_transition(session, order_id, old_status, new_status)
+    return order, old_status
+
+
+async def bulk_transition(session: AsyncSession, order_ids: Iterable[int], new_status: str) -> List:
+    """
+    Move many orders to ``new_status`` with one set-based UPDATE; orders whose
+    status does not allow the transition are left alone. The statistics
+    rollup is updated and customers are notified. The caller commits.
+
+    Returns:
+        Rows of the changed orders (id, user_id, pharmacy_id, pickup_code,
+        total_amount, created_at, status, old_status)
+    """
+    allowed_from = [status for status, targets in TRANSITIONS.items() if new_status in targets]
+    if not allowed_from:
+        return []
+
+    # Lock the candidates first; the old status is read from the locked row version
+    target = (
+        select(Order.id, Order.status.label("old_status"))
+        .where(Order.id.in_(list(order_ids)), Order.status.in_(allowed_from))
+        .with_for_update()
+        .cte("target")
+    )
+    values = {"status": new_status, "updated_at": func.now()}
+    if new_status == "completed":
+        values["completed_at"] = func.now()
+
+    rows = (await session.execute(
+        update(Order)
+        .where(Order.id == target.c.id)
+        .values(**values)
+        .returning(
+            Order.id, Order.user_id, Order.pharmacy_id, Order.pickup_code,
+            Order.total_amount, Order.created_at, Order.status, target.c.old_status,
+        )
+        .execution_options(synchronize_session=False)
+    )).all()
+
+    if new_status == "cancelled":
+        await restock(session, [row.id for row in rows])
+    await record_transitions(session, rows, new_status)
+    for row in rows:
+        notify_customer(session, row)
+    return rows
+
+
+async def delete_orders(session: AsyncSession, order_ids: Iterable[int]) -> List:
+    """
+    Delete orders (their items cascade) and take them out of the statistics
+    rollup. Items of orders that were not completed or cancelled go back to
+    stock. The caller commits.
+
+    Returns:
+        Rows of the deleted orders (id, pharmacy_id, total_amount, created_at, old_status)
+    """
+    order_ids = list(order_ids)
+    # Locked, so none of them is completed or cancelled before the DELETE
+    held = (await session.scalars(
+        select(Order.id)
+        .where(Order.id.in_(order_ids), Order.status.in_(STOCK_HELD))
+        .with_for_update()
+    )).all()
+    await restock(session, held)
+
+    rows = (await session.execute(
+        delete(Order)
+        .where(Order.id.in_(order_ids))
+        .returning(
+            Order.id, Order.pharmacy_id, Order.total_amount, Order.created_at,
+            Order.status.label("old_status"),
+        )
+        .execution_options(synchronize_session=False)
+    )).all()
+    await record_transitions(session, rows, None)
+    return rows
+
+
+async def take_stock(session: AsyncSession, pharmacy_id: int, items: Iterable[Tuple[int, int]]) -> Set[int]:
+    """
+    Take (drug_id, quantity) items out of the pharmacy's stock, each with one
+    ``UPDATE ... WHERE residual >= quantity``, so concurrent orders can never
+    take the same units. The caller commits, or rolls back if anything is short.
+
+    Returns:
+        Drug ids the pharmacy does not have enough of (nothing taken for them)
+    """
+    short = set()
+    for drug_id, quantity in items:
+        taken = await session.execute(
+            update(PharmacyDrug)
+            .where(
+                PharmacyDrug.pharmacy_id == pharmacy_id,
+                PharmacyDrug.drug_id == drug_id,
+                PharmacyDrug.residual >= quantity,
+            )
+            .values(residual=PharmacyDrug.residual - quantity)
+            .execution_options(synchronize_session=False)
+        )
+        if not taken.rowcount:
+            short.add(drug_id)
+    return short
+
+
+async def restock(session: AsyncSession, order_ids: Iterable[int]) -> int:
+    """
+    Put the items of the given orders back into their pharmacy's stock with
+    one UPDATE: what ``take_stock`` took when they were placed. Drugs the
+    pharmacy no longer lists are skipped. The caller commits.
+
+    Returns:
+        Number of stock rows updated
+    """
+    order_ids = list(order_ids)
+    if not order_ids:
+        return 0
+    returned = (
+        select(Order.pharmacy_id, OrderItem.drug_id, func.sum(OrderItem.quantity).label("quantity"))
+        .join(OrderItem, OrderItem.order_id == Order.id)
+        .where(Order.id.in_(order_ids))
+        .group_by(Order.pharmacy_id, OrderItem.drug_id)
+        .subquery("returned")
+    )
+    result = await session.execute(
+        update(PharmacyDrug)
+        .where(PharmacyDrug.pharmacy_id == returned.c.pharmacy_id, PharmacyDrug.drug_id == returned.c.drug_id)
+        .values(residual=func.coalesce(PharmacyDrug.residual, 0) + returned.c.quantity)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def notify_customer(session: AsyncSession, order: Order):
+    """
+    Queue a message telling the customer about the order's new status.
+    Call in the transition's transaction. ``order`` may also be a result row
+    with ``id``, ``user_id``, ``status`` and ``pickup_code``.
+    """
+    template = CUSTOMER_MESSAGES.get(order.status)
+    if template:
+        enqueue(
+            session,
+            order.user_id,
+            template.format(id=order.id, code=order.pickup_code or ""),
+            parse_mode="HTML",
+        )
@@ -0,0 +1,121 @@
+"""
+Admin order search.
+
+The query is recognised by its shape, and each kind is backed by an index:
+- pickup code ("PX-7KQ2MC", "7kq2mc"): ``ix_orders_pickup_code``;
+- number ("1234", "+998 90 123-45-67"): the order id (primary key), the
+  customer phone as a digit suffix (``ix_orders_phone_digits_rev``,
+  migration 9, same scheme as the user search) and an all-digit pickup code;
+- "#1234": the order id only;
+- date or date range ("14.10.2026", "01.10.2026-14.10.2026", local days):
+  ``ix_orders_created``.
+
+Matches are listed newest first with keyset pagination.
+"""
+import re
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import Select, collate, false, literal_column, or_, select
+
+from database.models import Order
+from utils.config import TIMEZONE
+from utils.pickup_code import normalize_pickup_code
+from utils.user_search import LOCAL_PHONE_DIGITS, MIN_PHONE_DIGITS
+
+LOCAL_TZ = ZoneInfo(TIMEZONE)
+
+# Must stay identical to the expression of ix_orders_phone_digits_rev
+PHONE_DIGITS_REVERSED = literal_column(r"reverse(regexp_replace(orders.phone, '\D', '', 'g'))")
+
+INT_MAX = 2 ** 31 - 1
+
+_ORDER_ID = re.compile(r"^#\s*(\d+)$")
+_NUMBER = re.compile(r"^[\d\s()+\-]+$")
+_DATE = r"(\d{1,2})\.(\d{1,2})\.(\d{4})"
+_DATE_RANGE = re.compile(rf"^{_DATE}(?:\s*[-–]\s*{_DATE})?$")
+
+
+@dataclass
+class OrderQuery:
+    """
+    Parsed search query; ``describe`` is shown above the results.
+    """
+    kind: str  # code, number, id, dates
+    value: object
+
+    @property
+    def describe(self) -> str:
+        if self.kind == "dates":
+            start, end = self.value
+            return f"{start:%d.%m.%Y}" if start == end else f"{start:%d.%m.%Y} – {end:%d.%m.%Y}"
+        return str(self.value)
+
+
+def parse_order_query(raw: str) -> Optional[OrderQuery]:
+    """
+    Recognise a search query, or None if it matches no supported shape.
+    """
+    query = raw.strip()
+
+    match = _ORDER_ID.match(query)
+    if match:
+        return OrderQuery("id", int(match.group(1)))
+
+    match = _DATE_RANGE.match(query)
+    if match:
+        try:
+            start = date(int(match.group(3)), int(match.group(2)), int(match.group(1)))
+            end = date(int(match.group(6)), int(match.group(5)), int(match.group(4))) if match.group(4) else start
+        except ValueError:
+            return None
+        return OrderQuery("dates", (min(start, end), max(start, end)))
+
+    if _NUMBER.match(query):
+        digits = re.sub(r"\D", "", query)
+        if digits:
+            return OrderQuery("number", digits)
+
+    code = normalize_pickup_code(query)
+    if code:
+        return OrderQuery("code", code)
+    return None
+
+
+def _local_midnight(day: date) -> datetime:
+    return datetime(day.year, day.month, day.day, tzinfo=LOCAL_TZ)
+
+
+def build_order_query(query: OrderQuery) -> Select:
+    """
+    Filtered select of orders; the caller adds ordering and paging.
+    """
+    stmt = select(Order)
+    if query.kind == "code":
+        return stmt.where(Order.pickup_code == query.value)
+    if query.kind == "id":
+        return stmt.where(Order.id == query.value if query.value <= INT_MAX else false())
+    if query.kind == "dates":
+        start, end = query.value
+        return stmt.where(
+            Order.created_at >= _local_midnight(start),
+            Order.created_at < _local_midnight(end + timedelta(days=1)),
+        )
+
+    digits = query.value
+    conditions = []
+    if int(digits) <= INT_MAX:
+        conditions.append(Order.id == int(digits))
+    if len(digits) >= MIN_PHONE_DIGITS:
+        # Compare the local part only: the country code may be missing on either side
+        reversed_digits = digits[::-1][:LOCAL_PHONE_DIGITS]
+        phone = collate(PHONE_DIGITS_REVERSED, "C")
+        # Digit strings starting with the prefix sort before prefix + ":"
+        conditions.append(phone.between(reversed_digits, reversed_digits + ":"))
+    # Pickup codes may consist of digits only
+    code = normalize_pickup_code(digits)
+    if code:
+        conditions.append(Order.pickup_code == code)
+    return stmt.where(or_(*conditions)) if conditions else stmt.where(false())
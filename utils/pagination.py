@@ -0,0 +1,188 @@
+"""
+Keyset (cursor) pagination helpers.
+
+Lists are ordered newest first by ``(created_at, id)``. A page is fetched with
+``WHERE (created_at, id) < cursor`` instead of ``OFFSET``, so every page costs
+the same index range scan no matter how deep the user pages. Lists without a
+``created_at`` (admin user list) are ordered by id only, see ``fetch_id_page``.
+
+Cursors are short strings ("<microseconds>_<id>", or just "<id>") that fit
+into callback data.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import Select, func, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from utils.ttl_cache import TTLCache
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+NEXT = "n"  # older items
+PREV = "p"  # newer items
+
+
+def encode_cursor(created_at: datetime, item_id: int) -> str:
+    """
+    Encode a (created_at, id) position as a compact string.
+    """
+    micros = (created_at - EPOCH) // timedelta(microseconds=1)
+    return f"{micros}_{item_id}"
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decode a cursor made by ``encode_cursor``.
+
+    Raises:
+        ValueError: if the cursor is malformed
+    """
+    micros, item_id = cursor.split("_")
+    return EPOCH + timedelta(microseconds=int(micros)), int(item_id)
+
+
+@dataclass
+class Page:
+    """
+    One page of a keyset-paginated list with cursors for its neighbours.
+    """
+    items: List[Any]
+    prev_cursor: Optional[str]
+    next_cursor: Optional[str]
+
+
+async def fetch_page(
+    session: AsyncSession,
+    stmt: Select,
+    created_col,
+    id_col,
+    limit: int,
+    cursor: Optional[str] = None,
+    direction: str = NEXT,
+) -> Page:
+    """
+    Fetch one page of ``stmt`` (newest first) relative to ``cursor``.
+
+    Args:
+        stmt: Filtered select of ORM entities having ``created_at`` and ``id``
+        created_col, id_col: Ordering columns
+        limit: Page size
+        cursor: Position to page from, None for the first page
+        direction: NEXT for older items, PREV for newer items
+    """
+    key = tuple_(created_col, id_col)
+    if cursor is None:
+        direction = NEXT
+    elif direction == NEXT:
+        stmt = stmt.where(key < tuple_(*decode_cursor(cursor)))
+    else:
+        stmt = stmt.where(key > tuple_(*decode_cursor(cursor)))
+
+    if direction == NEXT:
+        stmt = stmt.order_by(created_col.desc(), id_col.desc())
+    else:
+        stmt = stmt.order_by(created_col.asc(), id_col.asc())
+
+    # One extra row tells whether there is another page in this direction
+    rows = list((await session.execute(stmt.limit(limit + 1))).scalars())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == PREV:
+        rows.reverse()
+
+    if not rows:
+        return Page(items=[], prev_cursor=None, next_cursor=None)
+
+    first = encode_cursor(rows[0].created_at, rows[0].id)
+    last = encode_cursor(rows[-1].created_at, rows[-1].id)
+    if direction == NEXT:
+        has_prev, has_next = cursor is not None, has_more
+    else:
+        has_prev, has_next = has_more, True
+
+    return Page(
+        items=rows,
+        prev_cursor=first if has_prev else None,
+        next_cursor=last if has_next else None,
+    )
+
+
+async def fetch_id_page(
+    session: AsyncSession,
+    stmt: Select,
+    id_col,
+    limit: int,
+    cursor: Optional[str] = None,
+    direction: str = NEXT,
+) -> Page:
+    """
+    Fetch one page of ``stmt`` ordered by ascending id relative to ``cursor``.
+
+    Args:
+        stmt: Filtered select of ORM entities having ``id``
+        id_col: Ordering column
+        limit: Page size
+        cursor: Id to page from (as a string), None for the first page
+        direction: NEXT for higher ids, PREV for lower ids
+    """
+    if cursor is None:
+        direction = NEXT
+    elif direction == NEXT:
+        stmt = stmt.where(id_col > int(cursor))
+    else:
+        stmt = stmt.where(id_col < int(cursor))
+
+    stmt = stmt.order_by(id_col.asc() if direction == NEXT else id_col.desc())
+
+    rows = list((await session.execute(stmt.limit(limit + 1))).scalars())
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if direction == PREV:
+        rows.reverse()
+
+    if not rows:
+        return Page(items=[], prev_cursor=None, next_cursor=None)
+
+    if direction == NEXT:
+        has_prev, has_next = cursor is not None, has_more
+    else:
+        has_prev, has_next = has_more, True
+
+    return Page(
+        items=rows,
+        prev_cursor=str(rows[0].id) if has_prev else None,
+        next_cursor=str(rows[-1].id) if has_next else None,
+    )
+
+
+# Below this many rows an exact count is cheap enough
+EXACT_COUNT_BELOW = 10_000
+
+_count_cache = TTLCache(ttl=60, max_size=64)
+
+
+async def estimated_count(session: AsyncSession, model) -> int:
+    """
+    Row count of ``model``'s table for "Jami: N" labels.
+
+    Uses the planner's estimate (``pg_class.reltuples``, kept current by
+    autovacuum/ANALYZE) for big tables and an exact count for small ones;
+    cached for a minute either way.
+    """
+    table = model.__table__.name
+    count = _count_cache.get(table)
+    if count is not None:
+        return count
+
+    count = await session.scalar(
+        text("SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(:table)"),
+        {"table": table},
+    )
+    # -1: never analyzed yet
+    if count is None or count < EXACT_COUNT_BELOW:
+        count = await session.scalar(select(func.count()).select_from(model))
+    count = int(count or 0)
+    _count_cache.set(table, count)
+    return count
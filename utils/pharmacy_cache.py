@@ -0,0 +1,107 @@
+"""
+Cached pharmacy details for the order flow.
+
+The order flow keeps only pharmacy ids (and distances) in FSM state and
+rehydrates names, addresses and coordinates from here. The active
+pharmacies are loaded with one query and kept for ``PHARMACY_CACHE_TTL``;
+any ORM insert, update or delete of a ``Pharmacy`` drops the cache when its
+transaction commits. Other worker processes see the change after the TTL.
+"""
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import object_session
+
+from database.db import async_session
+from database.models import Pharmacy
+from utils.config import PHARMACY_CACHE_TTL
+from utils.ttl_cache import TTLCache, pop_after_commit
+
+# Used when a pharmacy has no coordinates (Tashkent centre)
+DEFAULT_LOCATION = (41.2995, 69.2401)
+
+
+@dataclass(frozen=True)
+class PharmacyCard:
+    """
+    What the order flow shows about a pharmacy.
+    """
+    id: int
+    name: str
+    address: str
+    phone: str
+    latitude: Optional[float]
+    longitude: Optional[float]
+    tg_id: Optional[int]
+
+    @property
+    def location(self) -> tuple:
+        if self.latitude and self.longitude:
+            return float(self.latitude), float(self.longitude)
+        return DEFAULT_LOCATION
+
+    @property
+    def map_url(self) -> str:
+        return f"https://www.google.com/maps/search/?api=1&query={self.latitude},{self.longitude}"
+
+
+_cache = TTLCache(ttl=PHARMACY_CACHE_TTL, max_size=1)
+
+
+async def active_pharmacies() -> Dict[int, PharmacyCard]:
+    """
+    Active pharmacies by id, querying the database at most once per TTL.
+    """
+    cards = _cache.get("active")
+    if cards is not None:
+        return cards
+
+    generation = _cache.generation
+    async with async_session() as session:
+        rows = (await session.execute(
+            select(
+                Pharmacy.id, Pharmacy.name, Pharmacy.address, Pharmacy.phone,
+                Pharmacy.latitude, Pharmacy.longitude, Pharmacy.tg_id,
+            ).where(Pharmacy.is_active == True)
+        )).all()
+
+    cards = {
+        row.id: PharmacyCard(
+            id=row.id,
+            name=row.name,
+            address=row.address or "Manzil ko'rsatilmagan",
+            phone=row.phone or "",
+            latitude=row.latitude,
+            longitude=row.longitude,
+            tg_id=row.tg_id,
+        )
+        for row in rows
+    }
+    # Not cached if a pharmacy changed while they were being read
+    if _cache.generation == generation:
+        _cache.set("active", cards)
+    return cards
+
+
+async def get_pharmacies(ids: Iterable[int]) -> List[PharmacyCard]:
+    """
+    Cards of the given pharmacies in the given order; inactive ones are skipped.
+    """
+    cards = await active_pharmacies()
+    return [cards[pharmacy_id] for pharmacy_id in ids if pharmacy_id in cards]
+
+
+async def get_pharmacy(pharmacy_id: int) -> Optional[PharmacyCard]:
+    return (await active_pharmacies()).get(pharmacy_id)
+
+
+def invalidate_pharmacies():
+    _cache.clear()
+
+
+@event.listens_for(Pharmacy, "after_insert")
+@event.listens_for(Pharmacy, "after_update")
+@event.listens_for(Pharmacy, "after_delete")
+def _pharmacy_changed(mapper, connection, target):
+    pop_after_commit(object_session(target), _cache, "active")
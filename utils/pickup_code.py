@@ -0,0 +1,142 @@
+"""
+Pickup code generation and validation.
+
+A pickup code looks like ``PX-7KQ2MC``: five base32 characters derived from
+the ``pickup_code_seq`` database sequence plus one check character.
+
+- The sequence value is scrambled with a bijection over 32**5 values, so codes
+  never repeat for 33 million consecutive orders and are not guessable from
+  neighbouring orders.
+- The check character lets us reject any single mistyped character or swap
+  of neighbours without a database query. It is a weighted sum in GF(32), so
+  it stays within the 32 alphanumeric characters codes are made of (a plain
+  sum mod 31 could not tell 0 from Z).
+- The partial unique index ``uix_orders_active_pickup_code`` guards against
+  the (very unlikely) wrap-around case; ``add_order_with_pickup_code`` simply
+  retries with the next sequence value.
+"""
+import logging
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.models import Order, pickup_code_seq
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "PX-"
+# Crockford base32: no I, L, O, U, so codes are easy to read out loud
+ALPHABET = "0123456789ABCDEFGHJKMNPQRSTVWXYZ"
+BODY_LENGTH = 5
+CODE_SPACE = len(ALPHABET) ** BODY_LENGTH
+
+# Odd multiplier -> (n * MULTIPLIER + OFFSET) mod 2**25 is a bijection
+MULTIPLIER = 19_260_817
+OFFSET = 7_340_033
+
+MAX_ATTEMPTS = 3
+
+# Characters people commonly type instead of the Crockford ones
+_CONFUSABLES = str.maketrans({"O": "0", "I": "1", "L": "1", "U": "V"})
+
+# GF(32) = GF(2)[x] / (x^5 + x^2 + 1); weights are distinct non-zero powers of x
+_GF_MODULUS = 0b100101
+_WEIGHTS = (2, 4, 8, 16, 5)
+
+
+def _gf_multiply(a: int, b: int) -> int:
+    product = 0
+    while b:
+        if b & 1:
+            product ^= a
+        b >>= 1
+        a <<= 1
+        if a & 0b100000:
+            a ^= _GF_MODULUS
+    return product
+
+
+def _check_char(body: str) -> str:
+    """
+    Weighted checksum over the code body in GF(32). A field has no zero
+    divisors and neighbouring weights differ, so every single typo and swap
+    of neighbours changes it.
+    """
+    total = 0
+    for weight, ch in zip(_WEIGHTS, body):
+        total ^= _gf_multiply(weight, ALPHABET.index(ch))
+    return ALPHABET[total]
+
+
+def encode_pickup_code(number: int) -> str:
+    """
+    Turn a sequence number into a pickup code.
+    """
+    value = (number * MULTIPLIER + OFFSET) % CODE_SPACE
+    body = ""
+    for _ in range(BODY_LENGTH):
+        value, digit = divmod(value, len(ALPHABET))
+        body = ALPHABET[digit] + body
+    return f"{PREFIX}{body}{_check_char(body)}"
+
+
+def normalize_pickup_code(raw: str) -> Optional[str]:
+    """
+    Normalize user input ("px 7kq2mc", "7KQ2MC", ...) to the canonical form.
+
+    Returns:
+        Canonical code, or None if the input is not a valid pickup code
+    """
+    code = "".join(ch for ch in raw.upper() if ch.isalnum())
+    # A body may itself start with PX
+    if code.startswith("PX") and len(code) == len("PX") + BODY_LENGTH + 1:
+        code = code[2:]
+    code = code.translate(_CONFUSABLES)
+
+    if len(code) != BODY_LENGTH + 1 or any(ch not in ALPHABET for ch in code):
+        return None
+
+    body, check = code[:-1], code[-1]
+    if _check_char(body) != check:
+        return None
+    return f"{PREFIX}{code}"
+
+
+async def next_pickup_code(session: AsyncSession) -> str:
+    """
+    Reserve the next pickup code from the database sequence.
+    """
+    number = await session.scalar(select(pickup_code_seq.next_value()))
+    return encode_pickup_code(number)
+
+
+async def add_order_with_pickup_code(session: AsyncSession, order: Order) -> str:
+    """
+    Add a new order to the session with a pickup code unique among active orders.
+
+    Orders from the bot have no phone number yet, so the pickup code is also
+    used as the phone placeholder when none is given.
+
+    Returns:
+        The assigned pickup code
+    """
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        code = await next_pickup_code(session)
+        order.pickup_code = code
+        if not order.phone:
+            order.phone = code
+        try:
+            async with session.begin_nested():
+                session.add(order)
+                await session.flush()
+            return code
+        except IntegrityError as e:
+            if "uix_orders_active_pickup_code" not in str(e.orig):
+                raise
+            logger.warning(f"Pickup code {code} collided (attempt {attempt}), retrying")
+            if order.phone == code:
+                order.phone = None
+
+    raise RuntimeError("Could not allocate a unique pickup code")
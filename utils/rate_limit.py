@@ -0,0 +1,89 @@
+"""
+Rate limiting helpers for outgoing Telegram API calls.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Hashable
+
+
+class KeyedRateLimiter:
+    """
+    Allow at most one call per ``interval`` seconds for each key (e.g. chat id).
+
+    Slots are reserved in call order, so waiters for the same key keep FIFO order.
+    """
+
+    def __init__(self, interval: float, max_keys: int = 10_000):
+        self.interval = interval
+        self.max_keys = max_keys
+        self._next_slot: "OrderedDict[Hashable, float]" = OrderedDict()
+
+    async def wait(self, key: Hashable):
+        """
+        Sleep until the next free slot for ``key`` and reserve it.
+        """
+        now = time.monotonic()
+        slot = max(now, self._next_slot.get(key, 0.0))
+        self._reserve(key, slot + self.interval)
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def delay(self, key: Hashable) -> float:
+        """
+        Seconds until the next free slot for ``key``.
+        """
+        return max(0.0, self._next_slot.get(key, 0.0) - time.monotonic())
+
+    def penalize(self, key: Hashable, seconds: float):
+        """
+        Push the next slot for ``key`` back (after a 429 "retry after" answer).
+        """
+        until = time.monotonic() + seconds
+        self._reserve(key, max(until, self._next_slot.get(key, 0.0)))
+
+    def _reserve(self, key: Hashable, until: float):
+        self._next_slot[key] = until
+        self._next_slot.move_to_end(key)
+        # Forget the least recently used keys; their slots are long in the past
+        while len(self._next_slot) > self.max_keys:
+            self._next_slot.popitem(last=False)
+
+
+class TokenBucket:
+    """
+    Global rate limit: on average ``rate`` calls per second, with bursts of
+    up to ``capacity`` calls.
+
+    Waiters are served in call order.
+    """
+
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """
+        Sleep until a token is available and take it.
+        """
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+    def penalize(self, seconds: float):
+        """
+        Empty the bucket for ``seconds`` (after a 429 "retry after" answer).
+        """
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
@@ -0,0 +1,105 @@
+"""
+Render fingerprints: skip message edits that would not change anything.
+
+A fingerprint is a hash of the rendered text and the keyboard's button
+tuples, computed once per render; no pydantic ``model_dump`` or JSON.
+The last fingerprint sent to every (chat, message) is kept in an LRU, so
+"is this edit a no-op?" is one dict lookup.
+
+Messages are also edited by code that does not go through here. The cache
+therefore also remembers the keyboard it sent; a cached fingerprint is only
+trusted while the message (as Telegram delivered it with the callback)
+still carries that keyboard.
+"""
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+MessageKey = Tuple[int, int]  # (chat_id, message_id)
+
+
+def markup_fingerprint(reply_markup: Optional[types.InlineKeyboardMarkup]) -> int:
+    """
+    Hash of what a user sees and taps in an inline keyboard.
+    """
+    if reply_markup is None or not getattr(reply_markup, "inline_keyboard", None):
+        return 0
+    return hash(tuple(
+        tuple((button.text, button.callback_data, button.url) for button in row)
+        for row in reply_markup.inline_keyboard
+    ))
+
+
+def render_fingerprint(text: str, reply_markup: Optional[types.InlineKeyboardMarkup] = None) -> int:
+    return hash((text, markup_fingerprint(reply_markup)))
+
+
+class FingerprintCache:
+    """
+    Last rendered fingerprint per (chat, message), least recently used evicted.
+    """
+
+    def __init__(self, max_size: int = 10_000):
+        self.max_size = max_size
+        self._data: "OrderedDict[MessageKey, Tuple[int, int]]" = OrderedDict()
+
+    def matches(self, key: MessageKey, fingerprint: int) -> bool:
+        """
+        True if ``fingerprint`` is the last one rendered into the message.
+        """
+        entry = self._data.get(key)
+        return entry is not None and entry[0] == fingerprint
+
+    def unchanged(self, message: types.Message, fingerprint: int) -> bool:
+        """
+        Like ``matches``, but only if ``message`` still has the keyboard we
+        rendered, i.e. nothing else edited it since.
+        """
+        entry = self._data.get((message.chat.id, message.message_id))
+        return (
+            entry is not None
+            and entry[0] == fingerprint
+            and entry[1] == markup_fingerprint(message.reply_markup)
+        )
+
+    def remember(self, key: MessageKey, fingerprint: int,
+                 reply_markup: Optional[types.InlineKeyboardMarkup] = None):
+        self._data[key] = (fingerprint, markup_fingerprint(reply_markup))
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def forget(self, key: MessageKey):
+        self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+render_fingerprints = FingerprintCache()
+
+
+async def edit_if_changed(
+    message: types.Message,
+    text: str,
+    reply_markup: Optional[types.InlineKeyboardMarkup] = None,
+    parse_mode: Optional[str] = None,
+) -> bool:
+    """
+    ``message.edit_text`` unless the same content was rendered into it last.
+
+    Returns:
+        True if the message was edited
+    """
+    fingerprint = render_fingerprint(text, reply_markup)
+    if render_fingerprints.unchanged(message, fingerprint):
+        return False
+    try:
+        await message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            raise
+    render_fingerprints.remember((message.chat.id, message.message_id), fingerprint, reply_markup)
+    return True
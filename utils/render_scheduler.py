@@ -0,0 +1,142 @@
+"""
+Debounced, diff-aware message editing.
+
+Quantity taps in the cart re-render the same message many times per second.
+``RenderScheduler`` keeps only the latest render per (chat, message), applies
+it after a short window, skips it if the content did not change since the
+last edit (see utils/render_fingerprint.py) and spaces edits per chat to
+stay below Telegram's flood limits.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Dict, Optional, Tuple
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+from utils.config import CHAT_EDIT_INTERVAL, RENDER_DEBOUNCE
+from utils.rate_limit import KeyedRateLimiter
+from utils.render_fingerprint import FingerprintCache, render_fingerprint, render_fingerprints
+
+logger = logging.getLogger(__name__)
+
+MessageKey = Tuple[int, int]  # (chat_id, message_id)
+
+
+@dataclass
+class Render:
+    """
+    Content of a message edit.
+    """
+    message: types.Message
+    text: str
+    reply_markup: Optional[types.InlineKeyboardMarkup] = None
+    parse_mode: Optional[str] = None
+
+    def fingerprint(self) -> int:
+        return render_fingerprint(self.text, self.reply_markup)
+
+
+class RenderScheduler:
+    """
+    Coalesces edits per message and rate limits them per chat.
+    """
+
+    def __init__(self, window: float = RENDER_DEBOUNCE, chat_interval: float = CHAT_EDIT_INTERVAL,
+                 fingerprints: FingerprintCache = render_fingerprints):
+        self.window = window
+        self.fingerprints = fingerprints
+        self._limiter = KeyedRateLimiter(chat_interval)
+        self._pending: Dict[MessageKey, Render] = {}
+        self._timers: Dict[MessageKey, asyncio.Task] = {}
+
+    def schedule(
+        self,
+        message: types.Message,
+        text: str,
+        reply_markup: Optional[types.InlineKeyboardMarkup] = None,
+        parse_mode: Optional[str] = None,
+    ):
+        """
+        Queue an edit without waiting for it; only the latest render within
+        the debounce window is sent.
+        """
+        key = (message.chat.id, message.message_id)
+        self._pending[key] = Render(message, text, reply_markup, parse_mode)
+        if key not in self._timers:
+            self._timers[key] = asyncio.create_task(self._flush_later(key))
+
+    async def edit(
+        self,
+        message: types.Message,
+        text: str,
+        reply_markup: Optional[types.InlineKeyboardMarkup] = None,
+        parse_mode: Optional[str] = None,
+    ) -> bool:
+        """
+        Edit right away, rate limited per chat. A pending debounced render of
+        the same message is superseded.
+
+        The remembered fingerprint is only trusted while ``message`` still
+        has the keyboard we rendered: it may have been edited elsewhere since,
+        e.g. when navigating back to the cart.
+
+        Returns:
+            True if the message was edited
+        """
+        key = (message.chat.id, message.message_id)
+        self._pending.pop(key, None)
+        render = Render(message, text, reply_markup, parse_mode)
+        if self.fingerprints.unchanged(message, render.fingerprint()):
+            return False
+        return await self._apply(key, render, dedup=False)
+
+    async def _flush_later(self, key: MessageKey):
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self._timers.pop(key, None)
+        render = self._pending.pop(key, None)
+        if render:
+            try:
+                await self._apply(key, render)
+            except Exception as e:
+                logger.error(f"Error applying scheduled edit for {key}: {e}", exc_info=True)
+
+    async def _apply(self, key: MessageKey, render: Render, dedup: bool = True) -> bool:
+        fingerprint = render.fingerprint()
+        if dedup and self.fingerprints.matches(key, fingerprint):
+            return False
+
+        chat_id = key[0]
+        for _ in range(2):
+            await self._limiter.wait(chat_id)
+            # Re-check after waiting: an earlier render may have landed meanwhile
+            if dedup and self.fingerprints.matches(key, fingerprint):
+                return False
+            try:
+                await render.message.edit_text(
+                    render.text,
+                    reply_markup=render.reply_markup,
+                    parse_mode=render.parse_mode,
+                )
+                break
+            except TelegramRetryAfter as e:
+                logger.warning(f"Edit throttled in chat {chat_id}, retry after {e.retry_after}s")
+                self._limiter.penalize(chat_id, e.retry_after)
+                if key in self._pending:
+                    # A newer render is queued and will be sent instead
+                    return False
+            except TelegramBadRequest as e:
+                if "message is not modified" not in str(e):
+                    raise
+                break
+        else:
+            return False
+
+        self.fingerprints.remember(key, fingerprint, render.reply_markup)
+        return True
+
+
+render_scheduler = RenderScheduler()
@@ -0,0 +1,33 @@
+"""
+Startup timing.
+
+Import this module first in ``main.py``: its import time is the reference
+point for the marks below. ``FirstUpdateMiddleware`` records when the first
+update was handled and logs the whole breakdown once.
+"""
+import logging
+import time
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+STARTED_AT = time.perf_counter()
+_marks: Dict[str, float] = {}
+
+
+def mark(name: str):
+    """
+    Record how many seconds after start ``name`` happened (first call wins).
+    """
+    _marks.setdefault(name, time.perf_counter() - STARTED_AT)
+
+
+def marks() -> Dict[str, float]:
+    return dict(_marks)
+
+
+def report():
+    """
+    Log all marks, e.g. "imports=0.412s polling=0.655s first_update=1.020s".
+    """
+    logger.info("Startup: " + " ".join(f"{name}={seconds:.3f}s" for name, seconds in _marks.items()))
@@ -0,0 +1,234 @@
+"""
+Incrementally maintained pharmacy statistics.
+
+``pharmacy_daily_stats`` holds one row per pharmacy per day (the local day the
+order was created) with order counts by status and revenue of completed
+orders. Every order status change calls ``record_transition`` in the same
+transaction, so reading statistics costs O(days) instead of O(orders).
+
+Maintenance commands:
+    python -m utils.stats_rollup backfill [pharmacy_id]   rebuild from orders
+    python -m utils.stats_rollup check                    compare with orders
+"""
+import asyncio
+import sys
+from typing import Dict, Iterable, List, Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import Integer, delete, func, literal, select, text
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database.db import async_session
+from database.models import Order, PharmacyDailyStats
+from utils.config import TIMEZONE
+
+LOCAL_TZ = ZoneInfo(TIMEZONE)
+
+STATUSES = ("pending", "confirmed", "ready", "completed", "cancelled")
+COUNTERS = ("total",) + STATUSES + ("revenue",)
+
+
+def order_day():
+    """
+    Local calendar day an order was created on (SQL expression).
+    """
+    return func.date(func.timezone(TIMEZONE, Order.created_at))
+
+
+async def record_transition(
+    session: AsyncSession,
+    order_id: int,
+    old_status: Optional[str],
+    new_status: Optional[str],
+):
+    """
+    Apply one order transition to the rollup in a single upsert.
+
+    Args:
+        old_status: Previous status, None when the order was just created
+        new_status: New status, None when the order is about to be deleted
+    """
+    deltas = dict.fromkeys(COUNTERS, 0)
+    if old_status is None:
+        deltas["total"] += 1
+    else:
+        deltas[old_status] -= 1
+    if new_status is None:
+        deltas["total"] -= 1
+    else:
+        deltas[new_status] += 1
+
+    revenue_sign = (new_status == "completed") - (old_status == "completed")
+
+    columns = [literal(deltas[name], Integer).label(name) for name in COUNTERS if name != "revenue"]
+    columns.append((func.coalesce(Order.total_amount, 0) * revenue_sign).label("revenue"))
+
+    source = (
+        select(Order.pharmacy_id, order_day().label("day"), *columns)
+        .where(Order.id == order_id, Order.pharmacy_id.isnot(None))
+    )
+    stmt = insert(PharmacyDailyStats).from_select(["pharmacy_id", "day", *COUNTERS], source)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PharmacyDailyStats.pharmacy_id, PharmacyDailyStats.day],
+        set_={
+            name: getattr(PharmacyDailyStats, name) + getattr(stmt.excluded, name)
+            for name in COUNTERS
+        },
+    )
+    await session.execute(stmt)
+
+
+async def record_transitions(session: AsyncSession, rows: Iterable, new_status: Optional[str]):
+    """
+    Apply many transitions to ``new_status`` in one upsert (bulk admin
+    updates). Deltas are summed per pharmacy and day in Python first.
+
+    Args:
+        rows: Changed orders with ``pharmacy_id``, ``created_at``,
+            ``total_amount`` and ``old_status`` (None for new orders)
+        new_status: None when the orders are about to be deleted
+    """
+    deltas: Dict[tuple, Dict[str, int]] = {}
+    for row in rows:
+        if row.pharmacy_id is None:
+            continue
+        day = row.created_at.astimezone(LOCAL_TZ).date()
+        counters = deltas.setdefault((row.pharmacy_id, day), dict.fromkeys(COUNTERS, 0))
+        if row.old_status is None:
+            counters["total"] += 1
+        else:
+            counters[row.old_status] -= 1
+        if new_status is None:
+            counters["total"] -= 1
+        else:
+            counters[new_status] += 1
+        revenue_sign = (new_status == "completed") - (row.old_status == "completed")
+        counters["revenue"] += (row.total_amount or 0) * revenue_sign
+
+    if not deltas:
+        return
+    stmt = insert(PharmacyDailyStats).values([
+        {"pharmacy_id": pharmacy_id, "day": day, **counters}
+        for (pharmacy_id, day), counters in deltas.items()
+    ])
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PharmacyDailyStats.pharmacy_id, PharmacyDailyStats.day],
+        set_={
+            name: getattr(PharmacyDailyStats, name) + getattr(stmt.excluded, name)
+            for name in COUNTERS
+        },
+    )
+    await session.execute(stmt)
+
+
+async def pharmacy_totals(session: AsyncSession, pharmacy_id: int):
+    """
+    All-time counters of one pharmacy, summed over its daily rows.
+    """
+    result = await session.execute(
+        select(
+            *(func.coalesce(func.sum(getattr(PharmacyDailyStats, name)), 0).label(name)
+              for name in COUNTERS)
+        ).where(PharmacyDailyStats.pharmacy_id == pharmacy_id)
+    )
+    return result.one()
+
+
+def _raw_rollup():
+    """
+    The rollup computed from scratch from the orders table.
+    """
+    return (
+        select(
+            Order.pharmacy_id,
+            order_day().label("day"),
+            func.count(Order.id).label("total"),
+            *(func.count(Order.id).filter(Order.status == status).label(status) for status in STATUSES),
+            func.coalesce(
+                func.sum(Order.total_amount).filter(Order.status == "completed"), 0
+            ).label("revenue"),
+        )
+        .where(Order.pharmacy_id.isnot(None))
+        # Group by the label: a repeated expression would get its own bind parameter
+        .group_by(Order.pharmacy_id, "day")
+    )
+
+
+async def backfill(pharmacy_id: Optional[int] = None) -> int:
+    """
+    Rebuild the rollup from the orders table.
+
+    Returns:
+        Number of (pharmacy, day) rows written
+    """
+    source = _raw_rollup()
+    cleanup = delete(PharmacyDailyStats)
+    if pharmacy_id is not None:
+        source = source.where(Order.pharmacy_id == pharmacy_id)
+        cleanup = cleanup.where(PharmacyDailyStats.pharmacy_id == pharmacy_id)
+
+    async with async_session() as session:
+        # Concurrent transitions wait for us, so none is lost or counted twice
+        await session.execute(text("LOCK TABLE pharmacy_daily_stats IN EXCLUSIVE MODE"))
+        await session.execute(cleanup)
+        result = await session.execute(
+            insert(PharmacyDailyStats).from_select(["pharmacy_id", "day", *COUNTERS], source)
+        )
+        await session.commit()
+    return result.rowcount
+
+
+async def check_consistency() -> List[dict]:
+    """
+    Compare the rollup with the orders table.
+
+    Returns:
+        Mismatching (pharmacy, day) rows with both versions of the counters
+    """
+    raw = _raw_rollup().subquery("raw")
+    rollup = PharmacyDailyStats.__table__
+
+    join_on = (raw.c.pharmacy_id == rollup.c.pharmacy_id) & (raw.c.day == rollup.c.day)
+    differs = None
+    for name in COUNTERS:
+        condition = func.coalesce(raw.c[name], 0) != func.coalesce(rollup.c[name], 0)
+        differs = condition if differs is None else differs | condition
+
+    stmt = (
+        select(
+            func.coalesce(raw.c.pharmacy_id, rollup.c.pharmacy_id).label("pharmacy_id"),
+            func.coalesce(raw.c.day, rollup.c.day).label("day"),
+            *(raw.c[name].label(f"raw_{name}") for name in COUNTERS),
+            *(rollup.c[name].label(f"rollup_{name}") for name in COUNTERS),
+        )
+        .select_from(raw.join(rollup, join_on, full=True))
+        .where(differs)
+        .order_by("pharmacy_id", "day")
+    )
+    async with async_session() as session:
+        result = await session.execute(stmt)
+        return [dict(row._mapping) for row in result]
+
+
+async def _main(argv: List[str]):
+    command = argv[0] if argv else "check"
+    if command == "backfill":
+        pharmacy_id = int(argv[1]) if len(argv) > 1 else None
+        rows = await backfill(pharmacy_id)
+        print(f"✅ {rows} ta kunlik statistika qatori qayta hisoblandi.")
+    elif command == "check":
+        mismatches = await check_consistency()
+        for row in mismatches:
+            print(row)
+        if mismatches:
+            print(f"❌ {len(mismatches)} ta nomuvofiq qator topildi. 'backfill' ni ishga tushiring.")
+            sys.exit(1)
+        print("✅ Statistika buyurtmalar jadvali bilan mos.")
+    else:
+        print(__doc__)
+        sys.exit(2)
+
+
+if __name__ == "__main__":
+    asyncio.run(_main(sys.argv[1:]))
@@ -0,0 +1,439 @@
+"""
+Pharmacy stock feeds: ``pharmacy_drugs.residual`` and ``price`` from the
+pharmacies' own inventory systems.
+
+A feed lists (drug_id, residual, price) for one pharmacy; ``drug_id`` is
+the catalog API id (``drugs.drug_id``), as in catalog imports. An empty
+price keeps the stored one.
+- ``full`` feed: the complete stock; rows missing from it are deleted;
+- ``delta`` feed: only changed items; an item with ``"deleted": true``
+  (or a ``deleted`` CSV column set to 1/true) is deleted.
+
+A feed is applied in one transaction holding the pharmacy's advisory lock,
+with three set-based statements whatever its size: the items are passed as
+arrays and expanded with ``unnest`` on the server, joined to ``drugs``,
+upserted (rows whose values did not change are not rewritten) and deleted.
+
+Feeds arrive over HTTP (``POST {FEED_PATH}/{pharmacy_id}``, bearer
+``FEED_TOKEN``, JSON or CSV) or as files in ``FEED_DROP_DIR`` named
+``<pharmacy_id>_<full|delta>[_anything].<json|csv>``. A truncated ``full``
+feed would delete the stock after the cut-off, so files must be written
+under another name (``*.part``, ``*.tmp`` or a leading dot) and renamed into
+place; as a safety net a file is only picked up once it is
+``FEED_MIN_AGE`` seconds old.
+"""
+import asyncio
+import csv
+import hmac
+import io
+import json
+import logging
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from aiohttp import web
+from sqlalchemy import Integer, bindparam, text
+from sqlalchemy.dialects.postgresql import ARRAY
+
+from database.db import async_session
+from utils.config import (
+    FEED_CONCURRENCY,
+    FEED_DROP_DIR,
+    FEED_MAX_BYTES,
+    FEED_MIN_AGE,
+    FEED_PATH,
+    FEED_POLL_INTERVAL,
+    FEED_TOKEN,
+)
+
+logger = logging.getLogger(__name__)
+
+FULL, DELTA = "full", "delta"
+
+# First key of the per-pharmacy advisory lock
+FEED_LOCK_NAMESPACE = 4_510
+
+MAX_REPORTED_UNKNOWN = 20
+
+# Values are stored in integer columns
+INT_MAX = 2 ** 31 - 1
+
+# (drug_id, residual or None to delete, price or None to keep)
+FeedItem = Tuple[int, Optional[int], Optional[int]]
+
+
+class FeedError(ValueError):
+    """
+    The feed is malformed.
+    """
+
+
+@dataclass
+class FeedResult:
+    pharmacy_id: int
+    mode: str
+    items: int = 0
+    inserted: int = 0
+    updated: int = 0
+    unchanged: int = 0
+    deleted: int = 0
+    unknown_count: int = 0
+    unknown: List[int] = field(default_factory=list)  # sample of unknown drug ids
+    seconds: float = 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "pharmacy_id": self.pharmacy_id,
+            "mode": self.mode,
+            "items": self.items,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "unchanged": self.unchanged,
+            "deleted": self.deleted,
+            "unknown": self.unknown_count,
+            "unknown_drug_ids": self.unknown,
+        }
+
+
+# ---------- parsing ----------
+
+def _number(value, name: str, allow_none: bool = True) -> Optional[int]:
+    if value is None or value == "":
+        if allow_none:
+            return None
+        raise FeedError(f"{name} is required")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise FeedError(f"{name} is not a number: {value!r}")
+    if not math.isfinite(number):
+        raise FeedError(f"{name} is not a number: {value!r}")
+    if number < 0:
+        raise FeedError(f"{name} is negative: {value!r}")
+    if number > INT_MAX:
+        raise FeedError(f"{name} is too large: {value!r}")
+    return int(number)
+
+
+def _item(raw: dict) -> FeedItem:
+    drug_id = _number(raw.get("drug_id"), "drug_id", allow_none=False)
+    deleted = str(raw.get("deleted", "")).lower() in ("1", "true", "yes")
+    residual = None if deleted else _number(raw.get("residual"), "residual", allow_none=False)
+    return drug_id, residual, _number(raw.get("price"), "price")
+
+
+def parse_json(body: bytes) -> Tuple[Optional[str], List[FeedItem]]:
+    """
+    ``{"mode": "full", "items": [{"drug_id": 1, "residual": 5, "price": 12000}]}``
+    or just the items list.
+    """
+    try:
+        data = json.loads(body)
+    except ValueError as e:
+        raise FeedError(f"invalid JSON: {e}")
+    mode = None
+    if isinstance(data, dict):
+        mode = data.get("mode")
+        data = data.get("items")
+    if not isinstance(data, list):
+        raise FeedError("items must be a list")
+    return mode, [_item(raw) for raw in data if isinstance(raw, dict)]
+
+
+def parse_csv(body: bytes) -> List[FeedItem]:
+    """
+    Header row with ``drug_id``, ``residual`` and optionally ``price`` / ``deleted``.
+    """
+    reader = csv.DictReader(io.StringIO(body.decode("utf-8-sig")))
+    if not reader.fieldnames or "drug_id" not in [name.strip().lower() for name in reader.fieldnames]:
+        raise FeedError("CSV needs a drug_id column")
+    items = []
+    for raw in reader:
+        raw = {(key or "").strip().lower(): (value or "").strip() for key, value in raw.items()}
+        if raw.get("drug_id"):
+            items.append(_item(raw))
+    return items
+
+
+def parse_feed(body: bytes, content_type: str, mode: Optional[str]) -> Tuple[str, List[FeedItem]]:
+    """
+    Parse a JSON or CSV feed body; the mode comes from the body or ``mode``.
+
+    Raises:
+        FeedError: if the body or the mode is invalid
+    """
+    if "csv" in content_type:
+        items = parse_csv(body)
+    else:
+        body_mode, items = parse_json(body)
+        mode = body_mode or mode
+    mode = (mode or DELTA).lower()
+    if mode not in (FULL, DELTA):
+        raise FeedError(f"mode must be {FULL} or {DELTA}")
+    return mode, items
+
+
+# ---------- ingestion ----------
+
+_ARRAYS = (
+    bindparam("drug_ids", type_=ARRAY(Integer)),
+    bindparam("residuals", type_=ARRAY(Integer)),
+    bindparam("prices", type_=ARRAY(Integer)),
+)
+
+_FEED = (
+    "SELECT d.id AS drug_id, f.residual, f.price "
+    "FROM unnest(:drug_ids, :residuals, :prices) "
+    "AS f(api_id, residual, price) "
+    "JOIN drugs d ON d.drug_id = f.api_id"
+)
+
+_UPSERT = text(
+    "INSERT INTO pharmacy_drugs (pharmacy_id, drug_id, residual, price) "
+    f"SELECT CAST(:pharmacy_id AS integer), feed.drug_id, feed.residual, feed.price FROM ({_FEED}) AS feed "
+    "WHERE feed.residual IS NOT NULL "
+    "ON CONFLICT ON CONSTRAINT uix_pharmacy_drug DO UPDATE SET "
+    " residual = excluded.residual,"
+    " price = coalesce(excluded.price, pharmacy_drugs.price) "
+    "WHERE pharmacy_drugs.residual IS DISTINCT FROM excluded.residual"
+    " OR pharmacy_drugs.price IS DISTINCT FROM coalesce(excluded.price, pharmacy_drugs.price) "
+    # xmax is 0 for freshly inserted rows
+    "RETURNING (xmax = 0) AS inserted"
+).bindparams(*_ARRAYS)
+
+# Delta feeds: deleted items
+_DELETE_LISTED = text(
+    "DELETE FROM pharmacy_drugs pd USING drugs d "
+    "WHERE pd.pharmacy_id = :pharmacy_id AND pd.drug_id = d.id "
+    "AND d.drug_id = ANY(:drug_ids)"
+).bindparams(bindparam("drug_ids", type_=ARRAY(Integer)))
+
+# Full feeds: everything not in the feed
+_DELETE_MISSING = text(
+    "DELETE FROM pharmacy_drugs pd "
+    "WHERE pd.pharmacy_id = :pharmacy_id AND NOT EXISTS ("
+    " SELECT 1 FROM drugs d WHERE d.id = pd.drug_id AND d.drug_id = ANY(:drug_ids))"
+).bindparams(bindparam("drug_ids", type_=ARRAY(Integer)))
+
+# Stocked feed items whose drug is not in the catalog: total count and a sample
+_UNKNOWN = text(
+    "SELECT count(*) OVER () AS total, f.api_id FROM unnest(:drug_ids) AS f(api_id) "
+    "WHERE NOT EXISTS (SELECT 1 FROM drugs d WHERE d.drug_id = f.api_id) "
+    f"LIMIT {MAX_REPORTED_UNKNOWN}"
+).bindparams(bindparam("drug_ids", type_=ARRAY(Integer)))
+
+
+def _dedupe(items: Iterable[FeedItem]) -> Dict[int, FeedItem]:
+    # ON CONFLICT cannot touch a row twice in one statement: last item wins
+    return {item[0]: item for item in items}
+
+
+async def ingest_feed(pharmacy_id: int, mode: str, items: Iterable[FeedItem]) -> FeedResult:
+    """
+    Apply one pharmacy's feed in a single transaction.
+    """
+    started = time.perf_counter()
+    unique = _dedupe(items)
+    result = FeedResult(pharmacy_id=pharmacy_id, mode=mode, items=len(unique))
+
+    kept = [item for item in unique.values() if item[1] is not None]
+    removed = [item[0] for item in unique.values() if item[1] is None]
+    if mode == FULL and not kept:
+        # Most likely a broken export; would delete the whole stock
+        raise FeedError("full feed without items")
+
+    async with async_session() as session:
+        await session.execute(
+            text("SELECT pg_advisory_xact_lock(:ns, :id)"),
+            {"ns": FEED_LOCK_NAMESPACE, "id": pharmacy_id},
+        )
+        exists = await session.scalar(
+            text("SELECT EXISTS (SELECT 1 FROM pharmacies WHERE id = :id)"), {"id": pharmacy_id}
+        )
+        if not exists:
+            raise FeedError(f"pharmacy {pharmacy_id} not found")
+
+        if kept:
+            rows = (await session.execute(_UPSERT, {
+                "pharmacy_id": pharmacy_id,
+                "drug_ids": [item[0] for item in kept],
+                "residuals": [item[1] for item in kept],
+                "prices": [item[2] for item in kept],
+            })).scalars().all()
+            result.inserted = sum(1 for inserted in rows if inserted)
+            result.updated = len(rows) - result.inserted
+
+        if mode == FULL:
+            deleted = await session.execute(
+                _DELETE_MISSING, {"pharmacy_id": pharmacy_id, "drug_ids": [item[0] for item in kept]}
+            )
+            result.deleted = deleted.rowcount
+        elif removed:
+            deleted = await session.execute(
+                _DELETE_LISTED, {"pharmacy_id": pharmacy_id, "drug_ids": removed}
+            )
+            result.deleted = deleted.rowcount
+
+        if kept:
+            unknown = (await session.execute(_UNKNOWN, {"drug_ids": [item[0] for item in kept]})).all()
+            result.unknown = [row.api_id for row in unknown]
+            result.unknown_count = unknown[0].total if unknown else 0
+        await session.commit()
+
+    result.unchanged = len(kept) - result.inserted - result.updated - result.unknown_count
+    result.seconds = time.perf_counter() - started
+    logger.info(
+        f"Stock feed ({mode}) for pharmacy {pharmacy_id}: {result.items} items, "
+        f"+{result.inserted} ~{result.updated} -{result.deleted} ={result.unchanged}, "
+        f"{result.unknown_count} unknown drugs, {result.seconds * 1000:.0f} ms"
+    )
+    return result
+
+
+# ---------- HTTP endpoint ----------
+
+async def handle_feed_request(request: web.Request) -> web.Response:
+    """
+    ``POST {FEED_PATH}/{pharmacy_id}?mode=full|delta`` with a JSON or CSV body.
+    """
+    authorization = request.headers.get("Authorization", "").encode()
+    if not hmac.compare_digest(authorization, f"Bearer {FEED_TOKEN}".encode()):
+        return web.json_response({"error": "unauthorized"}, status=401)
+    try:
+        pharmacy_id = int(request.match_info["pharmacy_id"])
+        body = await request.read()
+        mode, items = await asyncio.to_thread(
+            parse_feed, body, request.content_type, request.query.get("mode")
+        )
+        result = await ingest_feed(pharmacy_id, mode, items)
+    except (FeedError, ValueError) as e:
+        return web.json_response({"error": str(e)}, status=400)
+    return web.json_response(result.as_dict())
+
+
+def setup_feed_routes(app: web.Application) -> bool:
+    """
+    Register the feed endpoint on ``app``; disabled without ``FEED_TOKEN``.
+    """
+    if not FEED_TOKEN:
+        return False
+    app.router.add_post(FEED_PATH.rstrip("/") + "/{pharmacy_id}", handle_feed_request)
+    return True
+
+
+def feed_app() -> web.Application:
+    """
+    aiohttp application for feeds (and the webhook, when enabled).
+    """
+    return web.Application(client_max_size=FEED_MAX_BYTES)
+
+
+# ---------- file drop ----------
+
+class FeedDropWatcher:
+    """
+    Ingests feed files dropped into ``FEED_DROP_DIR``.
+
+    Only complete files are taken: names ending in ``.json``/``.csv`` (so
+    ``*.part``/``*.tmp`` are skipped), not starting with a dot, and not
+    modified for ``FEED_MIN_AGE`` seconds. A file is claimed by renaming it
+    into ``processing/`` (atomic, so with several workers exactly one takes
+    it), then moved to ``done/`` or ``failed/`` (with a ``.error`` note next
+    to it).
+    """
+
+    def __init__(self, directory: str = FEED_DROP_DIR, interval: float = FEED_POLL_INTERVAL,
+                 concurrency: int = FEED_CONCURRENCY, min_age: float = FEED_MIN_AGE):
+        self.directory = directory
+        self.interval = interval
+        self.min_age = min_age
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        for sub in ("processing", "done", "failed"):
+            os.makedirs(os.path.join(self.directory, sub), exist_ok=True)
+        self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.scan()
+            except Exception as e:
+                logger.error(f"Stock feed scan failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def scan(self) -> List[FeedResult]:
+        """
+        Ingest every complete feed file currently in the directory.
+        """
+        names = sorted(name for name in os.listdir(self.directory) if self._is_complete(name))
+        results = await asyncio.gather(*(self._ingest_file(name) for name in names))
+        return [result for result in results if result]
+
+    def _is_complete(self, name: str) -> bool:
+        if name.startswith(".") or not name.lower().endswith((".json", ".csv")):
+            return False
+        try:
+            modified = os.stat(os.path.join(self.directory, name)).st_mtime
+        except OSError:
+            return False  # renamed meanwhile
+        # Still being written by a writer that does not rename into place
+        return time.time() - modified >= self.min_age
+
+    @staticmethod
+    def parse_name(name: str) -> Tuple[int, str]:
+        """
+        ``12_full_2024-05-01.csv`` -> (12, "full").
+
+        Raises:
+            FeedError: if the name does not follow the convention
+        """
+        parts = os.path.splitext(name)[0].split("_")
+        if len(parts) < 2 or not parts[0].isdigit() or parts[1].lower() not in (FULL, DELTA):
+            raise FeedError(f"file name must be <pharmacy_id>_<{FULL}|{DELTA}>[_...]: {name}")
+        return int(parts[0]), parts[1].lower()
+
+    async def _ingest_file(self, name: str) -> Optional[FeedResult]:
+        source = os.path.join(self.directory, name)
+        claimed = os.path.join(self.directory, "processing", name)
+        try:
+            os.rename(source, claimed)
+        except OSError:
+            return None  # taken by another worker
+
+        async with self._semaphore:
+            try:
+                pharmacy_id, mode = self.parse_name(name)
+                content_type = "text/csv" if name.lower().endswith(".csv") else "application/json"
+
+                def read():
+                    with open(claimed, "rb") as f:
+                        return parse_feed(f.read(), content_type, mode)
+
+                mode, items = await asyncio.to_thread(read)
+                result = await ingest_feed(pharmacy_id, mode, items)
+            except Exception as e:
+                logger.warning(f"Stock feed file {name} failed: {e}")
+                os.replace(claimed, os.path.join(self.directory, "failed", name))
+                with open(os.path.join(self.directory, "failed", name + ".error"), "w") as f:
+                    f.write(str(e))
+                return None
+
+        os.replace(claimed, os.path.join(self.directory, "done", name))
+        return result
+
+
+feed_watcher = FeedDropWatcher()
@@ -0,0 +1,88 @@
+"""
+Small in-process TTL cache.
+
+Caches of database rows are invalidated with ``pop_after_commit`` from ORM
+events: the entry is dropped once the transaction commits (not at flush, and
+not at all on rollback). A reader that loaded the old row before the commit
+checks ``generation`` and does not store it. Other processes are not told:
+there an entry stays stale until it expires.
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    LRU cache whose entries expire ``ttl`` seconds after being set.
+    """
+
+    def __init__(self, ttl: float, max_size: int = 10_000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self.generation = 0  # bumped by every invalidation
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        Return the cached value, or ``default`` if missing or expired.
+        """
+        entry = self._data.get(key, _MISSING)
+        if entry is _MISSING:
+            return default
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        """
+        Store a value, evicting the least recently used entries when full.
+        """
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable):
+        """
+        Remove a key if present.
+        """
+        self.generation += 1
+        self._data.pop(key, None)
+
+    def clear(self):
+        self.generation += 1
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def pop_after_commit(session: Optional[Session], cache: TTLCache, key: Hashable):
+    """
+    Remove ``key`` from ``cache`` when ``session`` commits; forgotten if it
+    rolls back. Without a session the key is removed at once.
+    """
+    if session is None:
+        cache.pop(key)
+        return
+    session.info.setdefault("ttl_cache_pops", []).append((cache, key))
+
+
+@event.listens_for(Session, "after_commit")
+def _pop_committed(session: Session):
+    for cache, key in session.info.pop("ttl_cache_pops", ()):
+        cache.pop(key)
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_pops(session: Session):
+    session.info.pop("ttl_cache_pops", None)
@@ -0,0 +1,97 @@
+"""
+Admin user search.
+
+One query over ``telegram_id``, ``phone_number``, ``username`` and
+``fullname``, every branch backed by an index (migration 7):
+- telegram id: exact match on the unique index;
+- phone: digits only, matched as a suffix, so "+998 90 123-45-67",
+  "901234567" and "1234567" all find the same user. The index is on the
+  reversed digits, which turns the suffix into a prefix range;
+- username and full name: substring and fuzzy (typo tolerant) matches on
+  pg_trgm GIN indexes over the lower-cased values.
+
+Results are ranked: exact id / phone, exact username, prefix, substring,
+then by trigram similarity.
+"""
+import re
+from typing import List
+
+from sqlalchemy import case, collate, func, literal_column, or_, select
+
+from database.db import async_session
+from database.models import User
+
+SEARCH_LIMIT = 10
+# Shorter digit strings match too many phone numbers
+MIN_PHONE_DIGITS = 4
+MIN_NAME_LENGTH = 2
+# Local part of an Uzbek number (operator code + subscriber), without 998
+LOCAL_PHONE_DIGITS = 9
+
+# Must stay identical to the expression of ix_users_phone_digits_rev
+PHONE_DIGITS_REVERSED = literal_column(r"reverse(regexp_replace(users.phone_number, '\D', '', 'g'))")
+
+BIGINT_MAX = 2 ** 63 - 1
+
+_NUMERIC_QUERY = re.compile(r"^[\d\s()+\-]+$")
+
+
+def _escape_like(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def build_search_query(query: str, limit: int = SEARCH_LIMIT):
+    """
+    Ranked search statement, or None if the query is too short to search.
+    """
+    query = query.strip()
+    conditions, ranks = [], []
+
+    digits = re.sub(r"\D", "", query)
+    if _NUMERIC_QUERY.match(query) and len(digits) >= MIN_PHONE_DIGITS:
+        if int(digits) <= BIGINT_MAX:
+            conditions.append(User.telegram_id == int(digits))
+            ranks.append((User.telegram_id == int(digits), 0))
+
+        # Compare the local part only: the country code may be missing on either side
+        reversed_digits = digits[::-1][:LOCAL_PHONE_DIGITS]
+        phone = collate(PHONE_DIGITS_REVERSED, "C")
+        # Digit strings starting with the prefix sort before prefix + ":"
+        conditions.append(phone.between(reversed_digits, reversed_digits + ":"))
+        ranks.append((phone == reversed_digits, 1))
+        ranks.append((phone.between(reversed_digits, reversed_digits + ":"), 2))
+        order_by = [case(*ranks, else_=4), User.id]
+    else:
+        name = query.lstrip("@").lower()
+        if len(name) < MIN_NAME_LENGTH:
+            return None
+
+        username = func.lower(User.username)
+        fullname = func.lower(User.fullname)
+        contains = f"%{_escape_like(name)}%"
+        prefix = f"{_escape_like(name)}%"
+
+        conditions += [
+            username.like(contains),
+            fullname.like(contains),
+            fullname.op("%")(name),  # trigram similarity above pg_trgm.similarity_threshold
+        ]
+        ranks += [
+            (username == name, 1),
+            (or_(username.like(prefix), fullname.like(prefix)), 2),
+            (or_(username.like(contains), fullname.like(contains)), 3),
+        ]
+        order_by = [case(*ranks, else_=4), func.similarity(fullname, name).desc(), User.id]
+
+    return select(User).where(or_(*conditions)).order_by(*order_by).limit(limit)
+
+
+async def search_users(query: str, limit: int = SEARCH_LIMIT) -> List[User]:
+    """
+    Best matching users, best first; empty if the query is too short.
+    """
+    stmt = build_search_query(query, limit)
+    if stmt is None:
+        return []
+    async with async_session() as session:
+        return list((await session.execute(stmt)).scalars().all())